@@ -0,0 +1,437 @@
+"""
+التحكم في قبول الطلبات التي تحتاج النموذج (Groq) حتى لا يستهلك عميل واحد كل شيء.
+
+قبل استدعاء النموذج:
+1. token bucket لكل جلسة ولكل IP: إذا نفد الرصيد يرفض الطلب فوراً بـ 429
+   و Retry-After حتى توفر توكن
+2. حد عام لعدد استدعاءات النموذج المتزامنة (لكل العمليات على نفس الجهاز):
+   إذا امتلأ ينتظر الطلب في طابور محدود الحجم حتى ADMISSION_QUEUE_TIMEOUT،
+   وإذا امتلأ الطابور أو انتهت المهلة يرفض بـ 503 و Retry-After
+
+الردود المحلية (الفريق، التحية) وردود الكاش لا تمر من هنا.
+
+/chat/batch يدفع الخطوة 1 مرة واحدة للطلب كله (check_rate: توكن واحد من bucket
+الـ IP ومن bucket كل جلسة فيه، معاً أو لا شيء)، ثم تمر رسائله بالخطوة 2 فقط
+(acquire بـ rate_checked=True).
+
+الحالة في SQLite مشترك بين عمليات gunicorn (ADMISSION_BACKEND=sqlite، الافتراضي)
+أو في الذاكرة لعملية واحدة (memory). أماكن العمليات المنتهية بدون تحرير تُستعاد
+تلقائياً (كل مكان مسجل برقم العملية). الانتظار في الطابور بفحص دوري بتأخير
+متزايد، فالترتيب تقريبي وليس FIFO صارماً.
+"""
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from metrics import pid_alive
+
+ADMITTED, QUEUED, WAIT, FULL = "admitted", "queued", "wait", "full"
+
+
+class Rejected(Exception):
+    def __init__(self, status, retry_after, reason):
+        super().__init__(f"{reason} (retry after {retry_after}s)")
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def refill(tokens, updated, rate, burst, now):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+# ====== الحالة في الذاكرة ======
+class MemoryAdmissionState:
+    shared = False
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> [tokens, updated]
+        self.active = 0
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def take(self, buckets, now):
+        """استهلاك توكن من كل bucket معاً، أو إرجاع ثواني الانتظار بدون استهلاك شيء"""
+        with self.lock:
+            levels = []
+            wait = 0.0
+            for key, rate, burst in buckets:
+                state = self.buckets.get(key)
+                tokens = burst if state is None else refill(state[0], state[1], rate, burst, now)
+                levels.append((key, tokens))
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+            if wait:
+                return wait
+
+            for key, tokens in levels:
+                self.buckets[key] = [tokens - 1, now]
+                self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return 0.0
+
+    def acquire(self, limit, queue_size, queued):
+        with self.lock:
+            # القادم الجديد لا يتجاوز من ينتظر في الطابور
+            if self.active < limit and (queued or self.waiting == 0):
+                self.active += 1
+                if queued:
+                    self.waiting -= 1
+                return ADMITTED
+            if queued:
+                return WAIT
+            if self.waiting < queue_size:
+                self.waiting += 1
+                return QUEUED
+            return FULL
+
+    def leave_queue(self):
+        with self.lock:
+            self.waiting -= 1
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+    def prune(self, cutoff):
+        """الـ buckets التي لم تستخدم منذ cutoff ممتلئة على أي حال"""
+        with self.lock:
+            while self.buckets:
+                key, state = next(iter(self.buckets.items()))
+                if state[1] >= cutoff:
+                    break
+                del self.buckets[key]
+
+    def stats(self):
+        with self.lock:
+            return {"active": self.active, "waiting": self.waiting, "buckets": len(self.buckets)}
+
+
+# ====== الحالة المشتركة بين العمليات ======
+class SQLiteAdmissionState:
+    shared = True
+
+    # أقل مدة بين عمليتي بحث عن أماكن عمليات منتهية
+    REAP_INTERVAL = 5.0
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.reaped_at = 0.0
+
+        db = self._connection()
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated);
+            CREATE TABLE IF NOT EXISTS holders (
+                pid INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (pid, kind)
+            );
+        """)
+
+    def _connection(self):
+        # اتصال لكل خيط ولكل عملية (gunicorn قد ينسخ العملية بعد الاستيراد)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # حالة مؤقتة لا تحتاج fsync
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, operation, *args):
+        """تنفيذ عملية كتابة داخل معاملة واحدة"""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = operation(db, *args)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _count(self, db, kind):
+        return db.execute("SELECT COALESCE(SUM(count), 0) FROM holders WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def _add(self, db, kind, amount):
+        db.execute(
+            "INSERT INTO holders (pid, kind, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (pid, kind) DO UPDATE SET count = count + excluded.count",
+            (os.getpid(), kind, amount)
+        )
+
+    def _take(self, db, buckets, now):
+        levels = []
+        wait = 0.0
+        for key, rate, burst in buckets:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else refill(row[0], row[1], rate, burst, now)
+            levels.append((key, tokens))
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+        if wait:
+            return wait
+
+        db.executemany(
+            "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+            [(key, tokens - 1, now) for key, tokens in levels]
+        )
+        return 0.0
+
+    def take(self, buckets, now):
+        return self._write(self._take, buckets, now)
+
+    def _reap(self, db):
+        """أماكن العمليات التي انتهت بدون تحرير (عامل قُتل أو أعيد تشغيله)"""
+        now = time.monotonic()
+        if now - self.reaped_at < self.REAP_INTERVAL:
+            return
+        self.reaped_at = now
+        for (pid,) in db.execute("SELECT DISTINCT pid FROM holders").fetchall():
+            if not pid_alive(pid):
+                db.execute("DELETE FROM holders WHERE pid = ?", (pid,))
+
+    def _acquire(self, db, limit, queue_size, queued):
+        active = self._count(db, "active")
+        waiting = self._count(db, "waiting")
+        if active >= limit or (not queued and waiting):
+            self._reap(db)
+            active = self._count(db, "active")
+            waiting = self._count(db, "waiting")
+
+        if active < limit and (queued or waiting == 0):
+            self._add(db, "active", 1)
+            if queued:
+                self._add(db, "waiting", -1)
+            return ADMITTED
+        if queued:
+            return WAIT
+        if waiting < queue_size:
+            self._add(db, "waiting", 1)
+            return QUEUED
+        return FULL
+
+    def acquire(self, limit, queue_size, queued):
+        return self._write(self._acquire, limit, queue_size, queued)
+
+    def leave_queue(self):
+        self._write(self._add, "waiting", -1)
+
+    def release(self):
+        self._write(self._add, "active", -1)
+
+    def prune(self, cutoff):
+        self._write(lambda db: db.execute("DELETE FROM buckets WHERE updated < ?", (cutoff,)))
+
+    def stats(self):
+        db = self._connection()
+        return {
+            "active": self._count(db, "active"),
+            "waiting": self._count(db, "waiting"),
+            "buckets": db.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+        }
+
+
+# ====== المتحكم ======
+class AdmissionController:
+    # الفحص الدوري أثناء الانتظار: يبدأ سريعاً ثم يتباطأ حتى لا يضغط على SQLite
+    POLL_MIN = 0.01
+    POLL_MAX = 0.1
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, state, max_concurrent, queue_size, queue_timeout, retry_after,
+                 session_rate, session_burst, ip_rate, ip_burst):
+        self.state = state
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        # bucket لم يستخدم أكثر من هذا ممتلئ بالتأكيد فيمكن حذفه
+        self.idle_after = max(
+            [burst / rate for rate, burst in ((session_rate, session_burst), (ip_rate, ip_burst)) if rate > 0],
+            default=0.0
+        )
+        self.pruned_at = time.monotonic()
+        self.rejected = {}
+
+    def _buckets(self, session_ids, ip):
+        buckets = []
+        if self.session_rate > 0:
+            buckets.extend((f"session:{session_id}", self.session_rate, self.session_burst)
+                           for session_id in dict.fromkeys(session_ids))
+        if self.ip_rate > 0 and ip:
+            buckets.append((f"ip:{ip}", self.ip_rate, self.ip_burst))
+        return buckets
+
+    def _reject(self, status, retry_after, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return Rejected(status, max(1, math.ceil(retry_after)), reason)
+
+    def _maybe_prune(self):
+        now = time.monotonic()
+        if self.idle_after and now - self.pruned_at >= self.PRUNE_INTERVAL:
+            self.pruned_at = now
+            self.state.prune(time.time() - self.idle_after)
+
+    def _check_rate(self, session_ids, ip):
+        """الخطوة 1 (بدون انتظار) لرسالة أو دفعة رسائل. ترجع استثناء Rejected أو None"""
+        buckets = self._buckets(session_ids, ip)
+        if not buckets:
+            return None
+        self._maybe_prune()
+        wait = self.state.take(buckets, time.time())
+        return self._reject(429, wait, "rate_limited") if wait else None
+
+    def _next_step(self, status, deadline):
+        """بعد نتيجة acquire: None للقبول، WAIT لفحص آخر بعد قليل، أو Rejected"""
+        if status == ADMITTED:
+            return None
+        if status == FULL:
+            return self._reject(503, self.retry_after, "queue_full")
+        if time.monotonic() >= deadline:
+            return self._reject(503, self.retry_after, "queue_timeout")
+        return WAIT
+
+    def check_rate(self, session_ids, ip):
+        """الخطوة 1 مرة واحدة لدفعة رسائل (/chat/batch). ترفع Rejected إذا نفد أي رصيد"""
+        rejected = self._check_rate(session_ids, ip)
+        if rejected:
+            raise rejected
+
+    def acquire(self, session_id, ip, rate_checked=False):
+        """قبول طلب أو رفعه Rejected. كل acquire ناجح يقابله release"""
+        if not rate_checked:
+            self.check_rate([session_id], ip)
+        if self.max_concurrent <= 0:
+            return
+
+        deadline = time.monotonic() + self.queue_timeout
+        status = self.state.acquire(self.max_concurrent, self.queue_size, queued=False)
+        delay = self.POLL_MIN
+        try:
+            while True:
+                step = self._next_step(status, deadline)
+                if step is None:
+                    return
+                if isinstance(step, Rejected):
+                    raise step
+                time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+                delay = min(delay * 2, self.POLL_MAX)
+                status = self.state.acquire(self.max_concurrent, self.queue_size, queued=True)
+        except BaseException:
+            if status in (QUEUED, WAIT):
+                self.state.leave_queue()
+            raise
+
+    def release(self):
+        if self.max_concurrent > 0:
+            self.state.release()
+
+    @contextmanager
+    def admit(self, session_id, ip, rate_checked=False):
+        self.acquire(session_id, ip, rate_checked)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {**self.state.stats(), "limit": self.max_concurrent, "rejected": dict(self.rejected)}
+
+
+class AsyncAdmissionController:
+    """
+    واجهة async للمتحكم (asgi.py). الحالة في الذاكرة تستدعى مباشرة،
+    و SQLite في خيط منفصل (مثل AsyncSessionStore)، والانتظار بـ asyncio.sleep.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.state = controller.state
+
+    async def _call(self, method, *args):
+        if self.state.shared:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def check_rate(self, session_ids, ip):
+        rejected = await self._call(self.controller._check_rate, session_ids, ip)
+        if rejected:
+            raise rejected
+
+    async def acquire(self, session_id, ip, rate_checked=False):
+        controller = self.controller
+        if not rate_checked:
+            await self.check_rate([session_id], ip)
+        if controller.max_concurrent <= 0:
+            return
+
+        deadline = time.monotonic() + controller.queue_timeout
+        status = await self._call(self.state.acquire, controller.max_concurrent, controller.queue_size, False)
+        delay = controller.POLL_MIN
+        try:
+            while True:
+                step = controller._next_step(status, deadline)
+                if step is None:
+                    return
+                if isinstance(step, Rejected):
+                    raise step
+                await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+                delay = min(delay * 2, controller.POLL_MAX)
+                status = await self._call(self.state.acquire, controller.max_concurrent, controller.queue_size, True)
+        except BaseException:
+            if status in (QUEUED, WAIT):
+                # حتى لو أُلغيت المهمة يجب أن يخرج الطلب من عداد الطابور
+                self.state.leave_queue()
+            raise
+
+    async def release(self):
+        if self.controller.max_concurrent > 0:
+            await self._call(self.state.release)
+
+    async def stats(self):
+        return await self._call(self.controller.stats)
+
+
+def create_admission_controller():
+    """إنشاء المتحكم حسب متغيرات البيئة (ADMISSION_MAX_CONCURRENT=0 أو RATE=0 يعطل الجزء المعني)"""
+    backend = os.environ.get("ADMISSION_BACKEND", "sqlite")
+    if backend == "sqlite":
+        state = SQLiteAdmissionState(os.environ.get("ADMISSION_DB_PATH", "admission.db"))
+    elif backend == "memory":
+        state = MemoryAdmissionState()
+    else:
+        raise ValueError(f"Unknown ADMISSION_BACKEND: {backend}")
+
+    return AdmissionController(
+        state,
+        max_concurrent=int(os.environ.get("ADMISSION_MAX_CONCURRENT", 32)),
+        queue_size=int(os.environ.get("ADMISSION_QUEUE_SIZE", 64)),
+        queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 10)),
+        retry_after=float(os.environ.get("ADMISSION_RETRY_AFTER", 2)),
+        # 0.5 في الثانية = 30 رسالة للنموذج في الدقيقة لكل جلسة بعد الدفعة الأولى
+        session_rate=float(os.environ.get("ADMISSION_SESSION_RATE", 0.5)),
+        session_burst=float(os.environ.get("ADMISSION_SESSION_BURST", 5)),
+        ip_rate=float(os.environ.get("ADMISSION_IP_RATE", 2)),
+        ip_burst=float(os.environ.get("ADMISSION_IP_BURST", 20))
+    )
@@ -0,0 +1,496 @@
+"""
+نسخة ASGI (asyncio) من نفس مسارات server.py وبنفس صيغة JSON.
+
+في نسخة Flask كل طلب /chat يحجز عامل gunicorn طوال انتظار Groq (عدة ثوانٍ)،
+هنا الانتظار لا يحجز شيئاً فتستطيع عملية واحدة خدمة مئات المحادثات في نفس الوقت.
+المنطق نفسه (اللغة، الردود المحلية، الكاش، التنسيق) يؤخذ من server.py، والفرق
+فقط في عميل Groq غير المتزامن وفي استدعاء مخزن الجلسات عبر AsyncSessionStore.
+
+التشغيل:
+    uvicorn asgi:app --host 0.0.0.0 --port 10000
+"""
+import asyncio
+import os
+import time
+import uuid
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import server
+from sessions import AsyncSessionStore
+from singleflight import AsyncSingleFlight, flight_key
+from metrics import StageClock, TimedStream, record_usage
+from upstream import create_async_upstream, is_rate_limited
+from admission import AsyncAdmissionController, Rejected
+
+# حد اتصالات Groq الافتراضي هنا 512 (الافتراضي في المكتبة 100 وهو أقل من عدد المحادثات المتوقعة)
+upstream = create_async_upstream(os.environ.get("GROQ_API_KEY"))
+
+metrics = server.metrics
+sessions = AsyncSessionStore(server.session_store)
+upstream_flights = AsyncSingleFlight(timeout=server.SINGLE_FLIGHT_TIMEOUT)
+admission = AsyncAdmissionController(server.admission)
+
+
+async def with_model_fallback(route, call):
+    """نفس server.with_model_fallback لاستدعاءات async"""
+    try:
+        return await call(route), route
+    except Exception as e:
+        if not is_rate_limited(e) or not server.model_router.enabled:
+            raise
+        fallback = server.model_router.fallback(route)
+        server.MODEL_FALLBACKS.labels(route.tier.name, fallback.tier.name).inc()
+        return await call(fallback), fallback
+
+
+async def complete_chat(messages, route):
+
+    async def call(route):
+        params = server.completion_params(messages, route)
+
+        async def create():
+            started = time.perf_counter()
+            completion = await upstream.create(**params)
+            elapsed = time.perf_counter() - started
+            server.UPSTREAM_SECONDS.labels("total").observe(elapsed)
+            server.MODEL_SECONDS.labels(route.tier.name).observe(elapsed)
+            if completion.usage is not None:
+                record_usage(server.UPSTREAM_TOKENS, completion.usage, route.tier.name)
+            return completion.choices[0].message.content
+
+        return await upstream_flights.do(flight_key(params), create)
+
+    return await with_model_fallback(route, call)
+
+
+async def stream_chat(messages, route):
+
+    async def call(route):
+        params = server.completion_params(messages, route, stream=True)
+
+        async def open_stream():
+            started = time.perf_counter()
+            return TimedStream(
+                await upstream.create(**params), started, server.UPSTREAM_SECONDS, server.UPSTREAM_TOKENS,
+                (route.tier.name,)
+            )
+
+        return await upstream_flights.stream(flight_key(params), open_stream)
+
+    return await with_model_fallback(route, call)
+
+
+def error_response(user_msg=None):
+    language = server.detect_language(user_msg) if user_msg else 'arabic'
+    return JSONResponse({"error": server.ERROR_MESSAGES[language]}, status_code=500)
+
+
+def busy_response(rejected, language):
+    body, status, headers = server.busy_payload(rejected, language)
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+def client_ip(request):
+    peer = request.client.host if request.client else None
+    return server.forwarded_client(request.headers.get("x-forwarded-for"), peer)
+
+
+class ReleasingResponse:
+    """
+    يحرر مكان التحكم في القبول بعد انتهاء الاستجابة مهما كان السبب (حتى انقطاع الاتصال)،
+    ويغلق اشتراك البث المشترك pieces حتى لو لم يبدأ المولد
+    """
+
+    def __init__(self, response, pieces=None):
+        self.response = response
+        self.pieces = pieces
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            try:
+                if self.pieces is not None:
+                    await self.pieces.aclose()
+            finally:
+                await admission.release()
+
+
+async def read_message(request):
+    data = await request.json()
+    return data.get("message", "").strip(), data.get("session_id", "default")
+
+
+async def remember_turn(session_id, user_msg, reply):
+    await sessions.append_message(session_id, "user", user_msg)
+    await sessions.append_message(session_id, "assistant", reply)
+
+
+# ====== ROUTES ======
+async def home(request):
+    return HTMLResponse("OILNOVA CHAT BACKEND IS RUNNING OK - ENHANCED PROFESSIONAL VERSION")
+
+
+async def start_session(request):
+    """بدء جلسة محادثة جديدة"""
+    session_id = str(uuid.uuid4())
+    await sessions.create(session_id)
+    return JSONResponse({"session_id": session_id})
+
+
+async def answer_chat(user_msg, session_id, ip, rate_checked=False):
+    """رد رسالة واحدة كما في /chat. يرفع Rejected إذا رفضها التحكم في القبول"""
+    clock = StageClock(server.STAGES)
+    await sessions.cleanup(server.CLEANUP_BATCH_SIZE)
+    clock.lap("session_cleanup")
+    user_language = server.detect_language(user_msg)
+    clock.lap("detect_language")
+    session_data = await sessions.get(session_id)
+    conversation_history = session_data.messages
+    clock.lap("history_load")
+
+    ready = server.ready_reply(user_msg, user_language, conversation_history)
+    clock.lap("routing")
+    if ready:
+        route, reply = ready
+        await remember_turn(session_id, user_msg, reply)
+        clock.lap("history_update")
+        server.REPLY_SOURCES[route.partition(":")[0]].inc()
+        return server.chat_payload(route, reply, session_id, user_language)
+
+    messages, prompt_tokens = server.assemble_prompt(session_id, user_language, conversation_history, user_msg)
+    model_route = server.choose_model(user_msg, user_language, conversation_history)
+    clock.lap("prompt_assembly")
+    await admission.acquire(session_id, ip, rate_checked)
+    clock.lap("admission")
+    try:
+        reply, model_route = await complete_chat(messages, model_route)
+    finally:
+        await admission.release()
+    clock.lap("upstream")
+
+    formatted_reply = server.format_final_response(reply, user_language)
+    server.remember_reply(user_msg, user_language, conversation_history, formatted_reply, model_route)
+    clock.lap("format")
+    await remember_turn(session_id, user_msg, formatted_reply)
+    clock.lap("history_update")
+    server.REPLY_SOURCES["model"].inc()
+
+    return server.chat_payload(None, formatted_reply, session_id, user_language, prompt_tokens, model_route)
+
+
+async def chat(request):
+    user_msg = None
+    try:
+        user_msg, session_id = await read_message(request)
+        if not user_msg:
+            return JSONResponse({"error": "الرسالة فارغة"}, status_code=400)
+
+        return JSONResponse(await answer_chat(user_msg, session_id, client_ip(request)))
+
+    except Rejected as e:
+        return busy_response(e, server.detect_language(user_msg))
+
+    except Exception as e:
+        print(f"Error: {e}")
+        server.ERRORS.labels("chat", type(e).__name__).inc()
+        return error_response(user_msg)
+
+
+async def batch_item(user_msg, session_id, ip):
+    try:
+        return await answer_chat(user_msg, session_id, ip, rate_checked=True)
+    except Rejected as e:
+        body, status, _ = server.busy_payload(e, server.detect_language(user_msg))
+        return {**body, "status": status, "session_id": session_id}
+    except Exception as e:
+        print(f"Error: {e}")
+        server.ERRORS.labels("chat_batch", type(e).__name__).inc()
+        return {"error": server.ERROR_MESSAGES[server.detect_language(user_msg)], "status": 500, "session_id": session_id}
+
+
+async def chat_batch(request):
+    """نفس /chat/batch في server.py: الجلسات بالتوازي ورسائل نفس الجلسة بالترتيب، والرصيد مرة للطلب كله"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        items = data.get("items") if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return JSONResponse({"error": "items يجب أن تكون قائمة غير فارغة"}, status_code=400)
+        if len(items) > server.BATCH_MAX_ITEMS:
+            return JSONResponse({"error": f"الحد الأقصى {server.BATCH_MAX_ITEMS} عنصراً في الطلب"}, status_code=413)
+
+        ip = client_ip(request)
+        results, batch_sessions = server.batch_groups(items)
+        if batch_sessions:
+            await admission.check_rate(list(batch_sessions), ip)
+        slots = asyncio.Semaphore(server.BATCH_CONCURRENCY)
+
+        async def answer_session(session_id, entries):
+            async with slots:
+                for index, user_msg in entries:
+                    results[index] = await batch_item(user_msg, session_id, ip)
+
+        await asyncio.gather(*(answer_session(session_id, entries) for session_id, entries in batch_sessions.items()))
+        return JSONResponse({"results": results})
+
+    except Rejected as e:
+        return busy_response(e, 'arabic')
+
+    except Exception as e:
+        print(f"Error: {e}")
+        server.ERRORS.labels("chat_batch", type(e).__name__).inc()
+        return error_response()
+
+
+async def jobs_call(method, *args):
+    """مهام SQLite في خيط منفصل مثل AsyncSessionStore، والتوليد نفسه في خيوط job_runner"""
+    if server.job_runner.store.shared:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+async def submit_chat_job(request):
+    """نفس /chat/jobs في server.py: المهمة تنفذ server.answer_chat في مجموعة خيوط المهام"""
+    user_msg = None
+    try:
+        user_msg, session_id = await read_message(request)
+        if not user_msg:
+            return JSONResponse({"error": "الرسالة فارغة"}, status_code=400)
+
+        handler = server.job_handler(user_msg, session_id, client_ip(request))
+        job = await jobs_call(server.job_runner.submit, session_id, handler)
+        return JSONResponse(job.payload(), status_code=202, headers={"Location": f"/chat/jobs/{job.job_id}"})
+
+    except Rejected as e:
+        return busy_response(e, server.detect_language(user_msg))
+
+    except Exception as e:
+        print(f"Error: {e}")
+        server.ERRORS.labels("chat_jobs", type(e).__name__).inc()
+        return error_response(user_msg)
+
+
+async def chat_job(request):
+    """GET حالة المهمة ونتيجتها، DELETE لإلغائها"""
+    method = server.job_runner.get if request.method == "GET" else server.job_runner.cancel
+    job = await jobs_call(method, request.path_params["job_id"])
+    if job is None:
+        return JSONResponse(*server.job_not_found())
+    return JSONResponse(job.payload())
+
+
+def sse_response(events):
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def chat_stream(request):
+    """نفس /chat لكن يرسل الرد كأحداث SSE أثناء التوليد"""
+    user_msg = None
+    try:
+        user_msg, session_id = await read_message(request)
+        if not user_msg:
+            return JSONResponse({"error": "الرسالة فارغة"}, status_code=400)
+
+        clock = StageClock(server.STAGES)
+        await sessions.cleanup(server.CLEANUP_BATCH_SIZE)
+        clock.lap("session_cleanup")
+        user_language = server.detect_language(user_msg)
+        clock.lap("detect_language")
+        session_data = await sessions.get(session_id)
+        conversation_history = session_data.messages
+        clock.lap("history_load")
+
+        meta = {"session_id": session_id, "detected_language": user_language}
+
+        ready = server.ready_reply(user_msg, user_language, conversation_history)
+        clock.lap("routing")
+        if ready:
+            route, reply = ready
+            await remember_turn(session_id, user_msg, reply)
+            clock.lap("history_update")
+            server.REPLY_SOURCES[route.partition(":")[0]].inc()
+
+            async def generate_static():
+                yield server.sse_event(meta, event="meta")
+                yield server.sse_event({"delta": reply})
+                yield server.sse_event({"reply": reply, **meta}, event="done")
+
+            return sse_response(generate_static())
+
+        messages, meta["prompt_tokens"] = server.assemble_prompt(session_id, user_language, conversation_history, user_msg)
+        model_route = server.choose_model(user_msg, user_language, conversation_history)
+        clock.lap("prompt_assembly")
+        await admission.acquire(session_id, client_ip(request))
+        clock.lap("admission")
+        try:
+            pieces, model_route = await stream_chat(messages, model_route)
+        except BaseException:
+            await admission.release()
+            raise
+        meta["model_tier"] = model_route.tier.name
+        meta["model"] = model_route.model
+
+    except Rejected as e:
+        return busy_response(e, user_language)
+
+    except Exception as e:
+        print(f"Error: {e}")
+        server.ERRORS.labels("chat_stream", type(e).__name__).inc()
+        return error_response(user_msg)
+
+    async def generate():
+        formatter = server.StreamingFormatter(user_language)
+        format_seconds = 0.0
+        try:
+            yield server.sse_event(meta, event="meta")
+
+            async for text in pieces:
+                started = time.perf_counter()
+                piece = formatter.feed(text)
+                format_seconds += time.perf_counter() - started
+                if piece:
+                    yield server.sse_event({"delta": piece})
+
+            piece = formatter.finish()
+            if piece:
+                yield server.sse_event({"delta": piece})
+            server.STAGES["format"].observe(format_seconds)
+
+            formatted_reply = formatter.text
+            server.remember_reply(user_msg, user_language, conversation_history, formatted_reply, model_route)
+            clock.reset()
+            await remember_turn(session_id, user_msg, formatted_reply)
+            clock.lap("history_update")
+            server.REPLY_SOURCES["model"].inc()
+
+            yield server.sse_event({"reply": formatted_reply, **meta}, event="done")
+
+        except Exception as e:
+            print(f"Error: {e}")
+            server.ERRORS.labels("chat_stream", type(e).__name__).inc()
+            yield server.sse_event({"error": server.ERROR_MESSAGES[user_language]}, event="error")
+
+        finally:
+            await pieces.aclose()
+
+    return ReleasingResponse(sse_response(generate()), pieces)
+
+
+async def clear_history(request):
+    """مسح تاريخ المحادثة"""
+    try:
+        data = await request.json()
+        session_id = data.get("session_id", "default")
+
+        await sessions.clear(session_id)
+        server.forget_history_summary(session_id)
+
+        return JSONResponse({"message": "تم مسح تاريخ المحادثة", "session_id": session_id})
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def get_session_info(request):
+    """الحصول على معلومات الجلسة (قائمة الجلسات نفسها في /admin/sessions)"""
+    return JSONResponse({
+        "active_sessions": len(server.session_store),
+        "session_memory": await sessions.memory_stats(),
+        "session_journal": server.session_journal.stats() if server.session_journal else None,
+        "completion_cache": server.completion_cache.stats(),
+        "single_flight": upstream_flights.stats(),
+        "upstream": upstream.stats(),
+        "admission": await admission.stats(),
+        "jobs": await jobs_call(server.job_runner.stats),
+        "prompts": server.prompts.stats()
+    })
+
+
+async def admin_sessions(request):
+    """نفس /admin/sessions في server.py"""
+    if not server.admin_authorized(request.headers):
+        return JSONResponse(*server.admin_denied())
+    try:
+        page, next_cursor = await sessions.list_sessions(**server.admin_page_query(request.query_params))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse({"sessions": page, "next_cursor": next_cursor})
+
+
+async def admin_session_stats(request):
+    if not server.admin_authorized(request.headers):
+        return JSONResponse(*server.admin_denied())
+    return JSONResponse({
+        **await sessions.session_stats(),
+        "memory": await sessions.memory_stats(),
+        "journal": server.session_journal.stats() if server.session_journal else None
+    })
+
+
+async def prometheus_metrics(request):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+class RequestMetrics:
+    """زمن الاستجابة حتى الترويسات وعدد الطلبات لكل مسار وحالة (مثل after_request في Flask)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                route = getattr(scope.get("endpoint"), "__name__", "unknown")
+                server.ROUTE_SECONDS[route].observe(time.perf_counter() - started)
+                server.ROUTE_STATUSES[route, message["status"]].inc()
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
+
+
+app = Starlette(
+    routes=[
+        Route("/", home),
+        Route("/start_session", start_session, methods=["GET"]),
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/batch", chat_batch, methods=["POST"]),
+        Route("/chat/jobs", submit_chat_job, methods=["POST"]),
+        Route("/chat/jobs/{job_id}", chat_job, methods=["GET", "DELETE"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/clear_history", clear_history, methods=["POST"]),
+        Route("/get_session_info", get_session_info, methods=["GET"]),
+        Route("/admin/sessions", admin_sessions, methods=["GET"]),
+        Route("/admin/sessions/stats", admin_session_stats, methods=["GET"]),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+    ],
+    middleware=[
+        Middleware(RequestMetrics),
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["https://petroai-iq.web.app", "https://ping-pkai.onrender.com", "*"],
+            allow_methods=["POST", "GET", "DELETE", "OPTIONS"],
+            allow_headers=["Content-Type"]
+        )
+    ]
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=10000)
@@ -0,0 +1,103 @@
+"""
+مقارنة إنتاجية /chat بين نسخة Flask المتزامنة (gunicorn) ونسخة ASGI (uvicorn)
+مقابل stub_groq.py بزمن استجابة ثابت، مع عدد كبير من المحادثات المتزامنة.
+
+الاستخدام:
+    python benchmarks/bench_asgi.py [--concurrency 200] [--requests 1000] [--latency 1.0] [--workers 4]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_PORT = 18000
+SYNC_PORT = 18001
+ASGI_PORT = 18002
+
+
+def wait_for_port(port, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"port {port} did not open")
+
+
+def start(command, port, env):
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+async def run_load(port, concurrency, requests):
+    url = f"http://127.0.0.1:{port}/chat"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    queue = asyncio.Queue()
+    for index in range(requests):
+        queue.put_nowait(index)
+    errors = 0
+
+    async def worker(http):
+        nonlocal errors
+        while not queue.empty():
+            index = queue.get_nowait()
+            # أسئلة مختلفة وجلسات مختلفة حتى لا يرد الكاش بدل النموذج
+            try:
+                response = await http.post(url, json={"message": f"How does an ESP pump work in well {index}?",
+                                                       "session_id": f"bench-{index}"})
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.TransportError:
+                errors += 1
+
+    async with httpx.AsyncClient(limits=limits, timeout=300) as http:
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start_time
+
+    return requests / elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn sync workers")
+    args = parser.parse_args()
+
+    # القياس هنا للإنتاجية الخام فالتحكم في القبول معطل
+    env = dict(os.environ, GROQ_API_KEY="benchmark", GROQ_BASE_URL=f"http://127.0.0.1:{STUB_PORT}",
+               SESSION_SWEEP_INTERVAL="0", PYTHONPATH=ROOT, ADMISSION_BACKEND="memory",
+               ADMISSION_MAX_CONCURRENT="0", ADMISSION_SESSION_RATE="0", ADMISSION_IP_RATE="0")
+
+    processes = [start([sys.executable, "benchmarks/stub_groq.py", "--port", str(STUB_PORT),
+                        "--latency", str(args.latency)], STUB_PORT, env)]
+    try:
+        processes.append(start(["gunicorn", "-w", str(args.workers), "-b", f"127.0.0.1:{SYNC_PORT}", "server:app"],
+                               SYNC_PORT, env))
+        processes.append(start([sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(ASGI_PORT),
+                                "--log-level", "warning"], ASGI_PORT, env))
+
+        print(f"upstream latency {args.latency}s, {args.requests} requests, concurrency {args.concurrency}")
+        print(f"{'server':<28} {'req/s':>8} {'errors':>8}")
+        for label, port in ((f"flask sync ({args.workers} workers)", SYNC_PORT), ("asgi (1 process)", ASGI_PORT)):
+            throughput, errors = asyncio.run(run_load(port, args.concurrency, args.requests))
+            print(f"{label:<28} {throughput:>8.1f} {errors:>8}")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
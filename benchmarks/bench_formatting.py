@@ -0,0 +1,91 @@
+"""
+التحقق من تطابق التنسيق مع المخرجات المرجعية ثم قياس سرعة format_final_response.
+
+golden/formatting.json يحتوي نصوصاً حقيقية وحالات حدية مع الناتج المتوقع لكل دالة
+تنسيق. أي اختلاف ولو بحرف واحد يوقف القياس بخطأ.
+
+الاستخدام:
+    python benchmarks/bench_formatting.py            # تحقق + قياس
+    python benchmarks/bench_formatting.py --update   # إعادة كتابة المخرجات المرجعية (بعد تغيير مقصود فقط)
+"""
+import json
+import os
+import sys
+import timeit
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("SESSION_SWEEP_INTERVAL", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "formatting.json")
+
+FUNCTIONS = {
+    "format_final_response_arabic": lambda text: server.format_final_response(text, "arabic"),
+    "format_final_response_english": lambda text: server.format_final_response(text, "english"),
+    "format_arabic_text": server.format_arabic_text,
+    "format_english_text": server.format_english_text,
+}
+
+
+def load_cases():
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_golden(cases):
+    for case in cases:
+        for name, function in FUNCTIONS.items():
+            case[name] = function(case["text"])
+    with open(GOLDEN_PATH, "w", encoding="utf-8") as f:
+        json.dump(cases, f, ensure_ascii=False, indent=1)
+        f.write("\n")
+    print(f"updated {len(cases)} cases")
+
+
+def check_golden(cases):
+    failures = 0
+    for index, case in enumerate(cases):
+        for name, function in FUNCTIONS.items():
+            output = function(case["text"])
+            if output != case[name]:
+                failures += 1
+                print(f"MISMATCH case {index} {name}:\n  expected {case[name]!r}\n  got      {output!r}")
+    return failures
+
+
+def benchmark(cases):
+    texts = [case["text"] for case in cases if case["text"]]
+    samples = {
+        "short": texts[0],
+        "medium": "\n\n".join(texts[:8]),
+        "long (~4k tokens)": "\n\n".join(texts * 4),
+    }
+    print(f"{'sample':<20} {'chars':>8} {'arabic us':>12} {'english us':>12}")
+    for label, text in samples.items():
+        row = [label, len(text)]
+        for language in ("arabic", "english"):
+            timer = timeit.Timer(lambda: server.format_final_response(text, language))
+            number, _ = timer.autorange()
+            best = min(timer.repeat(repeat=5, number=number)) / number
+            row.append(best * 1e6)
+        print(f"{row[0]:<20} {row[1]:>8} {row[2]:>12.1f} {row[3]:>12.1f}")
+
+
+def main():
+    cases = load_cases()
+    if "--update" in sys.argv[1:]:
+        update_golden(cases)
+        return
+
+    failures = check_golden(cases)
+    if failures:
+        print(f"{failures} golden mismatches")
+        sys.exit(1)
+    print(f"golden: {len(cases)} cases x {len(FUNCTIONS)} functions identical")
+    benchmark(cases)
+
+
+if __name__ == "__main__":
+    main()
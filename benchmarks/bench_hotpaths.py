@@ -0,0 +1,198 @@
+"""
+قياس دوال معالجة النص في مسار كل طلب: كشف اللغة، التنسيق، وتوجيه رسائل الفريق.
+
+لكل دالة ولكل عينة (عربي، إنجليزي، مختلط بأطوال من رد قصير حتى ~4k توكن)
+يقاس عدد العمليات في الثانية (أفضل --repeat تكرارات) وذاكرة الاستدعاء الواحد من
+tracemalloc: أعلى ذاكرة مؤقتة (peak_bytes) وعدد الكتل التي بقيت بعده
+(retained_blocks، غالباً الناتج فقط؛ زيادتها تعني كاشاً أو تسريباً).
+
+النتائج تحفظ JSON للمقارنة بين commits، ومع --baseline يفشل الأمر (exit 1)
+إذا نقصت السرعة أو زادت الذاكرة أكثر من الحد.
+
+النصوص في corpus/replies.json.
+
+الاستخدام:
+    python benchmarks/bench_hotpaths.py --output before.json
+    python benchmarks/bench_hotpaths.py --baseline before.json [--threshold 0.2] [--memory-threshold 0.25]
+    python benchmarks/bench_hotpaths.py --filter detect_language
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("SESSION_SWEEP_INTERVAL", "0")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import server  # noqa: E402
+from context import estimate_tokens  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "replies.json")
+
+# حجم كل عينة بالتوكنات التقديرية
+SIZES = {"short": 0, "medium": 600, "long": 4000}
+
+# رسائل مستخدمين لتوجيه chat(): أعضاء الفريق، تحية، خارج الموضوع، وأسئلة تقنية تمر للنموذج
+ROUTING_MESSAGES = {
+    "team": ["من هو حيدر؟", "Who is the founder of OILNOVA?", "مين سجاد في الفريق", "tell me about the team"],
+    "local": ["مرحبا", "hello", "what's the weather today?", "اعطني وصفة كيك"],
+    "model": [
+        "How do I size an ESP for a well producing 1500 bbl/d with 80% water cut?",
+        "ما الفرق بين الرفع بالغاز والمضخة الغاطسة من ناحية التكلفة والكفاءة؟",
+        "Explain the skin factor and how acidizing changes it " * 10,
+    ],
+}
+
+
+def load_samples():
+    """عينات بكل لغة وحجم: short = أول رد، والأكبر تكرار كل الردود حتى الحجم المطلوب"""
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    samples = {}
+    for language, replies in corpus.items():
+        for size, tokens in SIZES.items():
+            if not tokens:
+                samples[f"{language}/{size}"] = replies[0]
+                continue
+            parts = []
+            while estimate_tokens("\n\n".join(parts)) < tokens:
+                parts.append(replies[len(parts) % len(replies)])
+            samples[f"{language}/{size}"] = "\n\n".join(parts)
+    return samples
+
+
+def reply_language(sample):
+    return "english" if sample.startswith("english") else "arabic"
+
+
+def cases(samples):
+    """(الاسم، دالة بدون معاملات) لكل دالة وعينة"""
+    for sample, text in samples.items():
+        language = reply_language(sample)
+        yield f"detect_language/{sample}", lambda text=text: server.detect_language(text)
+        yield f"convert_english_numbers_to_arabic/{sample}", lambda text=text: server.convert_english_numbers_to_arabic(text)
+        yield f"enforce_list_formatting/{sample}", lambda text=text, language=language: server.enforce_list_formatting(text, language)
+        yield f"bold_important_words/{sample}", lambda text=text: server.bold_important_words(text)
+        yield f"format_final_response/{sample}", lambda text=text, language=language: server.format_final_response(text, language)
+
+    for language in ("arabic", "english"):
+        def rewrite_all(language=language):
+            for member_key in server.FOUNDERS_INFO:
+                server.rewrite_team_member_info(member_key, language)
+        yield f"rewrite_team_member_info/{language}", rewrite_all
+
+    for kind, messages in ROUTING_MESSAGES.items():
+        def route_all(messages=messages):
+            for message in messages:
+                server.route_message(message, server.detect_language(message))
+        yield f"route_message/{kind}", route_all
+
+
+def measure(function, repeat):
+    # الكاشات الداخلية (re وغيرها) ممتلئة قبل القياس
+    function()
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start_bytes, _ = tracemalloc.get_traced_memory()
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    retained = sum(stat.count_diff for stat in after.compare_to(before, "lineno") if stat.count_diff > 0)
+    return {
+        "ops_per_sec": round(1 / best, 1),
+        "us_per_op": round(best * 1e6, 2),
+        "peak_bytes": peak - start_bytes,
+        "retained_blocks": retained
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, memory_threshold):
+    """قائمة التراجعات مقارنة بنتائج سابقة"""
+    regressions = []
+    for name, old in baseline["results"].items():
+        new = results.get(name)
+        if new is None:
+            continue
+        if new["ops_per_sec"] < old["ops_per_sec"] * (1 - threshold):
+            regressions.append(f"{name}: {old['ops_per_sec']:.0f} -> {new['ops_per_sec']:.0f} ops/s")
+        # هامش 1KB حتى لا تفشل العينات الصغيرة بسبب تغير بسيط في الحجم
+        if new["peak_bytes"] > old["peak_bytes"] * (1 + memory_threshold) + 1024:
+            regressions.append(f"{name}: peak {old['peak_bytes']} -> {new['peak_bytes']} bytes")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="حفظ النتائج JSON في هذا الملف")
+    parser.add_argument("--baseline", help="نتائج سابقة للمقارنة")
+    # على جهاز مشترك يتغير القياس نفسه بين تشغيلين بحدود 10-20%
+    parser.add_argument("--threshold", type=float, default=0.2, help="أقصى نقص مسموح في ops/sec (0.2 = 20%%)")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="أقصى زيادة مسموحة في peak_bytes")
+    parser.add_argument("--repeat", type=int, default=5, help="عدد التكرارات (تؤخذ أفضلها)")
+    parser.add_argument("--filter", default="", help="قياس الحالات التي يحتوي اسمها هذا النص فقط")
+    args = parser.parse_args()
+
+    samples = load_samples()
+    print("samples: " + ", ".join(f"{name}={estimate_tokens(text)} tokens" for name, text in samples.items()))
+    print(f"{'case':<52} {'ops/sec':>12} {'us/op':>10} {'peak KiB':>10} {'blocks':>7}")
+
+    results = {}
+    for name, function in cases(samples):
+        if args.filter not in name:
+            continue
+        result = results[name] = measure(function, args.repeat)
+        print(f"{name:<52} {result['ops_per_sec']:>12.0f} {result['us_per_op']:>10.2f} "
+              f"{result['peak_bytes'] / 1024:>10.1f} {result['retained_blocks']:>7}")
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+            f.write("\n")
+        print(f"saved {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions against {baseline.get('commit') or args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"no regressions against {baseline.get('commit') or args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
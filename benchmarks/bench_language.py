@@ -0,0 +1,113 @@
+"""
+detect_language الجديدة (language.py، مرور واحد) مقابل القديمة (أربع re.findall)
+على نصوص طويلة يلصقها المستخدمون: سجل اختبار بئر، تقرير حفر يومي عربي فيه
+وحدات ومصطلحات إنجليزية، وسؤال قصير قبل سجل ملصوق، وردود الـ corpus.
+
+لكل عينة: الزمن (أفضل --repeat تكرارات)، أعلى ذاكرة مؤقتة للاستدعاء الواحد
+(tracemalloc)، وأن الناتج نفسه في الدالتين. ثم من أين يصبح الكشف على بداية
+النص (ScriptCounter على أجزاء من --chunk حرفاً) مطابقاً للنص كاملاً.
+
+الاستخدام:
+    python benchmarks/bench_language.py [--lines 2000] [--repeat 5] [--chunk 256]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from language import ScriptCounter, classify_script, detect_language  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "replies.json")
+
+WELL_TEST_LINE = ("2024-03-{day:02d} {hour:02d}:00 WHP=1450 psi FLP=320 psi CHOKE=32/64 Qo=1520 bbl/d "
+                  "Qw=2480 bbl/d GOR=850 scf/bbl WC=62% BHT=212F ESP freq=52Hz amps=48 status=OK")
+DRILLING_REPORT_LINE = ("العمق {hour}0 قدم، الحفر مستمر بمعدل ROP=45 ft/hr، وزن الطين MW=10.2 ppg، "
+                        "الضخ 550 gpm، لا توجد خسائر دوران. ملاحظة: ارتفاع بسيط في الغاز الخلفي.")
+
+
+def legacy_detect_language(text):
+    """detect_language كما كانت في server.py"""
+    arabic_chars = len(re.findall(r'[؀-ۿ]', text))
+    english_chars = len(re.findall(r'[a-zA-Z]', text))
+    if arabic_chars > english_chars:
+        return 'arabic'
+    elif english_chars > arabic_chars:
+        return 'english'
+    else:
+        arabic_words = len(re.findall(r'\b[؀-ۿ]+\b', text))
+        english_words = len(re.findall(r'\b[a-zA-Z]+\b', text))
+        return 'arabic' if arabic_words >= english_words else 'english'
+
+
+def samples(lines):
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+    well_test = "\n".join(WELL_TEST_LINE.format(day=index // 24 % 28 + 1, hour=index % 24) for index in range(lines))
+    report = "\n".join(DRILLING_REPORT_LINE.format(hour=index) for index in range(lines))
+    return {
+        "question": "كيف أختار حجم المضخة الغاطسة لبئر ينتج 1500 برميل يومياً؟",
+        "well_test_log": well_test,
+        "drilling_report": report,
+        "question+log": "لماذا انخفض الإنتاج في هذا السجل؟\n" + well_test,
+        **{f"corpus/{language}": "\n\n".join(replies * 20) for language, replies in corpus.items()},
+    }
+
+
+def measure(function, text, repeat):
+    function(text)
+    timer = timeit.Timer(lambda: function(text))
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        function(text)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak - start
+
+
+def prefix_decision(text, chunk):
+    """عدد الحروف حتى تصبح اللغة محسومة على البداية، أو None إذا لم تحسم قبل النهاية"""
+    counter = ScriptCounter()
+    for start in range(0, len(text), chunk):
+        counter.feed(text[start:start + chunk])
+        if counter.decided(len(text) - start - chunk):
+            return min(start + chunk, len(text))
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=2000, help="lines in the pasted log and report")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--chunk", type=int, default=256, help="characters per streamed chunk")
+    args = parser.parse_args()
+
+    print(f"{'sample':<18} {'chars':>8} {'legacy us':>10} {'new us':>9} {'speedup':>8} "
+          f"{'legacy peak KiB':>16} {'new peak KiB':>13}  profile")
+    for name, text in samples(args.lines).items():
+        legacy_seconds, legacy_peak = measure(legacy_detect_language, text, args.repeat)
+        new_seconds, new_peak = measure(detect_language, text, args.repeat)
+        assert detect_language(text) == legacy_detect_language(text), name
+        profile = classify_script(text)
+        print(f"{name:<18} {len(text):>8} {legacy_seconds * 1e6:>10.1f} {new_seconds * 1e6:>9.1f} "
+              f"{legacy_seconds / new_seconds:>7.1f}x {legacy_peak / 1024:>16.1f} {new_peak / 1024:>13.1f}  "
+              f"{profile.language} {profile.confidence:.2f}{' mixed' if profile.mixed else ''}")
+
+        decided = prefix_decision(text, args.chunk)
+        if decided is not None and decided < len(text):
+            print(f"{'':<18} decided after {decided} of {len(text)} chars in {args.chunk}-char chunks")
+
+
+if __name__ == "__main__":
+    main()
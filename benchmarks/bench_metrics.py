@@ -0,0 +1,76 @@
+"""
+قياس تكلفة القياسات نفسها لكل طلب /chat يمر بالنموذج:
+8 مراحل StageClock + عداد الردود + زمن الطلب وعداده في after_request، بسلاسل
+مربوطة مرة (Family.bind) كما في server.py، ومقارنتها بـ labels() في كل تسجيل.
+
+الاستخدام:
+    python benchmarks/bench_metrics.py
+"""
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Metrics, StageClock  # noqa: E402
+
+STAGES = ["session_cleanup", "detect_language", "history_load", "routing", "prompt_assembly", "upstream",
+          "format", "history_update"]
+
+
+def main():
+    metrics = Metrics("bench")
+    stage_seconds = metrics.histogram("stage_seconds", "stages", ["stage"])
+    request_seconds = metrics.histogram("request_seconds", "requests", ["route"])
+    requests = metrics.counter("requests", "requests", ["route", "status"])
+    replies = metrics.counter("replies", "replies", ["source"])
+
+    stages = stage_seconds.bind(STAGES)
+    reply_sources = replies.bind(["model"])
+    route_seconds = request_seconds.bind()
+    route_statuses = requests.bind()
+
+    def instrumented_request():
+        clock = StageClock(stages)
+        for stage in STAGES:
+            clock.lap(stage)
+        reply_sources["model"].inc()
+        route_seconds["chat"].observe(0.8)
+        route_statuses["chat", 200].inc()
+
+    def labels_request():
+        # كما كان قبل bind: labels() في كل تسجيل
+        last = time.perf_counter()
+        for stage in STAGES:
+            now = time.perf_counter()
+            stage_seconds.labels(stage).observe(now - last)
+            last = now
+        replies.labels("model").inc()
+        request_seconds.labels("chat").observe(0.8)
+        requests.labels("chat", 200).inc()
+
+    def per_call(function):
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        return min(timer.repeat(repeat=5, number=number)) / number
+
+    best = per_call(instrumented_request)
+    unbound = per_call(labels_request)
+
+    observe = timeit.Timer(lambda: stage_seconds.labels("format").observe(0.001))
+    number, _ = observe.autorange()
+    single = min(observe.repeat(repeat=5, number=number)) / number
+
+    print(f"observe():             {single * 1e6:.2f} us")
+    print(f"per /chat request:     {best * 1e6:.2f} us ({len(STAGES)} stages + 2 counters + request timer)")
+    print(f"  with labels() calls: {unbound * 1e6:.2f} us")
+
+    metrics.render()
+    render = timeit.Timer(metrics.render)
+    number, _ = render.autorange()
+    print(f"render /metrics:       {min(render.repeat(repeat=3, number=number)) / number * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
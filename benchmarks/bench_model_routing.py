@@ -0,0 +1,66 @@
+"""
+توجيه النماذج (model_routing.py) على رسائل الجلسات المسجلة (traces/sessions.json):
+لكل رسالة تصل للنموذج (بعد الردود المحلية) نوع السؤال والطبقة و max_tokens والسبب،
+ثم نسبة ما يذهب للنموذج السريع ومتوسط max_tokens مقابل 1024 للجميع سابقاً.
+
+لقياس الزمن الفعلي مع زمن مختلف لكل نموذج:
+    python benchmarks/stub_groq.py --latency 1.0 --model-latency llama-3.1-8b-instant=0.2
+    python benchmarks/load_test.py ...
+
+الاستخدام:
+    python benchmarks/bench_model_routing.py [--trace benchmarks/traces/sessions.json] [--quiet]
+"""
+import argparse
+import json
+import os
+import sys
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("SESSION_SWEEP_INTERVAL", "0")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import server  # noqa: E402
+from context import stored_message  # noqa: E402
+from model_routing import question_kind  # noqa: E402
+
+DEFAULT_TRACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces", "sessions.json")
+PREVIOUS_MAX_TOKENS = 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", default=DEFAULT_TRACE)
+    parser.add_argument("--quiet", action="store_true", help="print the summary only")
+    args = parser.parse_args()
+
+    with open(args.trace, encoding="utf-8") as f:
+        trace = json.load(f)["sessions"]
+
+    routes = []
+    for session in trace:
+        history = []
+        for turn in session["turns"]:
+            message = turn["message"]
+            language = server.detect_language(message)
+            if server.ready_reply(message, language, history) is None:
+                route = server.model_router.choose(
+                    message, language, len(history), server.classify_script(message).mixed
+                )
+                routes.append(route)
+                if not args.quiet:
+                    print(f"{route.tier.name:<6} {question_kind(message):<10} {route.max_tokens:>5} "
+                          f"{route.reason:<10} {message[:60]}")
+            history += [stored_message("user", message), stored_message("assistant", "...")]
+
+    if not routes:
+        print("no model-bound messages in the trace")
+        return
+    fast = sum(route.tier is server.model_router.fast for route in routes)
+    average = sum(route.max_tokens for route in routes) / len(routes)
+    print(f"{len(routes)} model-bound messages: {fast} fast ({fast / len(routes):.0%}), "
+          f"{len(routes) - fast} large; average max_tokens {average:.0f} vs {PREVIOUS_MAX_TOKENS}")
+
+
+if __name__ == "__main__":
+    main()
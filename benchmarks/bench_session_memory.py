@@ -0,0 +1,122 @@
+"""
+ذاكرة الجلسات في العملية: التمثيل القديم (قواميس + datetime + context فارغ)
+مقابل Session/Message المضغوطة، بجلسات فيها 12 رسالة والردود طويلة
+(--reply-chars) من corpus/replies.json.
+
+يقاس بـ tracemalloc (كل ما يحجز فعلاً) ويطبع أيضاً الحجم الذي يحسبه المخزن
+لنفسه (memory_stats) للتأكد أن التقدير قريب من الحقيقة، وزمن قراءة تاريخ جلسة
+كاملة (فك الضغط) لكل طلب.
+
+الاستخدام:
+    python benchmarks/bench_session_memory.py [--sessions 2000] [--messages 12] [--reply-chars 2000]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from context import stored_message  # noqa: E402
+from sessions import MemorySessionStore  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "replies.json")
+QUESTIONS = ["ما هي أسباب انخفاض إنتاج البئر؟", "How do I size an ESP for 1500 bbl/d?"]
+
+
+def long_reply(replies, start, chars):
+    """ردود الـ corpus متتالية بدءاً من start حتى chars حرفاً على الأقل"""
+    parts = []
+    while sum(len(part) for part in parts) < chars:
+        parts.append(replies[(start + len(parts)) % len(replies)])
+    return "\n\n".join(parts)
+
+
+def conversation(replies, count, reply_chars):
+    """count رسالة بالتناوب سؤال/رد"""
+    messages = []
+    for index in range(count):
+        if index % 2 == 0:
+            messages.append(("user", QUESTIONS[index // 2 % len(QUESTIONS)] + f" ({index})"))
+        else:
+            messages.append(("assistant", long_reply(replies, index // 2, reply_chars) + f"\n\n({index})"))
+    return messages
+
+
+def legacy_store(session_ids, messages):
+    sessions = OrderedDict()
+    for session_id in session_ids:
+        session = sessions[session_id] = {'messages': [], 'last_activity': datetime.now(), 'context': {}}
+        for role, content in messages:
+            # نسخة جديدة من النص لكل جلسة كما يحدث مع رسائل حقيقية
+            session['messages'].append(stored_message(role, content[:-1] + content[-1]))
+    return sessions
+
+
+def compact_store(session_ids, messages):
+    store = MemorySessionStore(timedelta(hours=1), len(session_ids) + 1, len(messages), max_bytes=None)
+    for session_id in session_ids:
+        for role, content in messages:
+            store.append_message(session_id, role, content[:-1] + content[-1])
+    return store
+
+
+def measure(build, *args):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = build(*args)
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, after - before
+
+
+def read_time(history, repeat=200):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for message in history:
+            message["content"]
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=12)
+    parser.add_argument("--reply-chars", type=int, default=2000, help="approximate length of each assistant reply")
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+    session_ids = [f"{index:08d}-session" for index in range(args.sessions)]
+
+    print(f"{args.sessions} sessions x {args.messages} messages, replies ~{args.reply_chars} chars")
+    print(f"{'corpus':<10} {'legacy KiB/session':>19} {'compact KiB/session':>20} {'ratio':>6} "
+          f"{'accounted KiB':>14} {'read us/history':>16}")
+    for language, replies in corpus.items():
+        messages = conversation(replies, args.messages, args.reply_chars)
+        legacy, legacy_bytes = measure(legacy_store, session_ids, messages)
+        legacy_read = read_time(legacy[session_ids[0]]['messages'])
+        del legacy
+
+        store, compact_bytes = measure(compact_store, session_ids, messages)
+        compact_read = read_time(store.get(session_ids[0]).messages)
+        accounted = store.memory_stats()["bytes"]
+        del store
+
+        print(f"{language:<10} {legacy_bytes / args.sessions / 1024:>19.1f} "
+              f"{compact_bytes / args.sessions / 1024:>20.1f} {legacy_bytes / compact_bytes:>6.1f} "
+              f"{accounted / args.sessions / 1024:>14.1f} {legacy_read:>7.1f} -> {compact_read:<7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+زمن استرجاع الجلسات بعد إعادة التشغيل مع SESSION_LOG_DIR (journal.py).
+
+يبني مجلداً مؤقتاً فيه لقطة لـ --sessions جلسة (كل جلسة --messages رسالة) ثم
+ملف WAL فيه --tail رسالة أحدث من اللقطة، كما يحدث بعد النشر. بعدها يقيس:
+- تكلفة الكتابة في السجل لكل add_message_to_history
+- زمن الدمج (بناء اللقطة)
+- زمن الاسترجاع (فهرس اللقطة + المرور على WAL)، والهدف أقل من ثانية لـ 100k جلسة
+- زمن أول طلب لجلسة قديمة (قراءتها من القرص) وحجم الفهرس في الذاكرة
+
+الاستخدام:
+    python benchmarks/bench_session_recovery.py [--sessions 100000] [--messages 6] [--tail 20000]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from journal import SessionJournal  # noqa: E402
+from sessions import MemorySessionStore  # noqa: E402
+
+QUESTION = "كيف أختار حجم المضخة الغاطسة لبئر ينتج 1500 برميل يومياً؟"
+REPLY = ("حجم المضخة يعتمد على معدل الإنتاج المطلوب والعمق الديناميكي لمستوى السائل "
+         "ونسبة الماء والغاز. **أولاً** احسب TDH ثم اختر عدد المراحل من منحنى الأداء. ") * 3
+
+
+def new_store(directory, max_messages):
+    journal = SessionJournal(directory, snapshot_interval=3600)
+    return journal, MemorySessionStore(timedelta(hours=1), 10 ** 7, max_messages, journal=journal)
+
+
+def populate(directory, sessions, messages, tail):
+    journal, store = new_store(directory, messages)
+    journal.ready.wait()
+    session_ids = [f"session-{index:07d}" for index in range(sessions)]
+
+    started = time.perf_counter()
+    for session_id in session_ids:
+        for index in range(messages):
+            if index % 2 == 0:
+                store.append_message(session_id, "user", f"{QUESTION} ({index})")
+            else:
+                store.append_message(session_id, "assistant", f"{REPLY} ({index})")
+    append_us = (time.perf_counter() - started) / (sessions * messages) * 1e6
+
+    # بدون سجل للمقارنة
+    plain = MemorySessionStore(timedelta(hours=1), 10 ** 7, messages)
+    started = time.perf_counter()
+    for session_id in session_ids[:min(sessions, 20000)]:
+        for index in range(messages):
+            if index % 2 == 0:
+                plain.append_message(session_id, "user", f"{QUESTION} ({index})")
+            else:
+                plain.append_message(session_id, "assistant", f"{REPLY} ({index})")
+    plain_us = (time.perf_counter() - started) / (min(sessions, 20000) * messages) * 1e6
+    del plain
+
+    journal.rotate()
+    started = time.perf_counter()
+    journal.compact()
+    compact_s = time.perf_counter() - started
+
+    for index in range(tail):
+        store.append_message(session_ids[index * 7919 % sessions], "user", f"tail {index}")
+    journal.rotate()
+    return session_ids, append_us, plain_us, compact_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=6)
+    parser.add_argument("--tail", type=int, default=20000, help="messages written after the snapshot")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="session-journal-")
+    try:
+        session_ids, append_us, plain_us, compact_s = populate(
+            directory, args.sessions, args.messages, args.tail
+        )
+        files = {name: os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)}
+        print(f"{args.sessions} sessions x {args.messages} messages + {args.tail} WAL records")
+        print("  files: " + ", ".join(f"{name} {size / 2 ** 20:.1f} MiB" for name, size in sorted(files.items())))
+        print(f"  append: {append_us:.1f} us with journal vs {plain_us:.1f} us without")
+        print(f"  compaction: {compact_s:.2f} s")
+
+        # إعادة تشغيل: مخزن جديد يسترجع من نفس المجلد. الحجم من أول تشغيل والزمن من الثاني لأن tracemalloc يبطئ الأول
+        tracemalloc.start()
+        journal, store = new_store(directory, args.messages)
+        journal.ready.wait()
+        index_bytes, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del journal, store
+        journal, store = new_store(directory, args.messages)
+        journal.ready.wait()
+        print(f"  recovery: {journal.recovery_seconds:.3f} s for {journal.recovered} sessions, "
+              f"index {index_bytes / 2 ** 20:.1f} MiB")
+
+        sample = random.Random(1).sample(session_ids, min(1000, len(session_ids)))
+        timings = []
+        for session_id in sample:
+            started = time.perf_counter()
+            session = store.get(session_id)
+            timings.append(time.perf_counter() - started)
+            assert len(session.messages) >= min(args.messages, 2)
+        timings.sort()
+        print(f"  first get of a recovered session: p50 {timings[len(timings) // 2] * 1e6:.0f} us, "
+              f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f} us")
+
+        started = time.perf_counter()
+        store.get(sample[0])
+        print(f"  later get: {(time.perf_counter() - started) * 1e6:.1f} us")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
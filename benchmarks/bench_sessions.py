@@ -0,0 +1,71 @@
+"""
+قياس تكلفة إدارة الجلسات لكل طلب /chat مع زيادة عدد الجلسات النشطة.
+
+كل "طلب" هنا = cleanup_old_conversations + get_conversation_history
++ رسالتين add_message_to_history، وهو نفس ما يفعله chat() مع الجلسات.
+للمقارنة يقاس أيضاً التنظيف القديم الذي يمر على كل الجلسات.
+
+الاستخدام:
+    python benchmarks/bench_sessions.py [1000 10000 100000 1000000]
+"""
+import os
+import sys
+import time
+import uuid
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("SESSION_SWEEP_INTERVAL", "0")
+os.environ.setdefault("MAX_SESSIONS", "2000000")
+os.environ["SESSION_BACKEND"] = "memory"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+REQUESTS = 20000
+LEGACY_REQUESTS = 5
+
+
+def legacy_cleanup():
+    """التنظيف القديم: مرور كامل على كل الجلسات في كل طلب"""
+    current_time = time.time()
+    expired_sessions = []
+    sessions = server.session_store.sessions
+    for session_id, session_data in sessions.items():
+        if current_time - session_data.last_activity > 3600:
+            expired_sessions.append(session_id)
+    for session_id in expired_sessions:
+        del sessions[session_id]
+
+
+def populate(count):
+    server.session_store.sessions.clear()
+    server.session_store.bytes = 0
+    session_ids = [str(uuid.uuid4()) for _ in range(count)]
+    for session_id in session_ids:
+        server.create_session(session_id)
+    return session_ids
+
+
+def run_requests(session_ids, cleanup, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        session_id = session_ids[(i * 7919) % len(session_ids)]
+        cleanup()
+        server.get_conversation_history(session_id)
+        server.add_message_to_history(session_id, "user", "ما هو الرفع الاصطناعي؟")
+        server.add_message_to_history(session_id, "assistant", "الرفع الاصطناعي هو ...")
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000]
+    print(f"{'sessions':>10} {'indexed us/req':>16} {'full-scan us/req':>18}")
+    for count in sizes:
+        session_ids = populate(count)
+        indexed = run_requests(session_ids, server.cleanup_old_conversations, REQUESTS)
+        legacy = run_requests(session_ids, legacy_cleanup, LEGACY_REQUESTS)
+        print(f"{count:>10} {indexed:>16.2f} {legacy:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+فحص عنوان المستخدم في حدود الطلبات لكل IP (server.client_ip و asgi.client_ip)
+مقابل stub_groq.py، في Flask و ASGI:
+- بدون TRUST_FORWARDED_FOR: X-Forwarded-For يهمل كلياً، والحد على عنوان الاتصال
+- مع TRUST_FORWARDED_FOR: تغيير أول عنوان في X-Forwarded-For مع كل طلب لا يعيد الرصيد،
+  لأن العنوان المأخوذ هو ما أضافه البروكسي من اليمين (TRUSTED_PROXY_COUNT)
+- مستخدم آخر خلف نفس البروكسي له رصيده الخاص
+
+الاستخدام:
+    python benchmarks/check_client_ip.py
+"""
+import os
+import sys
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+STUB_PORT = 18010
+BURST = 5
+
+# رصيد IP لا يكاد يمتلئ أثناء الفحص، وحد الجلسة والكاش معطلان حتى يبقى حد الـ IP وحده
+os.environ.update(GROQ_API_KEY="check", GROQ_BASE_URL=f"http://127.0.0.1:{STUB_PORT}", SESSION_SWEEP_INTERVAL="0",
+                  ADMISSION_BACKEND="memory", ADMISSION_SESSION_RATE="0", ADMISSION_IP_RATE="0.001",
+                  ADMISSION_IP_BURST=str(BURST), COMPLETION_CACHE_SIZE="0", JOBS_BACKEND="memory",
+                  TRUST_FORWARDED_FOR="1", TRUSTED_PROXY_COUNT="1")
+
+import server  # noqa: E402
+from bench_asgi import start  # noqa: E402
+
+requests_sent = 0
+
+
+def fail(message):
+    raise SystemExit(f"FAIL {message}")
+
+
+def check(name, actual, expected):
+    if actual != expected:
+        fail(f"{name}: {actual!r} != {expected!r}")
+    print(f"ok   {name}")
+
+
+def statuses(post, count, forwarded):
+    """count طلبات /chat بأسئلة وجلسات مختلفة؛ forwarded(i) قيمة X-Forwarded-For أو None"""
+    global requests_sent
+    codes = []
+    for index in range(count):
+        requests_sent += 1
+        headers = {} if forwarded(index) is None else {"X-Forwarded-For": forwarded(index)}
+        response = post("/chat", json={"message": f"How does an ESP pump work in well {requests_sent}?",
+                                       "session_id": f"ip-check-{requests_sent}"}, headers=headers)
+        codes.append(response.status_code)
+    return codes.count(200), codes.count(429)
+
+
+def check_forwarded_client():
+    server.TRUST_FORWARDED_FOR, server.TRUSTED_PROXY_COUNT = False, 1
+    check("untrusted header ignored", server.forwarded_client("1.1.1.1, 2.2.2.2", "10.0.0.1"), "10.0.0.1")
+    server.TRUST_FORWARDED_FOR = True
+    check("rightmost hop", server.forwarded_client("1.1.1.1, 2.2.2.2", "10.0.0.1"), "2.2.2.2")
+    check("no header", server.forwarded_client(None, "10.0.0.1"), "10.0.0.1")
+    check("empty header", server.forwarded_client(" , ", "10.0.0.1"), "10.0.0.1")
+    server.TRUSTED_PROXY_COUNT = 2
+    check("two proxies", server.forwarded_client("1.1.1.1, 2.2.2.2, 3.3.3.3", "10.0.0.1"), "2.2.2.2")
+    check("shorter than the proxy count", server.forwarded_client("2.2.2.2", "10.0.0.1"), "2.2.2.2")
+    server.TRUSTED_PROXY_COUNT = 1
+
+
+def check_app(name, post, base):
+    """base: لاحقة حتى لا تتشارك الأجزاء نفس العناوين"""
+    server.TRUST_FORWARDED_FOR = True
+    spoofed = statuses(post, BURST + 5, lambda index: f"198.51.{base}.{index}, 203.0.{base}.7")
+    check(f"{name}: spoofed leading X-Forwarded-For keeps one bucket", spoofed, (BURST, 5))
+    check(f"{name}: another client behind the proxy", statuses(post, 1, lambda _: f"203.0.{base}.8"), (1, 0))
+
+    # بدون ثقة بالبروكسي كل الطلبات على عنوان الاتصال مهما كان الـ header
+    server.TRUST_FORWARDED_FOR = False
+    untrusted = statuses(post, BURST + 2, lambda index: f"198.51.{base}.{100 + index}")
+    check(f"{name}: header ignored without TRUST_FORWARDED_FOR", untrusted, (BURST, 2))
+    server.TRUST_FORWARDED_FOR = True
+
+
+def main():
+    stub = start([sys.executable, "benchmarks/stub_groq.py", "--port", str(STUB_PORT), "--latency", "0.01"],
+                 STUB_PORT, dict(os.environ))
+    try:
+        check_forwarded_client()
+
+        client = server.app.test_client()
+        check_app("flask", lambda *args, **kwargs: client.post(*args, environ_base={"REMOTE_ADDR": "10.0.0.1"},
+                                                              **kwargs), 1)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            import asgi
+            from starlette.testclient import TestClient
+        with TestClient(asgi.app) as asgi_client:
+            check_app("asgi", asgi_client.post, 2)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    main()
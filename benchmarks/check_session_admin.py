@@ -0,0 +1,238 @@
+"""
+فحص /admin/sessions و /admin/sessions/stats: صفحات list_sessions والعدادات
+التي تحدث مع كل تعديل (sessions.py) مقارنة بحساب كامل من الجلسات نفسها.
+
+لكل مخزن (الذاكرة، الذاكرة مع SESSION_LOG_DIR بعد إعادة التشغيل، SQLite):
+عمليات عشوائية (رسائل، إنشاء، مسح، قراءة، تنظيف، حذف بالحدود) بساعة وهمية
+تتقدم بخطوات من أجزاء الثانية حتى دقائق، ثم:
+- session_stats و memory_stats تساوي الحساب الكامل
+- كل الصفحات بعدة أحجام ومرشحات تساوي الترتيب والترشيح الكامل، بدون تكرار أو نقص
+وأخيراً ترحيل قاعدة SQLite بالمخطط القديم ومؤشر غير صالح.
+
+الاستخدام:
+    python benchmarks/check_session_admin.py [--operations 6000] [--seed 1]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sessions  # noqa: E402
+from journal import SessionJournal  # noqa: E402
+from sessions import MemorySessionStore, SQLiteSessionStore, last_user_language, session_matches, stats_payload  # noqa: E402
+
+TTL = timedelta(seconds=3000)
+MESSAGES = ["hello there", "ما هو الباكر؟", "x" * 400, "شرح " * 100]
+FILTERS = [
+    {},
+    {"min_messages": 3},
+    {"max_messages": 1},
+    {"active_after": 0.5},
+    {"active_before": 0.5, "min_messages": 2},
+]
+
+
+class FakeClock:
+    """time.time لـ sessions.py فقط، تتقدم بيد الفحص"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def fail(message):
+    raise SystemExit(f"FAIL {message}")
+
+
+def run(store, clock, rng, operations, session_count=300):
+    for _ in range(operations):
+        clock.now += rng.choice([0, 0.001, 0.5, 7, 70])
+        session_id = f"s{rng.randrange(session_count)}"
+        roll = rng.random()
+        if roll < 0.6:
+            store.append_message(session_id, rng.choice(["user", "assistant"]), rng.choice(MESSAGES))
+        elif roll < 0.7:
+            store.create(session_id)
+        elif roll < 0.75:
+            store.clear(session_id)
+        elif roll < 0.85:
+            store.get(session_id)
+        elif roll < 0.9:
+            store.cleanup(rng.choice([None, 3]))
+
+
+def expected_stats(rows):
+    """rows: [(session_id, last_activity, messages)] -> stats_payload"""
+    histogram, languages = {}, {}
+    for _, _, messages in rows:
+        histogram[len(messages)] = histogram.get(len(messages), 0) + 1
+        language = last_user_language(messages) or "none"
+        languages[language] = languages.get(language, 0) + 1
+    return stats_payload(len(rows), histogram, languages)
+
+
+def all_pages(store, limit, **filters):
+    found, cursor = [], None
+    while True:
+        page, cursor = store.list_sessions(limit, cursor, **filters)
+        found += [(item["session_id"], item["last_activity"], item["messages"]) for item in page]
+        if cursor is None:
+            return found
+
+
+def check_store(name, store, rows):
+    stats = store.session_stats()
+    if stats != expected_stats(rows):
+        fail(f"{name} session_stats: {stats} != {expected_stats(rows)}")
+
+    counted = [(session_id, last_activity, len(messages)) for session_id, last_activity, messages in rows]
+    low = min(row[1] for row in counted)
+    high = max(row[1] for row in counted)
+    for filters in FILTERS:
+        # 0.5 في المرشحات = منتصف مدى النشاط
+        filters = {key: low + (high - low) * value if key.startswith("active") else value
+                   for key, value in filters.items()}
+        wanted = sorted((row for row in counted if session_matches(row[1], row[2], filters.get("active_after"),
+                                                                    filters.get("active_before"),
+                                                                    filters.get("min_messages"),
+                                                                    filters.get("max_messages"))),
+                        key=lambda row: (row[1], row[0]), reverse=True)
+        for limit in (1, 7, 1000):
+            if all_pages(store, limit, **filters) != wanted:
+                fail(f"{name} list_sessions limit={limit} filters={filters}")
+    print(f"ok   {name}: {len(rows)} sessions, {stats['messages']} messages, languages {stats['languages']}")
+
+
+def memory_rows(store):
+    return [(session_id, session.last_activity, session.messages) for session_id, session in store.sessions.items()]
+
+
+def check_memory_counters(name, store):
+    memory = store.memory_stats()
+    messages = [message for session in store.sessions.values() for message in session.messages]
+    if memory["messages"] != len(messages):
+        fail(f"{name} memory_stats messages")
+    if memory["compressed_messages"] != sum(isinstance(message.data, bytes) for message in messages):
+        fail(f"{name} memory_stats compressed_messages")
+    if sum(len(session_ids) for session_ids in store.activity.values()) != len(store.sessions):
+        fail(f"{name} activity index")
+
+
+def check_memory(clock, rng, operations):
+    store = MemorySessionStore(TTL, 250, 8, max_bytes=200_000)
+    run(store, clock, rng, operations)
+    check_memory_counters("memory", store)
+    check_store("memory", store, memory_rows(store))
+
+
+def check_journal(clock, rng, operations, directory):
+    """العدادات بعد استرجاع الجلسات من السجل (_restore) كما لو أنشئت في هذه العملية"""
+    store = MemorySessionStore(TTL, 250, 8, max_bytes=200_000, journal=SessionJournal(directory, 3600))
+    store.journal.ready.wait()
+    run(store, clock, rng, operations)
+    live = {session_id: [(m["role"], m["content"]) for m in session.messages]
+            for session_id, session in store.sessions.items()}
+
+    restarted = MemorySessionStore(TTL, 250, 8, max_bytes=200_000, journal=SessionJournal(directory, 3600))
+    restarted.journal.ready.wait()
+    for session_id in live:
+        restarted.get(session_id)
+    restored = {session_id: [(m["role"], m["content"]) for m in session.messages]
+                for session_id, session in restarted.sessions.items()}
+    if restored != live:
+        fail("memory+journal: restored sessions differ from live sessions")
+    check_memory_counters("memory+journal", restarted)
+    check_store("memory+journal restarted", restarted, memory_rows(restarted))
+
+
+def check_sqlite(clock, rng, operations, directory):
+    path = os.path.join(directory, "sessions.db")
+    store = SQLiteSessionStore(path, TTL, 250, 8)
+    run(store, clock, rng, operations)
+    db = sqlite3.connect(path)
+    rows = [(session_id, last_activity, json.loads(messages))
+            for session_id, last_activity, messages in
+            db.execute("SELECT session_id, last_activity, messages FROM sessions")]
+    db.close()
+    check_store("sqlite", store, rows)
+
+
+def check_migration(directory):
+    """قاعدة من قبل message_count و language و session_stats"""
+    path = os.path.join(directory, "old.db")
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE sessions (session_id TEXT PRIMARY KEY, messages TEXT NOT NULL,
+                               last_activity REAL NOT NULL, version INTEGER NOT NULL);
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT INTO meta VALUES ('session_count', 2), ('version', 2);
+    """)
+    now = time.time()
+    db.execute("INSERT INTO sessions VALUES ('a', ?, ?, 1)", (json.dumps([{"role": "user", "content": "hi"}]), now))
+    db.execute("INSERT INTO sessions VALUES ('b', '[]', ?, 2)", (now - 1,))
+    db.commit()
+    db.close()
+
+    store = SQLiteSessionStore(path, TTL, 250, 8)
+    # اللغة لا تكشف في SQL فالجلسات المرحلة "none" حتى رسالة المستخدم التالية
+    expected = stats_payload(2, {1: 1, 0: 1}, {"none": 2})
+    if store.session_stats() != expected:
+        fail(f"migration stats: {store.session_stats()} != {expected}")
+    store.append_message("b", "user", "ما هو الباكر؟")
+    page, _ = store.list_sessions(10)
+    if [(item["session_id"], item["messages"], item["language"]) for item in page] != [("b", 1, "arabic"),
+                                                                                        ("a", 1, None)]:
+        fail(f"migration list_sessions: {page}")
+    print("ok   sqlite migration from the old schema")
+
+
+def check_bad_cursor():
+    store = MemorySessionStore(TTL, 10, 8)
+    store.append_message("a", "user", "hi")
+    try:
+        store.list_sessions(5, "garbage!")
+    except ValueError:
+        print("ok   invalid cursor raises ValueError")
+        return
+    fail("invalid cursor accepted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operations", type=int, default=6000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # يبدأ من الآن حتى لا يعتبر السجل الجلسات المسترجعة منتهية
+    clock = FakeClock(time.time())
+    sessions.time = clock
+    directory = tempfile.mkdtemp(prefix="admin-check-")
+    try:
+        check_memory(clock, rng, args.operations)
+        check_journal(clock, rng, args.operations, os.path.join(directory, "journal"))
+        check_sqlite(clock, rng, args.operations, directory)
+        sessions.time = time
+        check_migration(directory)
+        check_bad_cursor()
+    finally:
+        sessions.time = time
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
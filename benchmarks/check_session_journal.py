@@ -0,0 +1,245 @@
+"""
+فحص استرجاع الجلسات بعد إعادة التشغيل (journal.py مع MemorySessionStore).
+
+كل حالة تكتب في مجلد مؤقت ثم "تعيد التشغيل" بسجل ومخزن جديدين على نفس المجلد
+(السجل القديم لا يغلق ملفه، كعملية ماتت) وتقارن ما يسترجع بما كان في الذاكرة:
+- جلسة حذفت لتجاوز max_sessions أو max_bytes لا تعود رسائلها، ولا تسبق رسائل
+  جلسة جديدة بنفس المعرف (قبل الدمج وبعده)
+- جلسة انتهت بـ TTL ثم أعيد استخدام معرفها
+- /clear_history و create
+- سجل ناقص في آخر ملف WAL (توقفت العملية أثناء الكتابة)
+- أثناء استرجاع بطيء: معرف جديد لا ينتظر، والجلسات المحفوظة تنتظر وتعود كاملة
+- لقطة بالإصدار 1 (بدون بصمات المعرفات) بعد التحديث
+- عمليات عشوائية (رسائل، مسح، إنشاء، حذف بالحدود، دمج) ثم المقارنة جلسة جلسة
+
+الاستخدام:
+    python benchmarks/check_session_journal.py [--rounds 20] [--operations 400] [--seed 1]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import journal as journal_module  # noqa: E402
+from journal import SessionJournal  # noqa: E402
+from sessions import MemorySessionStore  # noqa: E402
+
+
+def open_store(directory, ttl=3600, max_sessions=1000, max_messages=6, max_bytes=None):
+    journal = SessionJournal(directory, snapshot_interval=3600)
+    store = MemorySessionStore(timedelta(seconds=ttl), max_sessions, max_messages, max_bytes, journal=journal)
+    journal.ready.wait()
+    return journal, store
+
+
+def compact(journal):
+    journal.rotate()
+    journal.compact()
+
+
+def contents(store, session_id):
+    return [(message["role"], message["content"]) for message in store.get(session_id).messages]
+
+
+def check(name, actual, expected):
+    if actual != expected:
+        raise SystemExit(f"FAIL {name}: {actual!r} != {expected!r}")
+    print(f"ok   {name}")
+
+
+def evicted_by_max_sessions(directory, compacted):
+    journal, store = open_store(directory, max_sessions=2)
+    store.append_message("a", "user", "old secret question")
+    store.append_message("a", "assistant", "old answer")
+    store.append_message("b", "user", "b")
+    store.append_message("c", "user", "c")  # يحذف a
+    store.append_message("a", "user", "new question after eviction")
+    if compacted:
+        compact(journal)
+    _, restarted = open_store(directory, max_sessions=2)
+    check(f"max_sessions eviction, compacted={compacted}", contents(restarted, "a"),
+          [("user", "new question after eviction")])
+
+
+def evicted_by_max_bytes(directory):
+    journal, store = open_store(directory, max_bytes=20000)
+    store.append_message("a", "user", "old question " * 200)
+    for index in range(20):
+        store.append_message(f"s{index}", "user", "filler " * 200)
+    assert "a" not in store.sessions
+    compact(journal)
+    _, restarted = open_store(directory, max_bytes=20000)
+    check("max_bytes eviction, no new messages", contents(restarted, "a"), [])
+
+
+def expired_then_reused(directory):
+    journal, store = open_store(directory, ttl=2)
+    store.append_message("a", "user", "expired question")
+    time.sleep(2.2)
+    check("ttl cleanup", store.cleanup(), 1)
+    store.append_message("a", "user", "new question")
+    _, restarted = open_store(directory, ttl=2)
+    check("ttl expiry then same id", contents(restarted, "a"), [("user", "new question")])
+
+
+def cleared_and_created(directory):
+    journal, store = open_store(directory)
+    store.append_message("a", "user", "a1")
+    store.clear("a")
+    store.append_message("a", "user", "a2")
+    store.append_message("b", "user", "b1")
+    compact(journal)
+    store.create("b")
+    _, restarted = open_store(directory)
+    check("clear_history", contents(restarted, "a"), [("user", "a2")])
+    check("create on existing id", contents(restarted, "b"), [])
+
+
+def torn_tail(directory):
+    journal, store = open_store(directory)
+    store.append_message("a", "user", "a1")
+    store.append_message("a", "assistant", "a2")
+    store.append_message("a", "user", "a3")
+    segment = os.path.join(directory, journal.segment)
+    os.truncate(segment, os.path.getsize(segment) - 3)
+    _, restarted = open_store(directory)
+    check("torn last record", contents(restarted, "a"), [("user", "a1"), ("assistant", "a2")])
+
+
+def slow_recovery(directory, delay=1.5):
+    """فهرس اللقطة يتأخر delay ثانية: المعرفات الجديدة تعود فوراً والمحفوظة تنتظره"""
+    journal, store = open_store(directory)
+    store.append_message("in-snapshot", "user", "s1")
+    compact(journal)
+    store.append_message("in-wal", "user", "w1")
+
+    read_snapshot_index = journal_module.read_snapshot_index
+
+    def slow_index(*args, **kwargs):
+        time.sleep(delay)
+        return read_snapshot_index(*args, **kwargs)
+
+    journal_module.read_snapshot_index = slow_index
+    try:
+        restarted = MemorySessionStore(timedelta(hours=1), 1000, 6,
+                                       journal=SessionJournal(directory, snapshot_interval=3600))
+        restarted.journal.scanned.wait()
+        if restarted.journal.ready.is_set():
+            raise SystemExit("FAIL slow recovery: finished before the check")
+        waits = {}
+        for session_id in ("brand-new", "default"):
+            started = time.perf_counter()
+            restarted.append_message(session_id, "user", "hi")
+            waits[session_id] = time.perf_counter() - started
+        if max(waits.values()) > delay / 3:
+            raise SystemExit(f"FAIL slow recovery: new ids waited {waits}")
+        print(f"ok   new ids during slow recovery: {max(waits.values()) * 1e3:.1f} ms, recovery {delay} s")
+
+        saved = {}
+        threads = [threading.Thread(target=lambda sid=sid: saved.__setitem__(sid, contents(restarted, sid)))
+                   for sid in ("in-snapshot", "in-wal")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        journal_module.read_snapshot_index = read_snapshot_index
+    check("saved sessions wait for recovery", saved,
+          {"in-snapshot": [("user", "s1")], "in-wal": [("user", "w1")]})
+    check("new id created during recovery", contents(restarted, "brand-new"), [("user", "hi")])
+
+
+def version_1_snapshot(directory):
+    """لقطة من قبل بصمات المعرفات: تقرأ كاملة، والطلبات أثناء الاسترجاع تنتظره كما كانت"""
+    journal, store = open_store(directory)
+    store.append_message("a", "user", "a1")
+    store.append_message("b", "user", "b1")
+    compact(journal)
+    path = os.path.join(directory, journal_module.SNAPSHOT_NAME)
+    with open(path, 'rb') as f:
+        data = f.read()
+    index_offset, count, names_offset, names_length, _ = journal_module.read_trailer(data)
+    body = journal_module.SNAPSHOT_MAGIC_V1 + data[len(journal_module.SNAPSHOT_MAGIC):names_offset + names_length]
+    with open(path, 'wb') as f:
+        f.write(body + journal_module.TRAILER_V1.pack(index_offset, count, names_offset, names_length))
+    if not journal_module.snapshot_may_contain(journal_module.map_file(path), "anything"):
+        raise SystemExit("FAIL version 1 snapshot: ids treated as absent")
+    _, restarted = open_store(directory)
+    check("version 1 snapshot", [contents(restarted, "a"), contents(restarted, "b")], [[("user", "a1")], [("user", "b1")]])
+
+
+def random_operations(directory, operations, rng):
+    """كل الجلسات بعد إعادة التشغيل كما كانت في الذاكرة، والمحذوفة فارغة"""
+    limits = dict(max_sessions=12, max_messages=6, max_bytes=60000)
+    journal, store = open_store(directory, **limits)
+    session_ids = [f"s{index}" for index in range(30)]
+    for step in range(operations):
+        session_id = rng.choice(session_ids)
+        roll = rng.random()
+        if roll < 0.75:
+            role = rng.choice(("user", "assistant"))
+            store.append_message(session_id, role, f"{session_id}-{step} " * rng.choice((1, 20, 300)))
+        elif roll < 0.85:
+            store.clear(session_id)
+        elif roll < 0.9:
+            store.create(session_id)
+        elif roll < 0.95:
+            compact(journal)
+        else:
+            # إعادة تشغيل وسط العمليات: المتابعة على المخزن الجديد
+            live = {sid: contents(store, sid) for sid in list(store.sessions)}
+            journal, store = open_store(directory, **limits)
+            for sid, messages in live.items():
+                if contents(store, sid) != messages:
+                    raise SystemExit(f"FAIL random restart at step {step}: {sid}")
+
+    live = {sid: [(m["role"], m["content"]) for m in session.messages] for sid, session in store.sessions.items()}
+    if rng.random() < 0.5:
+        compact(journal)
+    _, restarted = open_store(directory, **limits)
+    for session_id in session_ids:
+        expected = live.get(session_id, [])
+        if contents(restarted, session_id) != expected:
+            raise SystemExit(f"FAIL random: {session_id} restored {contents(restarted, session_id)!r}, "
+                             f"live {expected!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20, help="random operation rounds")
+    parser.add_argument("--operations", type=int, default=400, help="operations per round")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    cases = [
+        lambda directory: evicted_by_max_sessions(directory, compacted=False),
+        lambda directory: evicted_by_max_sessions(directory, compacted=True),
+        evicted_by_max_bytes,
+        expired_then_reused,
+        cleared_and_created,
+        torn_tail,
+        slow_recovery,
+        version_1_snapshot,
+    ]
+    rng = random.Random(args.seed)
+    cases += [lambda directory: random_operations(directory, args.operations, rng)] * args.rounds
+
+    for case in cases:
+        directory = tempfile.mkdtemp(prefix="journal-check-")
+        try:
+            case(directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    print(f"ok   {args.rounds} random rounds x {args.operations} operations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+فحص خروج المشتركين من البث المشترك (singleflight.py) عندما لا تقرأ الاستجابة أبداً:
+العميل ينقطع قبل أول قطعة فلا يبدأ مولد SSE، ويجب أن يغلق الاشتراك ويتوقف القارئ
+عن قراءة Groq بدل إكمال البث لغير أحد.
+
+- SingleFlight و AsyncSingleFlight مباشرة: اشتراك يغلق بدون قراءة، ومشترك يغادر
+  بينما آخر يكمل القراءة، وإغلاق الاشتراك أكثر من مرة
+- /chat/stream في Flask: استجابة تغلق بدون قراءة (call_on_close)
+- /chat/stream في ASGI: الاتصال ينقطع عند أول send فلا يبدأ المولد (ReleasingResponse)
+
+الاستخدام:
+    python benchmarks/check_single_flight.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+import warnings
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+STUB_PORT = 18011
+# 27 كلمة في رد الـ stub، فالبث الكامل نحو 2.7 ثانية
+TOKEN_RATE = 10
+WORDS = 27
+
+os.environ.update(GROQ_API_KEY="check", GROQ_BASE_URL=f"http://127.0.0.1:{STUB_PORT}", SESSION_SWEEP_INTERVAL="0",
+                  ADMISSION_BACKEND="memory", COMPLETION_CACHE_SIZE="0", JOBS_BACKEND="memory")
+
+import server  # noqa: E402
+from bench_asgi import start  # noqa: E402
+from singleflight import AsyncSingleFlight, SingleFlight  # noqa: E402
+
+
+def fail(message):
+    raise SystemExit(f"FAIL {message}")
+
+
+def check(name, actual, expected):
+    if actual != expected:
+        fail(f"{name}: {actual!r} != {expected!r}")
+    print(f"ok   {name}")
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class SlowUpstream:
+    """بث وهمي: chunks قطعة كل delay ثانية، ويعد ما قرئ منه"""
+
+    def __init__(self, chunks=100, delay=0.01):
+        self.chunks = chunks
+        self.delay = delay
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for index in range(self.chunks):
+            time.sleep(self.delay)
+            self.read += 1
+            yield chunk(f"{index} ")
+
+    async def __aiter__(self):
+        for index in range(self.chunks):
+            await asyncio.sleep(self.delay)
+            self.read += 1
+            yield chunk(f"{index} ")
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncSlowUpstream(SlowUpstream):
+    async def close(self):
+        self.closed = True
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def check_threads():
+    flight = SingleFlight(timeout=5)
+    upstream = SlowUpstream()
+    subscription = flight.stream("k", lambda: upstream)
+    shared = flight.streams["k"]
+    subscription.close()
+    if not wait_until(lambda: upstream.closed):
+        fail("threads: pump still reading after an unread subscription closed")
+    check("threads: unread subscription stops the pump", (shared.cancelled, shared.members, flight.streams),
+          (True, set(), {}))
+    if upstream.read >= upstream.chunks:
+        fail("threads: the whole upstream stream was read")
+
+    upstream = SlowUpstream(chunks=20)
+    reader = flight.stream("k", lambda: upstream)
+    leaving = flight.stream("k", lambda: None)
+    leaving.close()
+    leaving.close()
+    text = "".join(reader)
+    reader.close()
+    check("threads: one subscriber leaves, the other reads everything", (text, upstream.read),
+          ("".join(f"{index} " for index in range(20)), 20))
+
+
+async def check_asyncio():
+    flight = AsyncSingleFlight(timeout=5)
+    upstream = AsyncSlowUpstream()
+
+    async def open_stream():
+        return upstream
+
+    subscription = await flight.stream("k", open_stream)
+    shared = flight.streams["k"]
+    await subscription.aclose()
+    for _ in range(200):
+        if upstream.closed:
+            break
+        await asyncio.sleep(0.01)
+    check("asyncio: unread subscription stops the pump", (upstream.closed, shared.cancelled, flight.streams),
+          (True, True, {}))
+    if upstream.read >= upstream.chunks:
+        fail("asyncio: the whole upstream stream was read")
+
+
+def stream_request(message):
+    return json.dumps({"message": message, "session_id": "flight-check"}).encode("utf-8")
+
+
+def check_flask():
+    client = server.app.test_client()
+    response = client.post("/chat/stream", data=stream_request("How does gas lift work in deep wells?"),
+                           content_type="application/json", buffered=False)
+    check("flask: stream opened", response.status_code, 200)
+    (shared,) = server.upstream_flights.streams.values()
+    started = time.monotonic()
+    response.close()
+    if not wait_until(lambda: shared.done):
+        fail("flask: pump still reading after the response closed unread")
+    check("flask: unread response releases the stream", (shared.cancelled, shared.members), (True, set()))
+    print(f"     stopped after {time.monotonic() - started:.2f}s and {len(shared.pieces)} of {WORDS} words")
+    if len(shared.pieces) >= WORDS:
+        fail("flask: the whole upstream stream was read")
+
+
+def check_asgi():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        import asgi
+
+    async def run():
+        body = stream_request("How does an ESP pump handle gas?")
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+                 "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream", "query_string": b"",
+                 "root_path": "", "headers": [(b"content-type", b"application/json"),
+                                              (b"content-length", str(len(body)).encode())],
+                 "client": ("127.0.0.1", 5000), "server": ("127.0.0.1", 8000)}
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(3600)
+
+        streams = []
+
+        async def send(message):
+            # الاتصال مقطوع قبل أول بايت: المولد لا يبدأ أبداً
+            streams.extend(asgi.upstream_flights.streams.values())
+            raise OSError("client disconnected")
+
+        try:
+            await asgi.app(scope, receive, send)
+        except OSError:
+            pass
+        (shared,) = streams
+        for _ in range(200):
+            if shared.done:
+                break
+            await asyncio.sleep(0.01)
+        check("asgi: disconnect before the first chunk releases the stream",
+              (shared.done, shared.cancelled, shared.members), (True, True, set()))
+        if len(shared.pieces) >= WORDS:
+            fail("asgi: the whole upstream stream was read")
+        check("asgi: admission slot released", asgi.admission.state.stats()["active"], 0)
+
+    asyncio.run(run())
+
+
+def main():
+    check_threads()
+    asyncio.run(check_asyncio())
+    stub = start([sys.executable, "benchmarks/stub_groq.py", "--port", str(STUB_PORT), "--latency", "0.05",
+                  "--token-rate", str(TOKEN_RATE)], STUB_PORT, dict(os.environ))
+    try:
+        check_flask()
+        check_asgi()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    main()
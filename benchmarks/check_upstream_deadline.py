@@ -0,0 +1,163 @@
+"""
+فحص أن UPSTREAM_DEADLINE مهلة كلية للاستدعاء (upstream.py) وليست مهلة لكل مرحلة:
+خادم محلي يرسل الترويسات فوراً ثم:
+- drip-body: جسم JSON بايتاً كل 50ms (الرد كاملاً نحو 10 ثوان)
+- drip-stream: قطعة بث كل 100ms لمدة 30 ثانية
+- stall-stream: قطعة واحدة ثم صمت 30 ثانية
+ومع UPSTREAM_DEADLINE=1 يجب أن يتوقف كل منها بـ UpstreamDeadline قرب الثانية،
+في Upstream (الخيوط) و AsyncUpstream، ورد عادي سريع يبقى كما هو.
+
+الاستخدام:
+    python benchmarks/check_upstream_deadline.py
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+PORT = 18012
+DEADLINE = 1.0
+# هامش لبطء الجهاز، والمهم أنه أقل بكثير من زمن الرد كاملاً
+SLACK = 0.6
+
+os.environ.update(GROQ_BASE_URL=f"http://127.0.0.1:{PORT}", UPSTREAM_DEADLINE=str(DEADLINE),
+                  UPSTREAM_MAX_RETRIES="0", UPSTREAM_BREAKER_THRESHOLD="0")
+
+from upstream import UpstreamDeadline, create_async_upstream, create_upstream  # noqa: E402
+
+
+def completion(model):
+    return {"id": "check", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok " * 60},
+                         "finish_reason": "stop"}]}
+
+
+def chunk(model, text):
+    data = {"id": "check", "object": "chat.completion.chunk", "created": 0, "model": model,
+            "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+    return f"data: {json.dumps(data)}\n\n".encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        model = request["model"]
+        streaming = request.get("stream")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if streaming else "application/json")
+        if not streaming:
+            body = json.dumps(completion(model)).encode()
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.flush()
+        try:
+            if model == "fast":
+                if streaming:
+                    self.wfile.write(chunk(model, "ok") + b"data: [DONE]\n\n")
+                else:
+                    self.wfile.write(body)
+            elif model == "drip-body":
+                for index in range(len(body)):
+                    self.wfile.write(body[index:index + 1])
+                    self.wfile.flush()
+                    time.sleep(0.05)
+            elif model == "drip-stream":
+                for _ in range(300):
+                    self.wfile.write(chunk(model, "x "))
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            elif model == "stall-stream":
+                self.wfile.write(chunk(model, "x "))
+                self.wfile.flush()
+                time.sleep(30)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def fail(message):
+    raise SystemExit(f"FAIL {message}")
+
+
+def report(name, started, error):
+    elapsed = time.monotonic() - started
+    if not isinstance(error, UpstreamDeadline):
+        fail(f"{name}: {error!r} after {elapsed:.2f}s, expected UpstreamDeadline")
+    if elapsed > DEADLINE + SLACK:
+        fail(f"{name}: stopped after {elapsed:.2f}s, deadline {DEADLINE}s")
+    print(f"ok   {name}: UpstreamDeadline after {elapsed:.2f}s")
+
+
+def check_threads():
+    upstream = create_upstream("check")
+    reply = upstream.create(model="fast", messages=[{"role": "user", "content": "hi"}])
+    if not reply.choices[0].message.content.startswith("ok"):
+        fail("threads: fast reply")
+    print("ok   threads: fast reply")
+
+    started = time.monotonic()
+    try:
+        upstream.create(model="drip-body", messages=[{"role": "user", "content": "hi"}])
+        error = None
+    except Exception as e:
+        error = e
+    report("threads: slow-drip body", started, error)
+
+    for model in ("drip-stream", "stall-stream"):
+        started = time.monotonic()
+        try:
+            for _ in upstream.create(model=model, messages=[{"role": "user", "content": "hi"}], stream=True):
+                pass
+            error = None
+        except Exception as e:
+            error = e
+        report(f"threads: {model}", started, error)
+
+
+async def check_asyncio():
+    upstream = create_async_upstream("check")
+    reply = await upstream.create(model="fast", messages=[{"role": "user", "content": "hi"}])
+    if not reply.choices[0].message.content.startswith("ok"):
+        fail("asyncio: fast reply")
+    print("ok   asyncio: fast reply")
+
+    started = time.monotonic()
+    try:
+        await upstream.create(model="drip-body", messages=[{"role": "user", "content": "hi"}])
+        error = None
+    except Exception as e:
+        error = e
+    report("asyncio: slow-drip body", started, error)
+
+    for model in ("drip-stream", "stall-stream"):
+        started = time.monotonic()
+        try:
+            async for _ in await upstream.create(model=model, messages=[{"role": "user", "content": "hi"}],
+                                                 stream=True):
+                pass
+            error = None
+        except Exception as e:
+            error = e
+        report(f"asyncio: {model}", started, error)
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", PORT), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        check_threads()
+        asyncio.run(check_asyncio())
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
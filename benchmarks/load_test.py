@@ -0,0 +1,255 @@
+"""
+اختبار حمل كامل بدون إنترنت: gunicorn server:app مقابل stub_groq.py، مع إعادة
+تشغيل جلسات مسجلة (traces/sessions.json) عبر /start_session ثم /chat.
+
+لكل تركيبة workers × threads × concurrency يبدأ gunicorn من جديد ويقيس:
+الإنتاجية، p50/p95/p99 للزمن، نسبة الأخطاء لكل حالة، وأعلى ذاكرة RSS لكل عامل.
+
+صيغة الـ trace: {"sessions": [{"offset": ثوانٍ من البداية, "turns": [{"message": ..., "think": ثوانٍ قبل الرسالة}]}]}
+--sessions يكرر الجلسات دورياً حتى العدد المطلوب، و --rate-scale يقسم الأزمنة
+(2 = ضعف معدل الوصول وضعف سرعة المستخدمين). --concurrency حد الجلسات المفتوحة معاً.
+
+الاستخدام:
+    python benchmarks/load_test.py --workers 2,4 --threads 1,8 --concurrency 20,100 --sessions 200 --rate-scale 4
+    python benchmarks/load_test.py --latency 0.5 --token-rate 200 --throttle-rate 0.05 --error-rate 0.01 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench_asgi import wait_for_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TRACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces", "sessions.json")
+STUB_PORT = 18000
+APP_PORT = 18010
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+def load_sessions(path, count, rate_scale, unique):
+    """الجلسات مكررة دورياً حتى count، كل دورة تبدأ بعد انتهاء وصول الدورة السابقة"""
+    with open(path, encoding="utf-8") as f:
+        trace = json.load(f)["sessions"]
+
+    offsets = [session["offset"] for session in trace]
+    period = max(offsets) + (max(offsets) - min(offsets)) / max(len(trace) - 1, 1)
+
+    sessions = []
+    for index in range(count):
+        session = trace[index % len(trace)]
+        cycle = index // len(trace)
+        turns = []
+        for turn in session["turns"]:
+            message = turn["message"]
+            # نفس الرسالة من جلسات كثيرة يرد عليها الكاش، فنميزها إلا إذا طُلب غير ذلك
+            if unique and cycle:
+                message = f"{message} ({cycle})"
+            turns.append((message, turn["think"] / rate_scale))
+        sessions.append(((session["offset"] + cycle * period) / rate_scale, turns))
+    return sessions
+
+
+# ====== ذاكرة العمال ======
+def child_pids(parent):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # الحقل الرابع بعد اسم العملية (بين أقواس وقد يحتوي فراغات)
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent:
+            children.append(int(entry))
+    return children
+
+
+def rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return 0
+
+
+async def sample_memory(master, peaks, interval=0.5):
+    """أعلى RSS لكل عامل gunicorn طوال الاختبار"""
+    while True:
+        for pid in child_pids(master):
+            peaks[pid] = max(peaks.get(pid, 0), rss_bytes(pid))
+        await asyncio.sleep(interval)
+
+
+# ====== تشغيل الجلسات ======
+async def replay(sessions, concurrency, timeout):
+    base = f"http://127.0.0.1:{APP_PORT}"
+    latencies = []
+    statuses = {}
+    slots = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    def count(status):
+        statuses[status] = statuses.get(status, 0) + 1
+
+    async def request(http, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await http.request(method, base + path, **kwargs)
+        except httpx.HTTPError as e:
+            count(type(e).__name__)
+            return None
+        latencies.append(time.perf_counter() - started)
+        count(response.status_code)
+        return response
+
+    async def run_session(http, start_at, turns):
+        await asyncio.sleep(max(0.0, start_at - (time.perf_counter() - began)))
+        async with slots:
+            response = await request(http, "GET", "/start_session")
+            if response is None or response.status_code != 200:
+                return
+            session_id = response.json()["session_id"]
+            for message, think in turns:
+                await asyncio.sleep(think)
+                await request(http, "POST", "/chat", json={"message": message, "session_id": session_id})
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as http:
+        began = time.perf_counter()
+        await asyncio.gather(*(run_session(http, start_at, turns) for start_at, turns in sessions))
+        elapsed = time.perf_counter() - began
+
+    return latencies, statuses, elapsed
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_config(master, sessions, concurrency, timeout):
+    peaks = {}
+    sampler = asyncio.ensure_future(sample_memory(master, peaks))
+    try:
+        latencies, statuses, elapsed = await replay(sessions, concurrency, timeout)
+    finally:
+        sampler.cancel()
+
+    requests = sum(statuses.values())
+    errors = requests - statuses.get(200, 0)
+    return {
+        "requests": requests,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "statuses": {str(status): total for status, total in sorted(statuses.items(), key=str)},
+        "worker_rss_mb": [round(peak / 2 ** 20, 1) for peak in peaks.values()]
+    }
+
+
+def injected_failures():
+    """عدد ردود 429/500 التي أرسلها الـ stub حتى الآن (عميل Groq يعيد المحاولة فلا تظهر كلها كأخطاء)"""
+    return httpx.get(f"http://127.0.0.1:{STUB_PORT}/stats").json()
+
+
+def start(command, port, env):
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+def stop(process):
+    process.terminate()
+    process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", default=DEFAULT_TRACE)
+    parser.add_argument("--sessions", type=int, default=100, help="sessions to replay (trace is cycled)")
+    parser.add_argument("--rate-scale", type=float, default=1.0, help="divide offsets and think times by this")
+    parser.add_argument("--keep-duplicates", action="store_true", help="replay repeated messages verbatim (cache hits)")
+    parser.add_argument("--workers", type=int_list, default=[2], help="comma-separated gunicorn worker counts")
+    parser.add_argument("--threads", type=int_list, default=[1], help="comma-separated threads per worker")
+    parser.add_argument("--concurrency", type=int_list, default=[50], help="comma-separated open-session limits")
+    parser.add_argument("--timeout", type=float, default=120.0, help="client timeout per request")
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--token-rate", type=float, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="save results as JSON")
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.trace, args.sessions, args.rate_scale, not args.keep_duplicates)
+    # كل الجلسات من 127.0.0.1 فحد الـ IP معطل (ما لم يحدد في البيئة)، وحالة القبول في ملف مؤقت جديد
+    env = {"ADMISSION_IP_RATE": "0", **os.environ}
+    env.update(GROQ_API_KEY="benchmark", GROQ_BASE_URL=f"http://127.0.0.1:{STUB_PORT}",
+               SESSION_SWEEP_INTERVAL="0", PYTHONPATH=ROOT,
+               ADMISSION_DB_PATH=os.path.join(tempfile.mkdtemp(prefix="load-test-"), "admission.db"))
+
+    stub_command = [sys.executable, "benchmarks/stub_groq.py", "--port", str(STUB_PORT),
+                    "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+                    "--throttle-rate", str(args.throttle_rate), "--seed", "1"]
+    if args.token_rate:
+        stub_command += ["--token-rate", str(args.token_rate)]
+
+    turns = sum(len(session_turns) for _, session_turns in sessions)
+    print(f"{len(sessions)} sessions, {turns} chat turns, rate x{args.rate_scale}, upstream latency {args.latency}s")
+    print(f"{'workers':>7} {'threads':>7} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'errors':>7} {'RSS MB/worker (max)':>20}")
+
+    results = []
+    stub = start(stub_command, STUB_PORT, env)
+    try:
+        for workers in args.workers:
+            for threads in args.threads:
+                for concurrency in args.concurrency:
+                    # عملية جديدة لكل تركيبة حتى لا تؤثر جلسات التركيبة السابقة على الذاكرة
+                    app = start([sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+                                 "--timeout", "300", "-b", f"127.0.0.1:{APP_PORT}", "server:app"], APP_PORT, env)
+                    before = injected_failures()
+                    try:
+                        result = asyncio.run(run_config(app.pid, sessions, concurrency, args.timeout))
+                    finally:
+                        stop(app)
+                    after = injected_failures()
+
+                    result.update(workers=workers, threads=threads, concurrency=concurrency,
+                                  upstream_injected={key: after[key] - before[key] for key in after})
+                    results.append(result)
+                    rss = max(result["worker_rss_mb"], default=0.0)
+                    print(f"{workers:>7} {threads:>7} {concurrency:>5} {result['throughput_rps']:>8.2f} "
+                          f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                          f"{result['error_rate']:>7.2%} {rss:>20.1f}")
+                    if result["error_rate"] or any(result["upstream_injected"].values()):
+                        print(f"{'':>7} statuses: {result['statuses']}, upstream injected: {result['upstream_injected']}")
+    finally:
+        stop(stub)
+
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=1)
+            f.write("\n")
+        print(f"saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+خادم محلي يحاكي واجهة Groq chat/completions (عادي وبث) بزمن استجابة ثابت.
+يستخدم للقياس بدون إنترنت وبدون استهلاك حصة Groq: يكفي تشغيل التطبيق مع
+GROQ_BASE_URL=http://127.0.0.1:<port>
+
+- بدون --token-rate: الزمن الكلي لكل رد = --latency (موزعاً على الكلمات في البث)
+- مع --token-rate: --latency زمن أول توكن ثم توكن (كلمة) كل 1/token-rate ثانية
+- --error-rate و --throttle-rate: نسبة الطلبات التي ترجع 500 أو 429 (مع Retry-After)
+- --model-latency MODEL=SECONDS: زمن مختلف لنموذج معين (توجيه النماذج في model_routing.py)،
+  و --throttled-model MODEL: كل طلبات هذا النموذج ترجع 429 (للتحقق من الرجوع للنموذج الآخر)
+
+الاستخدام:
+    python benchmarks/stub_groq.py --port 18000 --latency 1.0
+    python benchmarks/stub_groq.py --latency 0.3 --token-rate 250 --throttle-rate 0.05 --error-rate 0.01
+    python benchmarks/stub_groq.py --latency 1.0 --model-latency llama-3.1-8b-instant=0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+REPLY = (
+    "Electrical submersible pumps (ESP) lift oil from the well. Main parts: "
+    "1. The pump 2. The motor 3. The power cable. Note: check the reservoir pressure first."
+)
+
+
+def completion_body(model, reply):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": reply},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 100, "completion_tokens": len(reply.split()), "total_tokens": 100 + len(reply.split())}
+    }
+
+
+def chunk_event(completion_id, model, content, finish_reason=None):
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+def error_response(status, message):
+    headers = {"retry-after": "1"} if status == 429 else None
+    return JSONResponse({"error": {"message": message, "type": "stub_error"}}, status_code=status, headers=headers)
+
+
+def create_app(latency, reply=REPLY, token_rate=None, error_rate=0.0, throttle_rate=0.0, seed=None,
+               model_latency=None, throttled_models=()):
+    chance = random.Random(seed)
+    words = reply.split(" ")
+    model_latency = model_latency or {}
+    injected = {"throttled": 0, "errors": 0}
+    model_requests = {}
+
+    def delays(model):
+        """(زمن أول كلمة، زمن كل كلمة بعدها، الزمن الكلي)"""
+        seconds = model_latency.get(model, latency)
+        if token_rate:
+            first_delay, word_delay = seconds, 1 / token_rate
+        else:
+            # نفس الزمن الكلي موزعاً على الكلمات
+            first_delay, word_delay = seconds / len(words), seconds / len(words)
+        return first_delay, word_delay, first_delay + word_delay * (len(words) - 1)
+
+    async def chat_completions(request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        model_requests[model] = model_requests.get(model, 0) + 1
+        first_delay, word_delay, total = delays(model)
+
+        draw = chance.random()
+        if draw < throttle_rate or model in throttled_models:
+            injected["throttled"] += 1
+            return error_response(429, "Rate limit reached (stub)")
+        if draw < throttle_rate + error_rate:
+            injected["errors"] += 1
+            return error_response(500, "Internal server error (stub)")
+
+        if not body.get("stream"):
+            await asyncio.sleep(total)
+            return JSONResponse(completion_body(model, reply))
+
+        async def events():
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            for index, word in enumerate(words):
+                await asyncio.sleep(first_delay if index == 0 else word_delay)
+                yield chunk_event(completion_id, model, word if index == 0 else " " + word)
+            yield chunk_event(completion_id, model, "", finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def stats(request):
+        return JSONResponse(injected)
+
+    async def models(request):
+        return JSONResponse(model_requests)
+
+    return Starlette(routes=[
+        Route("/openai/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/stats", stats, methods=["GET"]),
+        Route("/models", models, methods=["GET"]),
+    ])
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--latency", type=float, default=1.0,
+                        help="seconds per completion (time to first token with --token-rate)")
+    parser.add_argument("--token-rate", type=float, default=None, help="streamed tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="latency for one model instead of --latency (repeatable)")
+    parser.add_argument("--throttled-model", action="append", default=[], metavar="MODEL",
+                        help="answer every request for this model with 429 (repeatable)")
+    args = parser.parse_args()
+
+    model_latency = {}
+    for item in args.model_latency:
+        model, _, seconds = item.rpartition("=")
+        model_latency[model] = float(seconds)
+
+    app = create_app(args.latency, token_rate=args.token_rate, error_rate=args.error_rate,
+                     throttle_rate=args.throttle_rate, seed=args.seed,
+                     model_latency=model_latency, throttled_models=frozenset(args.throttled_model))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
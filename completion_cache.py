@@ -0,0 +1,248 @@
+"""
+كاش لردود النموذج على أسئلة الدور الأول (جلسة بدون تاريخ).
+
+المفتاح = (النموذج، اللغة، إصدار برومبت النظام، السؤال بعد التطبيع).
+محدود بعدد المدخلات وبالحجم بالبايت، مع حذف الأقدم استخداماً (LRU) ومدة صلاحية.
+
+طبقة اختيارية للأسئلة المتقاربة (إعادة صياغة) عبر TF-IDF وتشابه جيب التمام،
+تعمل فقط إذا كانت numpy مثبتة وتم تحديد COMPLETION_CACHE_FUZZY_THRESHOLD.
+"""
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # الطبقة التقريبية اختيارية
+    np = None
+
+# تشكيل وتطويل وعلامات ترقيم لا تغير معنى السؤال
+IGNORED_CHARS_RE = re.compile(r'[\u064B-\u0652\u0640?!.,;:،؛؟"\'()\[\]]')
+SPACES_RE = re.compile(r'\s+')
+ARABIC_LETTER_VARIANTS = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ة': 'ه', 'ى': 'ي'})
+
+
+def normalize_question(text):
+    """توحيد السؤال: حروف صغيرة، بدون ترقيم وتشكيل، وتوحيد أشكال الألف والتاء المربوطة والياء"""
+    text = IGNORED_CHARS_RE.sub(' ', text.lower()).translate(ARABIC_LETTER_VARIANTS)
+    return SPACES_RE.sub(' ', text).strip()
+
+
+class FuzzyIndex:
+    """فهرس TF-IDF لقسم واحد من الكاش (نفس النموذج واللغة والبرومبت)
+
+    كل سؤال يضيف أزواج (صف، كلمة، تكرار) في مصفوفات تكبر بالمضاعفة، والحذف يصفر
+    أزواجه. البحث يحسب الأوزان والأطوال من الأزواج مباشرة (O(عدد الأزواج) في numpy)
+    فلا توجد مصفوفة كثيفة يعاد بناؤها بعد كل put وقفل الكاش مغلق.
+    """
+
+    def __init__(self):
+        self.rows = {}  # question -> (row, start, end)
+        self.questions = []  # row -> question أو None بعد الحذف
+        self.free_rows = []
+        self.vocabulary = {}  # term -> column
+        self.document_frequency = np.zeros(64, dtype=np.float64)
+        self.entry_rows = np.zeros(256, dtype=np.intp)
+        self.entry_columns = np.zeros(256, dtype=np.intp)
+        self.entry_counts = np.zeros(256, dtype=np.float64)
+        self.size = 0
+        self.dead = 0
+
+    def _reserve(self, entries):
+        if len(self.vocabulary) > len(self.document_frequency):
+            frequency = np.zeros(2 * len(self.vocabulary), dtype=np.float64)
+            frequency[:len(self.document_frequency)] = self.document_frequency
+            self.document_frequency = frequency
+        if self.size + entries > len(self.entry_counts):
+            capacity = 2 * (self.size + entries)
+            self.entry_rows = np.resize(self.entry_rows, capacity)
+            self.entry_columns = np.resize(self.entry_columns, capacity)
+            self.entry_counts = np.resize(self.entry_counts, capacity)
+
+    def add(self, question):
+        if question in self.rows:
+            return
+        terms = Counter(question.split())
+        columns = [self.vocabulary.setdefault(term, len(self.vocabulary)) for term in terms]
+        self._reserve(len(columns))
+
+        row = self.free_rows.pop() if self.free_rows else len(self.questions)
+        if row == len(self.questions):
+            self.questions.append(question)
+        else:
+            self.questions[row] = question
+
+        start, end = self.size, self.size + len(columns)
+        self.entry_rows[start:end] = row
+        self.entry_columns[start:end] = columns
+        self.entry_counts[start:end] = list(terms.values())
+        self.document_frequency[columns] += 1
+        self.rows[question] = (row, start, end)
+        self.size = end
+
+    def remove(self, question):
+        position = self.rows.pop(question, None)
+        if position is None:
+            return
+        row, start, end = position
+        self.document_frequency[self.entry_columns[start:end]] -= 1
+        self.entry_counts[start:end] = 0
+        self.questions[row] = None
+        self.free_rows.append(row)
+        self.dead += end - start
+        if self.dead > 256 and self.dead * 2 > self.size:
+            self._compact()
+
+    def _compact(self):
+        """حذف الأزواج المصفرة والكلمات التي لم يعد لها سؤال"""
+        live = self.document_frequency[:len(self.vocabulary)] > 0
+        remap = np.cumsum(live) - 1
+        self.vocabulary = {term: int(remap[column]) for term, column in self.vocabulary.items() if live[column]}
+        self.document_frequency = self.document_frequency[:len(live)][live]
+
+        keep = self.entry_counts[:self.size] > 0
+        self.entry_rows = self.entry_rows[:self.size][keep]
+        self.entry_columns = remap[self.entry_columns[:self.size][keep]]
+        self.entry_counts = self.entry_counts[:self.size][keep]
+        # الأزواج الباقية بنفس ترتيبها، فكل سؤال يبدأ حيث انتهى الذي قبله
+        start = 0
+        for question, (row, old_start, old_end) in sorted(self.rows.items(), key=lambda item: item[1][1]):
+            self.rows[question] = (row, start, start + old_end - old_start)
+            start += old_end - old_start
+        self.size = start
+        self.dead = 0
+        self._reserve(0)
+
+    def nearest(self, question):
+        if not self.rows:
+            return None, 0.0
+
+        size = self.size
+        rows, columns = self.entry_rows[:size], self.entry_columns[:size]
+        frequency = self.document_frequency[:len(self.vocabulary)]
+        idf = np.log((1 + len(self.rows)) / (1 + frequency)) + 1
+        weights = self.entry_counts[:size] * idf[columns]
+
+        query = np.zeros(len(self.vocabulary))
+        for term, count in Counter(question.split()).items():
+            column = self.vocabulary.get(term)
+            # كلمة لم يعد لها سؤال (قبل _compact) كأنها غير موجودة
+            if column is not None and frequency[column]:
+                query[column] = count * idf[column]
+        query_norm = np.linalg.norm(query)
+        if not query_norm:
+            return None, 0.0
+
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(self.questions)))
+        dots = np.bincount(rows, weights=weights * query[columns], minlength=len(self.questions))
+        scores = np.divide(dots, norms * query_norm, out=np.zeros_like(dots), where=norms > 0)
+        best = int(scores.argmax())
+        return self.questions[best], float(scores[best])
+
+
+class CompletionCache:
+    """كاش LRU محدود بالعدد والحجم مع مدة صلاحية وعدادات إصابة/إخفاق"""
+
+    def __init__(self, max_entries=1024, max_bytes=8 * 1024 * 1024, ttl=6 * 3600, fuzzy_threshold=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.fuzzy_threshold = fuzzy_threshold if np is not None else None
+        self.entries = OrderedDict()  # (partition, question) -> (reply, size, expires_at)
+        self.fuzzy = {}  # partition -> FuzzyIndex
+        self.bytes = 0
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+        partition, question = key
+        if partition in self.fuzzy:
+            self.fuzzy[partition].remove(question)
+
+    def _lookup(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= now:
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, partition, user_msg):
+        """إرجاع الرد المخزن أو None. partition = (النموذج، اللغة، إصدار البرومبت)"""
+        if not self.enabled:
+            return None
+
+        question = normalize_question(user_msg)
+        now = time.monotonic()
+
+        with self.lock:
+            reply = self._lookup((partition, question), now)
+            if reply is not None:
+                self.hits += 1
+                return reply
+
+            if self.fuzzy_threshold is not None and partition in self.fuzzy:
+                nearest, score = self.fuzzy[partition].nearest(question)
+                if nearest is not None and score >= self.fuzzy_threshold:
+                    reply = self._lookup((partition, nearest), now)
+                    if reply is not None:
+                        self.fuzzy_hits += 1
+                        return reply
+
+            self.misses += 1
+            return None
+
+    def put(self, partition, user_msg, reply):
+        if not self.enabled or not reply:
+            return
+
+        question = normalize_question(user_msg)
+        key = (partition, question)
+        size = len(question.encode('utf-8')) + len(reply.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (reply, size, time.monotonic() + self.ttl)
+            self.bytes += size
+            if self.fuzzy_threshold is not None:
+                self.fuzzy.setdefault(partition, FuzzyIndex()).add(question)
+
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses
+            }
+
+
+def create_completion_cache():
+    """إنشاء الكاش حسب متغيرات البيئة (COMPLETION_CACHE_SIZE=0 يعطله)"""
+    threshold = os.environ.get("COMPLETION_CACHE_FUZZY_THRESHOLD")
+    return CompletionCache(
+        max_entries=int(os.environ.get("COMPLETION_CACHE_SIZE", 1024)),
+        max_bytes=int(os.environ.get("COMPLETION_CACHE_BYTES", 8 * 1024 * 1024)),
+        ttl=int(os.environ.get("COMPLETION_CACHE_TTL", 6 * 3600)),
+        fuzzy_threshold=float(threshold) if threshold else None
+    )
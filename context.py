@@ -0,0 +1,120 @@
+"""
+بناء سياق المحادثة حسب ميزانية توكنات بدل آخر 12 رسالة مهما كان طولها.
+
+- estimate_tokens: تقدير سريع بدون tokenizer (العربية توكنات أكثر لكل حرف)
+- كل رسالة مخزنة تحمل تقديرها في المفتاح "tokens" فلا يعاد حسابه في كل طلب
+- fit_history: يأخذ الأحدث أولاً حتى تمتلئ الميزانية، بأزواج كاملة (يبدأ بسؤال مستخدم)
+- RollingSummaries (اختياري): ملخص للرسائل التي خرجت من الميزانية، يُحدّث في
+  الخلفية بعد الرد فلا يؤخر أي طلب، ويستخدم في الطلب التالي
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+# متوسطات تقريبية لـ tokenizer نماذج Llama 3
+ASCII_CHARS_PER_TOKEN = 4.0
+OTHER_CHARS_PER_TOKEN = 2.6
+# role وفواصل القالب لكل رسالة
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """تقدير عدد توكنات نص (الحروف غير ASCII غالباً عربية)"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    other_chars = len(text) - ascii_chars
+    return int(ascii_chars / ASCII_CHARS_PER_TOKEN + other_chars / OTHER_CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+def stored_message(role, content):
+    """رسالة للتخزين في الجلسة مع تقدير توكناتها"""
+    return {"role": role, "content": content, "tokens": estimate_tokens(content)}
+
+
+def message_tokens(message):
+    # الرسائل المخزنة قبل إضافة التقدير لا تحتوي "tokens"
+    tokens = message.get("tokens")
+    return tokens if tokens is not None else estimate_tokens(message["content"])
+
+
+def fit_history(history, budget):
+    """تقسيم التاريخ إلى (المحذوف، المحتفظ به، توكناته) بحيث لا يتجاوز المحتفظ به budget"""
+    used = 0
+    start = len(history)
+    while start > 0:
+        tokens = message_tokens(history[start - 1])
+        if used + tokens > budget:
+            break
+        used += tokens
+        start -= 1
+    # رد المساعد الذي خرج سؤاله يخرج معه، فلا يبدأ السياق برد بدون سؤال
+    while start < len(history) and history[start]["role"] != "user":
+        used -= message_tokens(history[start])
+        start += 1
+    return history[:start], history[start:], used
+
+
+def message_fingerprint(message):
+    return hashlib.sha1(f"{message['role']}\0{message['content']}".encode('utf-8')).hexdigest()
+
+
+class RollingSummaries:
+    """ملخص متجدد لكل جلسة يغطي الرسائل حتى آخر رسالة محذوفة تم تلخيصها"""
+
+    def __init__(self, summarize, max_sessions=10000):
+        # summarize(الملخص السابق أو None، الرسائل الجديدة) -> نص الملخص
+        self.summarize = summarize
+        self.max_sessions = max_sessions
+        self.summaries = OrderedDict()  # session_id -> (بصمة آخر رسالة مغطاة، النص، التوكنات)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        """(نص الملخص، توكناته) أو None"""
+        with self.lock:
+            entry = self.summaries.get(session_id)
+            if entry is None:
+                return None
+            self.summaries.move_to_end(session_id)
+            return entry[1], entry[2]
+
+    def forget(self, session_id):
+        with self.lock:
+            self.summaries.pop(session_id, None)
+
+    def refresh(self, session_id, dropped):
+        """تحديث الملخص في الخلفية ليشمل الرسائل المحذوفة من السياق إذا لم يشملها بعد"""
+        if not dropped:
+            return
+
+        last = message_fingerprint(dropped[-1])
+        with self.lock:
+            entry = self.summaries.get(session_id)
+            if (entry is not None and entry[0] == last) or session_id in self.pending:
+                return
+            self.pending.add(session_id)
+
+        previous = None
+        new_messages = dropped
+        if entry is not None:
+            previous = entry[1]
+            fingerprints = [message_fingerprint(message) for message in dropped]
+            if entry[0] in fingerprints:
+                new_messages = dropped[fingerprints.index(entry[0]) + 1:]
+
+        threading.Thread(
+            target=self._run, args=(session_id, previous, new_messages, last), daemon=True
+        ).start()
+
+    def _run(self, session_id, previous, new_messages, last):
+        try:
+            text = self.summarize(previous, new_messages)
+            with self.lock:
+                self.summaries[session_id] = (last, text, estimate_tokens(text))
+                self.summaries.move_to_end(session_id)
+                while len(self.summaries) > self.max_sessions:
+                    self.summaries.popitem(last=False)
+        except Exception as e:
+            print(f"Summary error: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(session_id)
@@ -0,0 +1,371 @@
+"""
+وضع المهام للردود الطويلة: POST /chat/jobs يرجع فوراً بمعرف مهمة، والرد نفسه
+يولد في مجموعة خيوط محدودة (JOBS_WORKERS) بنفس مسار /chat (answer_chat)،
+والعميل يسأل GET /chat/jobs/<id> حتى تنتهي أو يلغيها بـ DELETE.
+
+فلا يبقى اتصال HTTP أو عامل gunicorn محجوزاً طوال التوليد، ولا يضيع الرد إذا
+قطع بروكسي بمهلة 30 ثانية الاتصال. عدد الردود التي تولد معاً تحدده JOBS_WORKERS
+في كل عملية، والمهام المنتظرة محدودة بـ JOBS_MAX_PENDING (بعدها 503).
+
+حالة المهمة: queued -> running -> done | failed | cancelled، والنتيجة تبقى
+JOBS_RESULT_TTL ثانية بعد انتهائها. الحالة في SQLite مشترك بين عمليات gunicorn
+(JOBS_BACKEND=sqlite، الافتراضي) لأن السؤال عن المهمة قد يصل لعملية غير التي
+تنفذها، أو في الذاكرة لعملية واحدة (memory). مهمة عمليتها انتهت قبل أن تكملها
+تظهر failed.
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import Rejected
+from metrics import pid_alive
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """يرفعه مسار الرد عندما يلاحظ أن المهمة ألغيت أثناء تنفيذها"""
+
+
+def raise_if_cancelled(cancelled):
+    if cancelled is not None and cancelled():
+        raise JobCancelled()
+
+
+class Job:
+    __slots__ = ('job_id', 'session_id', 'status', 'pid', 'created', 'updated', 'cancel', 'http_status', 'body')
+
+    def __init__(self, job_id, session_id, status, pid, created, updated, cancel=False, http_status=None, body=None):
+        self.job_id = job_id
+        self.session_id = session_id
+        self.status = status
+        self.pid = pid
+        self.created = created
+        self.updated = updated
+        self.cancel = bool(cancel)
+        self.http_status = http_status
+        # النتيجة (done) أو الخطأ (failed): نفس JSON الذي كان سيرجعه /chat
+        self.body = body
+
+    def payload(self):
+        payload = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "session_id": self.session_id,
+            "created_at": self.created,
+            "finished_at": self.updated if self.status in FINISHED else None
+        }
+        if self.status == DONE:
+            payload["result"] = self.body
+        elif self.status == FAILED:
+            payload["error"] = self.body
+            payload["error_status"] = self.http_status
+        elif self.status == RUNNING and self.cancel:
+            payload["cancel_requested"] = True
+        return payload
+
+
+# ====== الحالة في الذاكرة ======
+class MemoryJobStore:
+    shared = False
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, job):
+        with self.lock:
+            self.jobs[job.job_id] = job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            # نسخة حتى لا تتغير أثناء تحويلها لـ JSON
+            return None if job is None else Job(*(getattr(job, name) for name in Job.__slots__))
+
+    def start(self, job_id, now):
+        """queued -> running. False إذا ألغيت قبل أن تبدأ"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.status, job.updated = RUNNING, now
+            return True
+
+    def finish(self, job_id, status, http_status, body, now):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.status not in FINISHED:
+                job.status, job.http_status, job.body, job.updated = status, http_status, body, now
+
+    def request_cancel(self, job_id, now):
+        """المنتظرة تلغى فوراً، والتي تنفذ تتوقف عند أول فحص. يرجع المهمة أو None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                job.status, job.updated = CANCELLED, now
+            elif job.status == RUNNING:
+                job.cancel = True
+        return self.get(job_id)
+
+    def cancel_requested(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job is None or job.cancel or job.status == CANCELLED
+
+    def prune(self, cutoff):
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED and job.updated < cutoff]
+            for job_id in expired:
+                del self.jobs[job_id]
+        return len(expired)
+
+    def counts(self):
+        counts = {}
+        with self.lock:
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+
+# ====== الحالة في SQLite (كل عمليات gunicorn) ======
+class SQLiteJobStore:
+    shared = True
+
+    COLUMNS = "job_id, session_id, status, pid, created, updated, cancel, http_status, body"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                cancel INTEGER NOT NULL DEFAULT 0,
+                http_status INTEGER,
+                body TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated);
+        """)
+
+    def _connection(self):
+        # اتصال لكل خيط ولكل عملية (gunicorn قد ينسخ العملية بعد الاستيراد)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def add(self, job):
+        self._connection().execute(
+            f"INSERT INTO jobs ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.job_id, job.session_id, job.status, job.pid, job.created, job.updated, int(job.cancel),
+             job.http_status, None if job.body is None else json.dumps(job.body, ensure_ascii=False))
+        )
+
+    def get(self, job_id):
+        db = self._connection()
+        row = db.execute(f"SELECT {self.COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(*row[:-1], json.loads(row[-1]) if row[-1] is not None else None)
+        if job.status in (QUEUED, RUNNING) and job.pid != os.getpid() and not pid_alive(job.pid):
+            # العملية التي كانت تنفذها انتهت (إعادة تشغيل أو انهيار)
+            job.status, job.http_status, job.updated = FAILED, 500, time.time()
+            job.body = {"error": "worker_lost"}
+            self.finish(job_id, job.status, job.http_status, job.body, job.updated)
+        return job
+
+    def start(self, job_id, now):
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, updated = ? WHERE job_id = ? AND status = ?", (RUNNING, now, job_id, QUEUED)
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id, status, http_status, body, now):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, http_status = ?, body = ?, updated = ? "
+            "WHERE job_id = ? AND status IN (?, ?)",
+            (status, http_status, json.dumps(body, ensure_ascii=False), now, job_id, QUEUED, RUNNING)
+        )
+
+    def request_cancel(self, job_id, now):
+        db = self._connection()
+        db.execute("UPDATE jobs SET status = ?, updated = ? WHERE job_id = ? AND status = ?",
+                   (CANCELLED, now, job_id, QUEUED))
+        db.execute("UPDATE jobs SET cancel = 1 WHERE job_id = ? AND status = ?", (job_id, RUNNING))
+        return self.get(job_id)
+
+    def cancel_requested(self, job_id):
+        row = self._connection().execute("SELECT cancel, status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is None or bool(row[0]) or row[1] == CANCELLED
+
+    def prune(self, cutoff):
+        cursor = self._connection().execute(
+            "DELETE FROM jobs WHERE updated < ? AND status IN (?, ?, ?)", (cutoff, *FINISHED)
+        )
+        return cursor.rowcount
+
+    def counts(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        return dict(rows.fetchall())
+
+
+# ====== التنفيذ ======
+class JobRunner:
+    """مجموعة خيوط محدودة لكل عملية، وطابور مهام منتظرة محدود"""
+
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, store, workers, max_pending, result_ttl, retry_after):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.futures = {}
+        self.executor = None
+        self.executor_pid = None
+        self.pruned_at = 0.0
+        self.finished = {}
+
+    def _executor(self):
+        # الخيوط لا تنتقل مع fork في gunicorn، فكل عملية تنشئ مجموعتها
+        if self.executor is None or self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chat-job")
+            self.executor_pid = os.getpid()
+        return self.executor
+
+    def _maybe_prune(self):
+        now = time.monotonic()
+        if now - self.pruned_at >= self.PRUNE_INTERVAL:
+            self.pruned_at = now
+            self.store.prune(time.time() - self.result_ttl)
+
+    def submit(self, session_id, handler):
+        """
+        تسجيل مهمة وتنفيذها في الخلفية. handler(cancelled) يرجع (حالة HTTP، JSON)،
+        و cancelled() يصبح True إذا طلب إلغاؤها. يرفع Rejected (503) إذا امتلأ الطابور.
+        """
+        self._maybe_prune()
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise Rejected(503, max(1, math.ceil(self.retry_after)), "jobs_full")
+            self.pending += 1
+
+        now = time.time()
+        job = Job(uuid.uuid4().hex, session_id, QUEUED, os.getpid(), now, now)
+        try:
+            self.store.add(job)
+            future = self._executor().submit(self._run, job.job_id, handler)
+        except BaseException:
+            self._done(job.job_id)
+            raise
+        with self.lock:
+            self.futures[job.job_id] = future
+        future.add_done_callback(lambda _, job_id=job.job_id: self._done(job_id))
+        return job
+
+    def _done(self, job_id):
+        with self.lock:
+            self.pending -= 1
+            self.futures.pop(job_id, None)
+
+    def _count(self, status):
+        with self.lock:
+            self.finished[status] = self.finished.get(status, 0) + 1
+
+    def _run(self, job_id, handler):
+        if not self.store.start(job_id, time.time()):
+            self._count(CANCELLED)
+            return
+        try:
+            http_status, body = handler(lambda: self.store.cancel_requested(job_id))
+            status = DONE if http_status == 200 else FAILED
+        except JobCancelled:
+            status, http_status, body = CANCELLED, None, None
+        except Exception as e:
+            print(f"Error: {e}")
+            status, http_status, body = FAILED, 500, {"error": type(e).__name__}
+        self.store.finish(job_id, status, http_status, body, time.time())
+        self._count(status)
+
+    def get(self, job_id):
+        self._maybe_prune()
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        if job.status in FINISHED and job.updated < time.time() - self.result_ttl:
+            return None
+        if job.status in (QUEUED, RUNNING) and job.pid == os.getpid():
+            with self.lock:
+                lost = job_id not in self.futures
+            if lost:
+                # قد تكون انتهت بين القراءة وفحص futures: _done يحذفها بعد store.finish،
+                # فالقراءة الآن نهائية، وغير المنتهية فقط من عملية سابقة بنفس الرقم لم تكملها
+                job = self.store.get(job_id)
+                if job is not None and job.status in (QUEUED, RUNNING):
+                    job.status, job.http_status, job.body = FAILED, 500, {"error": "worker_lost"}
+                    job.updated = time.time()
+                    self.store.finish(job_id, job.status, job.http_status, job.body, job.updated)
+        return job
+
+    def cancel(self, job_id):
+        job = self.store.request_cancel(job_id, time.time())
+        with self.lock:
+            future = self.futures.get(job_id)
+        # المهمة في طابور هذه العملية لم تبدأ: تخرج منه فوراً ويتحرر مكانها
+        if future is not None and job is not None and job.status == CANCELLED and future.cancel():
+            self._count(CANCELLED)
+        return job
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "finished": dict(self.finished),
+            "stored": self.store.counts()
+        }
+
+
+def create_job_runner():
+    """إنشاء مجموعة المهام حسب متغيرات البيئة"""
+    backend = os.environ.get("JOBS_BACKEND", "sqlite")
+    if backend == "sqlite":
+        store = SQLiteJobStore(os.environ.get("JOBS_DB_PATH", "jobs.db"))
+    elif backend == "memory":
+        store = MemoryJobStore()
+    else:
+        raise ValueError(f"Unknown JOBS_BACKEND: {backend}")
+
+    return JobRunner(
+        store,
+        workers=int(os.environ.get("JOBS_WORKERS", 4)),
+        max_pending=int(os.environ.get("JOBS_MAX_PENDING", 64)),
+        result_ttl=float(os.environ.get("JOBS_RESULT_TTL", 3600)),
+        retry_after=float(os.environ.get("JOBS_RETRY_AFTER", 5))
+    )
@@ -0,0 +1,571 @@
+"""
+حفظ جلسات المخزن في الذاكرة على القرص حتى لا تضيع المحادثات عند إعادة تشغيل
+العامل أو النشر.
+
+- سجل كتابة مسبقة (WAL): كل add_message_to_history و /clear_history يكتب سجلاً
+  ثنائياً واحداً (os.write على ملف O_APPEND) في ملف خاص بالعملية. الكتابة تصل
+  لذاكرة نظام التشغيل فتنجو من موت العملية، و fsync فقط عند تدوير الملف.
+  إنشاء جلسة وحذفها من الذاكرة لتجاوز الحدود يكتبان سجل مسح أيضاً، فلا تعود
+  رسائل قديمة بعد إعادة التشغيل (benchmarks/check_session_journal.py)
+- لقطة مضغوطة: كل SESSION_SNAPSHOT_INTERVAL ثانية تدور كل عملية ملفها، وعملية
+  واحدة (قفل flock) تدمج الملفات المغلقة مع اللقطة السابقة في لقطة جديدة
+  (استبدال ذري) ثم تحذفها. اللقطة تحفظ أسماء الملفات التي دمجتها فلا يعاد
+  تطبيقها إذا توقفت العملية قبل حذفها.
+- الاسترجاع عند البدء في الخلفية: يمر على ترويسات ملفات WAL فقط ثم يقرأ فهرس
+  اللقطة ليعرف مكان سجلات كل جلسة، والجلسة نفسها تقرأ عند أول طلب لها. اللقطة
+  تحفظ بصمات معرفاتها مرتبة، فطلب معرف ليس في WAL ولا في البصمات (جلسة جديدة أو
+  "default") لا ينتظر فهرس اللقطة، وطلب جلسة قد تكون محفوظة ينتظر انتهاء الفهرس فقط.
+
+الصيغة (little-endian):
+    سجل WAL:  crc32 (I) + طول الجسم (I) + جسم: النوع (B) الوقت (d) طول المعرف (H) المعرف
+              ولرسالة جديدة: طول الدور (B) الدور + النص
+    اللقطة:   MAGIC + جلسات + فهرس (طول المعرف H، المعرف، الموقع Q، الطول I، آخر نشاط d)
+              + أسماء الملفات المدموجة (JSON) + بصمات المعرفات مرتبة (Q لكل جلسة) + ذيل
+              (لقطة الإصدار 1 بدون البصمات تقرأ كما هي)
+    الجلسة:   آخر نشاط (d) عدد الرسائل (H) ثم لكل رسالة: طول الدور (B) مضغوط؟ (B)
+              التوكنات (I) طول البيانات (I) الدور البيانات
+"""
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from metrics import pid_alive
+from sessions import Message, Session, compress_older
+
+SNAPSHOT_NAME = "sessions.snapshot"
+LOCK_NAME = "compact.lock"
+SEGMENT_SUFFIX = ".wal"
+
+SNAPSHOT_MAGIC = b"OILNOVA-SESSIONS-2\n"
+SNAPSHOT_MAGIC_V1 = b"OILNOVA-SESSIONS-1\n"
+RECORD_HEADER = struct.Struct("<II")  # crc32، طول الجسم
+RECORD_BODY = struct.Struct("<BdH")  # النوع، الوقت، طول session_id
+SESSION_HEADER = struct.Struct("<dH")
+MESSAGE_HEADER = struct.Struct("<BBII")
+INDEX_ENTRY = struct.Struct("<QId")  # الموقع، الطول، آخر نشاط (بعد طول المعرف H والمعرف)
+SID_LENGTH = struct.Struct("<H")
+TRAILER_V1 = struct.Struct("<QIQI")  # موقع الفهرس، عدد الجلسات، موقع أسماء الملفات، طولها
+TRAILER = struct.Struct("<QIQIQ")  # ... ثم موقع البصمات (عددها = عدد الجلسات)
+SID_HASH = struct.Struct("<Q")
+
+APPEND = 1
+CLEAR = 2
+
+
+# ====== الترميز ======
+def encode_record(kind, when, session_id, role=None, content=None):
+    sid = session_id.encode('utf-8')
+    body = RECORD_BODY.pack(kind, when, len(sid)) + sid
+    if kind == APPEND:
+        role_bytes = role.encode('utf-8')
+        body += bytes((len(role_bytes),)) + role_bytes + content.encode('utf-8')
+    return RECORD_HEADER.pack(zlib.crc32(body), len(body)) + body
+
+
+def decode_record(data, offset, length):
+    """(النوع، الوقت، الدور، النص) أو None إذا كان السجل تالفاً"""
+    crc = RECORD_HEADER.unpack_from(data, offset - RECORD_HEADER.size)[0]
+    body = data[offset:offset + length]
+    if len(body) != length or zlib.crc32(body) != crc:
+        return None
+    kind, when, sid_length = RECORD_BODY.unpack_from(body)
+    position = RECORD_BODY.size + sid_length
+    if kind != APPEND:
+        return kind, when, None, None
+    role_length = body[position]
+    role = body[position + 1:position + 1 + role_length].decode('utf-8')
+    return kind, when, role, body[position + 1 + role_length:].decode('utf-8')
+
+
+def encode_session(session):
+    parts = [SESSION_HEADER.pack(session.last_activity, len(session.messages))]
+    for message in session.messages:
+        data = message.data
+        compressed = isinstance(data, bytes)
+        if not compressed:
+            data = data.encode('utf-8')
+        role = message.role.encode('utf-8')
+        parts.append(MESSAGE_HEADER.pack(len(role), compressed, message.tokens, len(data)))
+        parts.append(role)
+        parts.append(data)
+    return b"".join(parts)
+
+
+def decode_session(data, offset):
+    last_activity, count = SESSION_HEADER.unpack_from(data, offset)
+    position = offset + SESSION_HEADER.size
+    session = Session(last_activity)
+    for _ in range(count):
+        role_length, compressed, tokens, data_length = MESSAGE_HEADER.unpack_from(data, position)
+        position += MESSAGE_HEADER.size
+        role = data[position:position + role_length].decode('utf-8')
+        position += role_length
+        content = data[position:position + data_length]
+        position += data_length
+        session.messages.append(Message(role, content if compressed else content.decode('utf-8'), tokens))
+    return session
+
+
+def map_file(path):
+    """mmap للقراءة فقط، أو None لملف فارغ. الخريطة تبقى صالحة حتى لو حُذف الملف أو استُبدل"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def sid_hash(session_id):
+    return int.from_bytes(hashlib.blake2b(session_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def read_trailer(data):
+    """(موقع الفهرس، عدد الجلسات، موقع أسماء الملفات، طولها، موقع البصمات أو None) أو None بدون لقطة"""
+    if data is None:
+        return None
+    if data[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC:
+        return TRAILER.unpack_from(data, len(data) - TRAILER.size)
+    if data[:len(SNAPSHOT_MAGIC_V1)] == SNAPSHOT_MAGIC_V1:
+        return TRAILER_V1.unpack_from(data, len(data) - TRAILER_V1.size) + (None,)
+    return None
+
+
+def read_snapshot_segments(data):
+    """أسماء ملفات WAL المدموجة في اللقطة"""
+    trailer = read_trailer(data)
+    if trailer is None:
+        return set()
+    _, _, names_offset, names_length, _ = trailer
+    return set(json.loads(data[names_offset:names_offset + names_length]))
+
+
+def snapshot_may_contain(data, session_id):
+    """بحث ثنائي في بصمات اللقطة بدون قراءة الفهرس. False يعني أن الجلسة ليست فيها بالتأكيد"""
+    trailer = read_trailer(data)
+    if trailer is None:
+        return False
+    _, count, _, _, hashes_offset = trailer
+    if hashes_offset is None:
+        return True
+    wanted = sid_hash(session_id)
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if SID_HASH.unpack_from(data, hashes_offset + middle * SID_HASH.size)[0] < wanted:
+            low = middle + 1
+        else:
+            high = middle
+    return low < count and SID_HASH.unpack_from(data, hashes_offset + low * SID_HASH.size)[0] == wanted
+
+
+def read_snapshot_index(data, cutoff=None):
+    """({session_id: (الموقع، الطول، آخر نشاط)}, أسماء ملفات WAL المدموجة) بدون الجلسات الأقدم من cutoff"""
+    trailer = read_trailer(data)
+    if trailer is None:
+        return {}, set()
+    index_offset, count, names_offset, names_length, _ = trailer
+    segments = set(json.loads(data[names_offset:names_offset + names_length]))
+
+    index = {}
+    position = index_offset
+    unpack_entry = INDEX_ENTRY.unpack_from
+    entry_size = INDEX_ENTRY.size
+    unpack_length = SID_LENGTH.unpack_from
+    for _ in range(count):
+        sid_length, = unpack_length(data, position)
+        position += 2
+        session_id = data[position:position + sid_length].decode('utf-8')
+        position += sid_length
+        entry = unpack_entry(data, position)
+        position += entry_size
+        if cutoff is None or entry[2] >= cutoff:
+            index[session_id] = entry
+    return index, segments
+
+
+def scan_segment(data, source, events):
+    """إضافة (الوقت، المصدر، الموقع، الطول) لكل سجل إلى events[session_id] بدون قراءة النصوص"""
+    if data is None:
+        return
+    size = len(data)
+    position = 0
+    header_size = RECORD_HEADER.size
+    unpack_header = RECORD_HEADER.unpack_from
+    unpack_body = RECORD_BODY.unpack_from
+    while position + header_size <= size:
+        _, length = unpack_header(data, position)
+        body = position + header_size
+        # سجل ناقص في النهاية (توقفت العملية أثناء الكتابة)
+        if length < RECORD_BODY.size or body + length > size:
+            break
+        _, when, sid_length = unpack_body(data, body)
+        sid_start = body + RECORD_BODY.size
+        session_id = data[sid_start:sid_start + sid_length].decode('utf-8', 'replace')
+        events.setdefault(session_id, []).append((when, source, body, length))
+        position = body + length
+
+
+# ====== السجل ======
+class SessionJournal:
+    def __init__(self, directory, snapshot_interval=300.0, load_timeout=10.0, fsync=True):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.load_timeout = load_timeout
+        self.fsync = fsync
+        self.ttl = None
+        self.max_messages = None
+        self.plain_messages = None
+
+        # الكتابة
+        self.fd = None
+        self.segment = None
+        self.pid = None
+        self.written = 0
+        self.write_lock = threading.Lock()
+
+        # الاسترجاع: الجلسات التي لم تُطلب بعد
+        self.sources = []  # اللقطة أولاً ثم ملفات WAL (mmap)
+        self.index = {}  # session_id -> (الموقع، الطول، آخر نشاط) في اللقطة
+        self.events = {}  # session_id -> [(الوقت، المصدر، الموقع، الطول)] في ملفات WAL
+        self.forgotten = set()  # جلسات أنشئت أو مُسحت قبل انتهاء الاسترجاع
+        self.pending_lock = threading.Lock()
+        self.scanned = threading.Event()  # events كاملة، وفهرس اللقطة لم يقرأ بعد
+        self.ready = threading.Event()
+        self.recovered = 0
+        self.recovered_at = None
+        self.recovery_seconds = None
+        self.restored = 0
+
+        # الدمج
+        self.compactions = 0
+        self.last_compaction_seconds = None
+        self.thread = None
+
+    # ---------- الكتابة ----------
+    def _open_segment(self):
+        self.pid = os.getpid()
+        self.segment = f"{time.time_ns():020d}-{self.pid}{SEGMENT_SUFFIX}"
+        self.fd = os.open(
+            os.path.join(self.directory, self.segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600
+        )
+
+    def _write(self, kind, when, session_id, role=None, content=None):
+        # فشل الحفظ (قرص ممتلئ، معرف طويل جداً) لا يفشل المحادثة نفسها
+        try:
+            record = encode_record(kind, when, session_id, role, content)
+            with self.write_lock:
+                # بعد fork (gunicorn --preload) لكل عملية ملفها
+                if self.fd is None or self.pid != os.getpid():
+                    self._open_segment()
+                os.write(self.fd, record)
+                self.written += len(record)
+        except (OSError, struct.error) as e:
+            print(f"Session journal write error: {e}")
+
+    def append(self, session_id, role, content, when):
+        self._write(APPEND, when, session_id, role, content)
+
+    def clear(self, session_id, when):
+        self._write(CLEAR, when, session_id)
+
+    def rotate(self):
+        """إغلاق ملف WAL الحالي؛ الكتابة التالية تفتح ملفاً جديداً"""
+        with self.write_lock:
+            if self.fd is None or self.pid != os.getpid():
+                return
+            if self.fsync:
+                os.fsync(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+    # ---------- الاسترجاع ----------
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+
+    def recover(self):
+        """بناء فهرس الجلسات المحفوظة (بدون قراءة الرسائل)"""
+        started = time.perf_counter()
+        try:
+            events = {}
+            # قفل مشترك: لا يحذف الدمج ملفاً بين قراءة اللقطة وفتح ملفات WAL
+            with open(os.path.join(self.directory, LOCK_NAME), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_SH)
+                snapshot_path = os.path.join(self.directory, SNAPSHOT_NAME)
+                snapshot = map_file(snapshot_path) if os.path.exists(snapshot_path) else None
+                merged = read_snapshot_segments(snapshot)
+                self.sources.append(snapshot)
+                for name in self._segments():
+                    if name in merged or name == self.segment:
+                        continue
+                    try:
+                        data = map_file(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        continue
+                    self.sources.append(data)
+                    scan_segment(data, len(self.sources) - 1, events)
+
+            # من هنا يعرف _may_be_saved الجلسات الجديدة بدون انتظار فهرس اللقطة (الأطول)
+            with self.pending_lock:
+                self.events = events
+            self.scanned.set()
+            index, _ = read_snapshot_index(snapshot, time.time() - self.ttl)
+
+            with self.pending_lock:
+                # ما أنشأته أو مسحته هذه العملية قبل انتهاء الاسترجاع أحدث مما في الفهرس
+                for session_id in self.forgotten:
+                    index.pop(session_id, None)
+                    events.pop(session_id, None)
+                self.forgotten = set()
+                self.index = index
+                self.events = events
+            self.recovered = len(index) + sum(1 for session_id in events if session_id not in index)
+            self.recovered_at = time.time()
+        except Exception as e:
+            print(f"Session journal recovery error: {e}")
+        finally:
+            self.recovery_seconds = time.perf_counter() - started
+            self.scanned.set()
+            self.ready.set()
+
+    def _expire_index(self):
+        """بعد مدة TTL من الاسترجاع كل ما لم يُطلب انتهى، فتحرر ذاكرة الفهرس والملفات"""
+        if self.recovered_at is None or time.time() - self.recovered_at < self.ttl:
+            return
+        with self.pending_lock:
+            self.index = {}
+            self.events = {}
+            self.sources = []
+            self.recovered_at = None
+
+    def _build(self, snapshot_entry, events, snapshot_data, sources):
+        """الجلسة من مدخل اللقطة ثم سجلات WAL بالترتيب الزمني"""
+        if snapshot_entry is not None:
+            session = decode_session(snapshot_data, snapshot_entry[0])
+        else:
+            session = Session(0.0)
+
+        for when, source, offset, length in sorted(events, key=lambda event: event[0]):
+            record = decode_record(sources[source], offset, length)
+            if record is None:
+                continue
+            kind, when, role, content = record
+            if kind == APPEND:
+                session.messages.append(Message(role, content))
+            else:
+                session.messages = []
+            session.last_activity = max(session.last_activity, when)
+
+        del session.messages[:-self.max_messages]
+        session.size += sum(message.nbytes() for message in session.messages)
+        compress_older(session, self.plain_messages)
+        return session
+
+    def forget(self, session_id):
+        """الجلسة أنشئت من جديد أو مُسحت فلا تسترجع. يرجع True إذا كانت قد تكون محفوظة"""
+        with self.pending_lock:
+            if not self.ready.is_set():
+                # تمنع recover من إضافتها لاحقاً
+                self.forgotten.add(session_id)
+                return True
+            in_index = self.index.pop(session_id, None) is not None
+            return self.events.pop(session_id, None) is not None or in_index
+
+    def _may_be_saved(self, session_id, timeout):
+        """قبل انتهاء الاسترجاع: False إذا كانت الجلسة بالتأكيد ليست في WAL ولا في اللقطة"""
+        if not self.scanned.wait(timeout):
+            return True
+        with self.pending_lock:
+            if self.ready.is_set() or session_id in self.events:
+                return True
+            snapshot = self.sources[0] if self.sources else None
+        return snapshot_may_contain(snapshot, session_id)
+
+    def load(self, session_id):
+        """
+        الجلسة المحفوظة (مرة واحدة فقط لكل جلسة) أو None. أثناء الاسترجاع تنتظر
+        انتهاءه فقط إذا كانت الجلسة قد تكون محفوظة، والجديدة تعود فوراً.
+        """
+        if not self.ready.is_set():
+            deadline = time.monotonic() + self.load_timeout
+            if not self._may_be_saved(session_id, self.load_timeout):
+                return None
+            if not self.ready.wait(max(0.0, deadline - time.monotonic())):
+                return None
+        with self.pending_lock:
+            entry = self.index.pop(session_id, None)
+            events = self.events.pop(session_id, None)
+            sources = self.sources
+        if entry is None and events is None:
+            return None
+
+        try:
+            session = self._build(entry, events or (), sources[0], sources)
+        except Exception as e:
+            print(f"Session journal load error ({session_id}): {e}")
+            return None
+        if session.last_activity < time.time() - self.ttl:
+            return None
+        self.restored += 1
+        return session
+
+    # ---------- الدمج ----------
+    def _sealed(self, names):
+        """ملفات WAL التي لا تكتب فيها أي عملية: ليست آخر ملف لعملية حية حديثة"""
+        latest = {}
+        for name in names:
+            pid = int(name[:-len(SEGMENT_SUFFIX)].split('-')[1])
+            latest[pid] = name
+
+        now = time.time_ns()
+        own = os.getpid()
+        sealed = []
+        for name in names:
+            created, pid = (int(part) for part in name[:-len(SEGMENT_SUFFIX)].split('-'))
+            if pid == own:
+                active = name == self.segment and self.fd is not None
+            else:
+                # كل عملية تدور ملفها كل snapshot_interval، فالملف الأقدم من ضعفه مغلق
+                active = (
+                    latest[pid] == name
+                    and pid_alive(pid)
+                    and now - created < 2 * self.snapshot_interval * 1e9
+                )
+            if not active:
+                sealed.append(name)
+        return sealed
+
+    def compact(self):
+        """دمج ملفات WAL المغلقة في لقطة جديدة. يرجع False إذا كانت عملية أخرى تدمج"""
+        started = time.perf_counter()
+        with open(os.path.join(self.directory, LOCK_NAME), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+
+            snapshot_path = os.path.join(self.directory, SNAPSHOT_NAME)
+            snapshot = map_file(snapshot_path) if os.path.exists(snapshot_path) else None
+            index, merged = read_snapshot_index(snapshot)
+
+            names = self._segments()
+            sealed = [name for name in self._sealed(names) if name not in merged]
+            if not sealed:
+                # ملفات دمجت سابقاً ولم تحذف
+                self._remove(name for name in names if name in merged)
+                return True
+
+            sources = [snapshot]
+            events = {}
+            for name in sealed:
+                sources.append(map_file(os.path.join(self.directory, name)))
+                scan_segment(sources[-1], len(sources) - 1, events)
+
+            cutoff = time.time() - self.ttl
+            temporary = f"{snapshot_path}.tmp"
+            new_index = []
+            with open(temporary, 'wb') as f:
+                f.write(SNAPSHOT_MAGIC)
+                position = len(SNAPSHOT_MAGIC)
+
+                for session_id in set(index) | set(events):
+                    entry = index.get(session_id)
+                    session_events = events.get(session_id)
+                    if not session_events:
+                        # جلسة لم تتغير: نسخ البايتات كما هي
+                        if entry[2] < cutoff:
+                            continue
+                        data = snapshot[entry[0]:entry[0] + entry[1]]
+                        last_activity = entry[2]
+                    else:
+                        session = self._build(entry, session_events, snapshot, sources)
+                        if session.last_activity < cutoff:
+                            continue
+                        data = encode_session(session)
+                        last_activity = session.last_activity
+                    f.write(data)
+                    new_index.append((session_id, position, len(data), last_activity))
+                    position += len(data)
+
+                index_offset = position
+                for session_id, offset, length, last_activity in new_index:
+                    sid = session_id.encode('utf-8')
+                    f.write(SID_LENGTH.pack(len(sid)) + sid + INDEX_ENTRY.pack(offset, length, last_activity))
+                    position += SID_LENGTH.size + len(sid) + INDEX_ENTRY.size
+
+                names_data = json.dumps(sealed).encode('utf-8')
+                f.write(names_data)
+                hashes_offset = position + len(names_data)
+                hashes = sorted(sid_hash(session_id) for session_id, _, _, _ in new_index)
+                f.write(struct.pack(f"<{len(hashes)}Q", *hashes))
+                f.write(TRAILER.pack(index_offset, len(new_index), position, len(names_data), hashes_offset))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(temporary, snapshot_path)
+
+            self._remove(sealed + [name for name in names if name in merged])
+            self.compactions += 1
+            self.last_compaction_seconds = time.perf_counter() - started
+            return True
+
+    def _remove(self, names):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    # ---------- التشغيل ----------
+    def start(self, ttl, max_messages, plain_messages):
+        """استرجاع في الخلفية ثم تدوير ودمج دوري"""
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.plain_messages = plain_messages
+        os.makedirs(self.directory, exist_ok=True)
+
+        def loop():
+            self.recover()
+            while True:
+                time.sleep(self.snapshot_interval)
+                try:
+                    self.rotate()
+                    self.compact()
+                    self._expire_index()
+                except Exception as e:
+                    print(f"Session journal compaction error: {e}")
+
+        self.thread = threading.Thread(target=loop, daemon=True)
+        self.thread.start()
+
+    def stats(self):
+        with self.pending_lock:
+            pending = len(self.index) + sum(1 for session_id in self.events if session_id not in self.index)
+        return {
+            "recovering": not self.ready.is_set(),
+            "recovered_sessions": self.recovered,
+            "recovery_seconds": round(self.recovery_seconds, 3) if self.recovery_seconds is not None else None,
+            "restored_sessions": self.restored,
+            "pending_sessions": pending,
+            "wal_bytes_written": self.written,
+            "compactions": self.compactions,
+            "last_compaction_seconds": (
+                round(self.last_compaction_seconds, 3) if self.last_compaction_seconds is not None else None
+            )
+        }
+
+
+def create_session_journal():
+    """سجل الجلسات إذا حُدد SESSION_LOG_DIR (للمخزن في الذاكرة فقط)، وإلا None"""
+    directory = os.environ.get("SESSION_LOG_DIR")
+    if not directory:
+        return None
+    return SessionJournal(
+        directory,
+        snapshot_interval=float(os.environ.get("SESSION_SNAPSHOT_INTERVAL", 300)),
+        fsync=os.environ.get("SESSION_LOG_FSYNC", "1") == "1"
+    )
@@ -0,0 +1,114 @@
+"""
+كشف لغة الرسالة بمرور واحد على النص.
+
+detect_language القديمة كانت تبني قائمة بكل حرف عربي ثم بكل حرف لاتيني
+(re.findall) فقط لتأخذ طولها، وهذا مكلف مع السجلات والتقارير الطويلة التي
+يلصقها المستخدمون. هنا النص يحول لـ UTF-8 ثم كل بايت لفئته بجدول واحد
+(bytes.translate في C) وتعد الفئات:
+- حروف نطاق العربية U+0600-U+06FF بالضبط هي التي يبدأ ترميزها بالبايت 0xD8-0xDB
+- الحروف اللاتينية a-z و A-Z والأرقام 0-9 بايت واحد كما هي
+
+الناتج نفس detect_language القديمة دائماً ('arabic' أو 'english')، ومعه في
+ScriptProfile الثقة ونسبة اللغة الأخرى (mixed). ScriptCounter يعد نفس الفئات
+على أجزاء نص متتالية (بث) ويعطي النتيجة على ما وصل حتى الآن.
+"""
+import re
+
+ARABIC, LATIN, DIGIT, OTHER = b"A", b"L", b"D", b"."
+
+# جدول 256 بايت: فئة كل بايت في ترميز UTF-8
+SCRIPT_TABLE = bytearray(OTHER * 256)
+for byte in range(0xD8, 0xDC):
+    SCRIPT_TABLE[byte] = ord(ARABIC)
+for byte in b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ":
+    SCRIPT_TABLE[byte] = ord(LATIN)
+for byte in b"0123456789":
+    SCRIPT_TABLE[byte] = ord(DIGIT)
+SCRIPT_TABLE = bytes(SCRIPT_TABLE)
+
+# عند تساوي عدد الحروف فقط (نادر): عدد الكلمات كما في الدالة القديمة
+ARABIC_WORD_RE = re.compile(r'\b[\u0600-\u06FF]+\b')
+LATIN_WORD_RE = re.compile(r'\b[a-zA-Z]+\b')
+
+# نسبة حروف اللغة الأقل التي تجعل النص مختلطاً
+MIXED_MIN_SHARE = 0.2
+
+
+def count_scripts(text):
+    """(حروف عربية، حروف لاتينية، أرقام) في النص"""
+    # surrogatepass: نص JSON قد يحتوي surrogate منفرد، وترميزه 0xED فلا يغير العد
+    classes = text.encode("utf-8", "surrogatepass").translate(SCRIPT_TABLE)
+    return classes.count(ARABIC), classes.count(LATIN), classes.count(DIGIT)
+
+
+def count_words(pattern, text):
+    return sum(1 for _ in pattern.finditer(text))
+
+
+class ScriptProfile:
+    """نتيجة الكشف: اللغة وثقتها (نسبة حروف اللغة الغالبة) وهل النص مختلط"""
+
+    __slots__ = ('language', 'confidence', 'mixed', 'arabic', 'latin', 'digits')
+
+    def __init__(self, language, arabic, latin, digits):
+        letters = arabic + latin
+        self.language = language
+        self.confidence = max(arabic, latin) / letters if letters else 0.0
+        self.mixed = bool(letters) and min(arabic, latin) / letters >= MIXED_MIN_SHARE
+        self.arabic = arabic
+        self.latin = latin
+        self.digits = digits
+
+    def __repr__(self):
+        return (f"ScriptProfile({self.language!r}, confidence={self.confidence:.2f}, mixed={self.mixed}, "
+                f"arabic={self.arabic}, latin={self.latin}, digits={self.digits})")
+
+
+def choose_language(arabic, latin, text=None):
+    if arabic > latin:
+        return 'arabic'
+    if latin > arabic:
+        return 'english'
+    if not arabic or text is None:
+        # بدون حروف أصلاً لا توجد كلمات، والتساوي يرجع للعربية كما كان
+        return 'arabic'
+    # إذا كانت متساوية، ننظر إلى الكلمات
+    return 'arabic' if count_words(ARABIC_WORD_RE, text) >= count_words(LATIN_WORD_RE, text) else 'english'
+
+
+def classify_script(text):
+    """ScriptProfile للنص كاملاً"""
+    arabic, latin, digits = count_scripts(text)
+    return ScriptProfile(choose_language(arabic, latin, text), arabic, latin, digits)
+
+
+def detect_language(text):
+    """كشف لغة النص بدقة"""
+    arabic, latin, _ = count_scripts(text)
+    return choose_language(arabic, latin, text)
+
+
+class ScriptCounter:
+    """نفس العد على نص يصل أجزاءً (بث أو بداية نص طويل)"""
+
+    __slots__ = ('arabic', 'latin', 'digits')
+
+    def __init__(self):
+        self.arabic = 0
+        self.latin = 0
+        self.digits = 0
+
+    def feed(self, text):
+        arabic, latin, digits = count_scripts(text)
+        self.arabic += arabic
+        self.latin += latin
+        self.digits += digits
+        return self
+
+    def profile(self):
+        """اللغة على ما وصل حتى الآن. التساوي يرجع للعربية لأن الكلمات قد تكون مقطوعة بين الأجزاء"""
+        return ScriptProfile(choose_language(self.arabic, self.latin), self.arabic, self.latin, self.digits)
+
+    def decided(self, remaining):
+        """هل تبقى اللغة نفسها مهما كانت آخر remaining حرفاً من النص"""
+        return abs(self.arabic - self.latin) > remaining
@@ -0,0 +1,360 @@
+"""
+قياسات داخل العملية (هستوغرام، عدادات، قيم لحظية) وتصديرها بصيغة Prometheus.
+
+التسجيل يحدث عدة مرات في كل طلب فيجب أن يكون رخيصاً: كل قياس يُعرّف مرة
+بأسماء تسمياته، و labels(...) يرجع سلسلة محفوظة لتلك القيم، والتسجيل نفسه
+bisect + زيادة في نسخة الخيط من السلسلة بدون قفل. في المسارات الساخنة (مراحل الطلب،
+الردود، المسارات) تربط السلاسل مرة عند الاستيراد بـ bind() فلا يمر كل تسجيل
+بـ labels().
+
+مع عدة عمليات gunicorn: إذا حُدد METRICS_DIR تكتب كل عملية لقطة لقياساتها
+في <pid>.json كل METRICS_FLUSH_INTERVAL ثانية، ومسار /metrics في أي عملية يدمج
+كل الملفات. العدادات والهستوغرامات تجمع من كل الملفات (حتى العمليات المنتهية
+حتى لا تتناقص العدادات)، والقيم اللحظية من العمليات الحية فقط.
+يفضل أن يكون METRICS_DIR مجلداً جديداً فارغاً لكل تشغيل.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from threading import get_ident
+from time import perf_counter
+
+# حدود الهستوغرام بالثواني: من 50 ميكروثانية (الدوال المحلية) حتى 30 ثانية (Groq)
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+# ====== السلاسل ======
+# كل خيط يكتب في نسخته (shard) من أرقام السلسلة فلا يحتاج التسجيل قفلاً، واللقطة
+# تجمع النسخ. قراءة نسخة أثناء كتابتها قد تعطي عداً بدون قيمته في المجموع، ويصحح
+# في اللقطة التالية
+class HistogramSeries:
+    __slots__ = ('buckets', 'shards')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.shards = {}  # thread id -> عدد لكل حد + ما فوق آخر حد + المجموع
+
+    def observe(self, value):
+        counts = self.shards.get(get_ident())
+        if counts is None:
+            counts = self.shards.setdefault(get_ident(), [0] * (len(self.buckets) + 2))
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def snapshot(self):
+        total = [0] * (len(self.buckets) + 2)
+        for counts in list(self.shards.values()):
+            for index, count in enumerate(counts):
+                total[index] += count
+        return total
+
+
+class CounterSeries:
+    __slots__ = ('shards',)
+
+    def __init__(self):
+        self.shards = {}  # thread id -> [القيمة]
+
+    def inc(self, amount=1):
+        value = self.shards.get(get_ident())
+        if value is None:
+            value = self.shards.setdefault(get_ident(), [0])
+        value[0] += amount
+
+    def snapshot(self):
+        return sum(value[0] for value in list(self.shards.values()))
+
+
+class Family:
+    """قياس واحد بأسماء تسميات ثابتة، وسلسلة لكل مجموعة قيم"""
+
+    def __init__(self, name, kind, help_text, label_names, new_series):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.new_series = new_series
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        series = self.children.get(values)
+        if series is None:
+            with self.lock:
+                series = self.children.setdefault(values, self.new_series())
+        return series
+
+    def bind(self, values=()):
+        """BoundSeries مملوءة مسبقاً بسلاسل values"""
+        bound = BoundSeries(self)
+        for value in values:
+            bound[value]
+        return bound
+
+    def snapshot(self):
+        with self.lock:
+            children = list(self.children.items())
+        return [[list(values), series.snapshot()] for values, series in children]
+
+
+class BoundSeries(dict):
+    """{قيمة التسمية: سلسلة}. القيمة نص لقياس بتسمية واحدة أو tuple لعدة تسميات،
+    وما لم يربط بعد يربط عند أول استخدام"""
+
+    __slots__ = ('family',)
+
+    def __init__(self, family):
+        super().__init__()
+        self.family = family
+
+    def __missing__(self, value):
+        series = self.family.labels(*(value if isinstance(value, tuple) else (value,)))
+        self[value] = series
+        return series
+
+
+# ====== السجل ======
+class Metrics:
+    def __init__(self, namespace, directory=None, flush_interval=5.0, buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buckets = buckets
+        self.families = {}
+        self.gauges = []  # (name, help, fn -> value, merge: "sum" | "max")
+        self.flusher = None
+
+    # ---------- التعريف ----------
+    def histogram(self, name, help_text, label_names=()):
+        return self._register(Family(
+            f"{self.namespace}_{name}", "histogram", help_text, label_names,
+            lambda: HistogramSeries(self.buckets)
+        ))
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Family(
+            f"{self.namespace}_{name}_total", "counter", help_text, label_names, CounterSeries
+        ))
+
+    def gauge(self, name, help_text, fn, merge="sum"):
+        """قيمة لحظية تحسب عند التصدير. merge=max للقيم المشتركة بين العمليات"""
+        self.gauges.append((f"{self.namespace}_{name}", help_text, fn, merge))
+
+    def _register(self, family):
+        self.families[family.name] = family
+        return family
+
+    # ---------- اللقطات ----------
+    def snapshot(self):
+        gauges = []
+        for name, _, fn, merge in self.gauges:
+            try:
+                gauges.append([name, fn(), merge])
+            except Exception as e:
+                print(f"Metrics gauge error ({name}): {e}")
+
+        return {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "families": {name: family.snapshot() for name, family in self.families.items()},
+            "gauges": gauges
+        }
+
+    def flush(self):
+        """كتابة لقطة هذه العملية (استبدال ذري للملف)"""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
+
+    def start_flusher(self):
+        if not self.directory or self.flusher is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        def loop():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Metrics flush error: {e}")
+
+        self.flusher = threading.Thread(target=loop, daemon=True)
+        self.flusher.start()
+
+    def _snapshots(self):
+        own = self.snapshot()
+        snapshots = [own]
+        if not self.directory or not os.path.isdir(self.directory):
+            return snapshots
+
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json") or filename == f"{own['pid']}.json":
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    # ---------- التصدير ----------
+    def render(self):
+        """كل القياسات مدموجة من كل العمليات بصيغة Prometheus النصية"""
+        merged = {name: {} for name in self.families}
+        gauges = {}
+
+        for snapshot in self._snapshots():
+            for name, children in snapshot.get("families", {}).items():
+                if name not in merged:
+                    continue
+                for values, value in children:
+                    key = tuple(values)
+                    if isinstance(value, list):
+                        total = merged[name].setdefault(key, [0] * len(value))
+                        for index, count in enumerate(value):
+                            total[index] += count
+                    else:
+                        merged[name][key] = merged[name].get(key, 0) + value
+
+            if snapshot["pid"] != os.getpid() and not pid_alive(snapshot["pid"]):
+                continue
+            for name, value, merge in snapshot["gauges"]:
+                if name not in gauges:
+                    gauges[name] = value
+                elif merge == "max":
+                    gauges[name] = max(gauges[name], value)
+                else:
+                    gauges[name] += value
+
+        lines = []
+        for name, family in sorted(self.families.items()):
+            lines.append(f"# HELP {name} {family.help}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for values, value in sorted(merged[name].items()):
+                labels = list(zip(family.label_names, values))
+                if family.kind == "counter":
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(self.buckets, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + [('le', format_value(bound))])} {cumulative}")
+                cumulative += value[len(self.buckets)]
+                lines.append(f"{name}_bucket{format_labels(labels + [('le', '+Inf')])} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(value[-1])}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+        for name, help_text, _, _ in sorted(self.gauges, key=lambda gauge: gauge[0]):
+            if name in gauges:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {format_value(gauges[name])}")
+
+        return "\n".join(lines) + "\n"
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# ====== أدوات التوقيت ======
+class StageClock:
+    """توقيت مراحل الطلب المتتالية: كل lap يسجل الزمن منذ الـ lap السابق.
+    stages: BoundSeries من Family.bind() بأسماء المراحل"""
+
+    __slots__ = ('stages', 'last')
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.last = perf_counter()
+
+    def reset(self):
+        self.last = perf_counter()
+
+    def lap(self, stage):
+        now = perf_counter()
+        self.stages[stage].observe(now - self.last)
+        self.last = now
+
+
+def record_usage(tokens, usage, *labels):
+    """توكنات Groq الفعلية من usage في الرد. labels قبل تسمية النوع (prompt/completion)"""
+    tokens.labels(*labels, "prompt").inc(usage.prompt_tokens or 0)
+    tokens.labels(*labels, "completion").inc(usage.completion_tokens or 0)
+
+
+class TimedStream:
+    """يغلف بث Groq لتسجيل زمن أول توكن والزمن الكلي والتوكنات المستخدمة"""
+
+    def __init__(self, stream, started, seconds, tokens, labels=()):
+        self.stream = stream
+        self.started = started
+        self.seconds = seconds
+        self.tokens = tokens
+        self.labels = labels
+
+    def _record(self, chunk, first):
+        if first:
+            self.seconds.labels("first_token").observe(time.perf_counter() - self.started)
+        # Groq يضع usage في x_groq في آخر قطعة
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+        if usage is not None:
+            record_usage(self.tokens, usage, *self.labels)
+
+    def _done(self):
+        self.seconds.labels("total").observe(time.perf_counter() - self.started)
+
+    def __iter__(self):
+        first = True
+        for chunk in self.stream:
+            self._record(chunk, first)
+            first = False
+            yield chunk
+        self._done()
+
+    async def _aiter(self):
+        first = True
+        async for chunk in self.stream:
+            self._record(chunk, first)
+            first = False
+            yield chunk
+        self._done()
+
+    def __aiter__(self):
+        return self._aiter()
+
+    def close(self):
+        return self.stream.close()
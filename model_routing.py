@@ -0,0 +1,129 @@
+"""
+اختيار نموذج Groq و max_tokens لكل سؤال يصل للنموذج، بدل 70B و 1024 للجميع.
+
+الاختيار من خصائص رخيصة بدون أي استدعاء: طول السؤال بالتوكنات التقديرية، اللغة
+وهل الرسالة مختلطة (language.py)، نوع السؤال (تعريف قصير، عام، أو معقد: حساب، مقارنة، تصميم،
+شرح خطوات)، وعمق تاريخ المحادثة.
+
+- fast (llama-3.1-8b-instant): أسئلة التعريف القصيرة في بداية المحادثة فقط
+- large (llama-3.3-70b-versatile): كل ما عداها، فالأسئلة الصعبة لا تتأثر
+
+max_tokens حسب نوع السؤال، والعربية تحتاج توكنات أكثر لنفس الرد. Groq يحسب
+max_tokens من حد التوكنات في الدقيقة فتقليله يقلل أيضاً رفض 429.
+
+عند 429 من نموذج (حدود Groq لكل نموذج) يعاد الطلب مرة واحدة بالنموذج الآخر.
+"""
+import os
+import re
+
+from context import estimate_tokens
+
+DEFINITION_RE = re.compile(
+    r"\b(what\s+(is|are|does)|what's|define|definition\s+of|meaning\s+of)\b"
+    r"|(^|\s)و?(ما|شنو|شو)\s+(هو|هي|هم|معنى|المقصود)"
+    r"|(^|\s)و?(ماهو|ماهي|عرف|تعريف)",
+    re.IGNORECASE
+)
+COMPLEX_RE = re.compile(
+    r"\b(how|why|calculate|compute|estimate|compare|difference|versus|vs|explain|design|select|choose"
+    r"|troubleshoot|optimi[sz]e|example|step[- ]by[- ]step|in\s+detail)\b"
+    r"|(كيف|كيفية|شلون|لماذا|ليش|احسب|أحسب|حساب|قارن|مقارنة|الفرق|اشرح|شرح|صمم|تصميم|أختار|اختار"
+    r"|خطوات|بالتفصيل|مثال|تحليل)",
+    re.IGNORECASE
+)
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+# الحد الأعلى لكل نوع، والعربية أكثر توكنات لكل كلمة
+BASE_MAX_TOKENS = {"definition": 400, "general": 800, "complex": 1024}
+LANGUAGE_TOKEN_FACTOR = {"arabic": 1.3}
+
+
+def question_kind(user_msg):
+    """definition | general | complex"""
+    # رقمان أو أكثر غالباً سؤال حسابي (معدل، عمق، نسبة)
+    if COMPLEX_RE.search(user_msg) or len(NUMBER_RE.findall(user_msg)) >= 2:
+        return "complex"
+    if DEFINITION_RE.search(user_msg):
+        return "definition"
+    return "general"
+
+
+class ModelTier:
+    __slots__ = ('name', 'model', 'max_tokens')
+
+    def __init__(self, name, model, max_tokens):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+
+
+class ModelRoute:
+    """نتيجة الاختيار: الطبقة و max_tokens وسبب الاختيار (للقياسات)"""
+
+    __slots__ = ('tier', 'max_tokens', 'reason')
+
+    def __init__(self, tier, max_tokens, reason):
+        self.tier = tier
+        self.max_tokens = max_tokens
+        self.reason = reason
+
+    @property
+    def model(self):
+        return self.tier.model
+
+
+class ModelRouter:
+    def __init__(self, fast, large, enabled=True, fast_max_tokens=40, fast_max_history=4,
+                 fast_languages=("arabic", "english")):
+        self.fast = fast
+        self.large = large
+        self.enabled = enabled
+        self.fast_max_tokens = fast_max_tokens
+        self.fast_max_history = fast_max_history
+        self.fast_languages = frozenset(fast_languages)
+
+    def max_tokens(self, kind, language, tier):
+        tokens = int(BASE_MAX_TOKENS[kind] * LANGUAGE_TOKEN_FACTOR.get(language, 1.0))
+        return min(tokens, tier.max_tokens)
+
+    def choose(self, user_msg, language, history_length, mixed=False):
+        if not self.enabled:
+            return ModelRoute(self.large, self.large.max_tokens, "disabled")
+
+        kind = question_kind(user_msg)
+        if kind != "definition":
+            tier, reason = self.large, kind
+        elif estimate_tokens(user_msg) > self.fast_max_tokens:
+            tier, reason = self.large, "long"
+        elif history_length > self.fast_max_history:
+            tier, reason = self.large, "history"
+        elif language not in self.fast_languages:
+            tier, reason = self.large, "language"
+        elif mixed:
+            # عربي مع مصطلحات أو سجلات إنجليزية: النموذج الصغير أضعف في خلط اللغتين
+            tier, reason = self.large, "mixed"
+        else:
+            tier, reason = self.fast, kind
+        return ModelRoute(tier, self.max_tokens(kind, language, tier), reason)
+
+    def fallback(self, route):
+        """نفس الطلب بالطبقة الأخرى (بعد 429)"""
+        tier = self.large if route.tier is self.fast else self.fast
+        return ModelRoute(tier, min(route.max_tokens, tier.max_tokens), "fallback")
+
+
+def create_model_router(large_model):
+    """إعدادات MODEL_ROUTING_* من البيئة. MODEL_ROUTING=0 يرجع كل الأسئلة للنموذج الكبير"""
+    max_tokens = int(os.environ.get("MODEL_MAX_TOKENS", 1024))
+    return ModelRouter(
+        fast=ModelTier("fast", os.environ.get("FAST_MODEL", "llama-3.1-8b-instant"),
+                       int(os.environ.get("FAST_MODEL_MAX_TOKENS", 512))),
+        large=ModelTier("large", large_model, max_tokens),
+        enabled=os.environ.get("MODEL_ROUTING", "1") == "1",
+        fast_max_tokens=int(os.environ.get("MODEL_ROUTING_FAST_MAX_TOKENS", 40)),
+        fast_max_history=int(os.environ.get("MODEL_ROUTING_FAST_MAX_HISTORY", 4)),
+        fast_languages=[
+            language.strip() for language in
+            os.environ.get("MODEL_ROUTING_FAST_LANGUAGES", "arabic,english").split(",") if language.strip()
+        ]
+    )
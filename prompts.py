@@ -0,0 +1,211 @@
+"""
+برومبتات النظام: تحمل وتحسب مرة واحدة عند بدء التشغيل بدل كل طلب.
+
+- PromptTemplate لكل لغة: النص، التوكنات التقديرية، ورسالة النظام نفسها (بادئة
+  مشتركة لا تعدل) التي تبدأ بها كل رسائل Groq لهذه اللغة
+- الإصدار: sha1 للترتيب PROMPT_LAYOUT ولكل نص ثابت في القالب، فيتغير مع أي
+  تعديل ويدخل في مفتاح كاش الردود (completion_cache) ومفتاح دمج الطلبات
+- ترتيب الرسائل ثابت: النظام ثم الملخص ثم التاريخ ثم الرسالة الحالية، فبداية
+  الطلب متطابقة بين كل طلبات نفس اللغة (يستفيد منها كاش البادئة في Groq)
+- ChatPrompt: قائمة رسائل عادية تحمل الإصدار وطول البادئة، فيعرف flight_key
+  أن يضع الإصدار مكان نص النظام بدل ترميزه في كل طلب
+
+SYSTEM_PROMPTS_DIR (اختياري): مجلد فيه arabic.txt و english.txt يستبدل النص
+المضمن هنا للغة الموجود ملفها.
+"""
+import hashlib
+import os
+
+from context import estimate_tokens
+
+# ترتيب رسائل Groq، وتغييره يغير كل الإصدارات
+PROMPT_LAYOUT = ("system", "summary", "history", "user")
+
+
+# ====== SYSTEM PROMPT المحسن والاحترافي مع التنسيق الإجباري ======
+SYSTEM_PROMPT_ARABIC = """
+أنت مساعد **OILNOVA** الذكي - مساعد متخصص في هندسة النفط والغاز.
+
+🎯 **التخصص الأساسي**: 
+- هندسة النفط والغاز بشكل حصري
+- أنظمة ESP والرفع الاصطناعي
+- هندسة المكامن والتنقيب
+- عمليات الحفر والإنتاج
+- التسجيل الجيوفيزيائي وتحليل البيانات النفطية
+
+🌐 **قواعد اللغة الصارمة**:
+- إذا كان السؤال بالعربية → أجب بالعربية فقط
+- إذا كان السؤال بالإنجليزية → أجب بالإنجليزية فقط  
+- لا تخلط اللغات أبداً في الرد الواحد
+- إذا اضطررت لاستخدام مصطلح تقني إنجليزي، اكتبه ثم اشرحه بين قوسين
+
+📝 **التنسيق الإجباري للقوائم**:
+- عند الإجابة عن أي سؤال يحتوي على أجزاء أو خطوات أو تعداد نقطي، يجب أن تكتب كل نقطة في سطر مستقل
+- استخدم هذا التنسيق فقط:
+  
+1. [النقطة الأولى]
+2. [النقطة الثانية] 
+3. [النقطة الثالثة]
+
+- أضف سطر جديد قبل كل رقم، ولا تكتب أي نقطة في نفس السطر مع نقطة أخرى
+
+👥 **معلومات الفريق (فقط عند السؤال المباشر)**:
+- حيدر نسيم: مؤسس المنصة، مهندس نفط، مبرمج
+- علي بلال: مبرمج بايثون من الموصل
+- نور كنعان: مبرمجة بايثون من كركوك
+- أرزو متين: محللة بيانات ومبرمجة بايثون من كركوك
+
+🚫 **السياسات**:
+- لا تعطي معلومات شخصية إلا عند السؤال المباشر عن أعضاء الفريق
+- للأسئلة خارج تخصص النفط: "أنا متخصص في هندسة النفط والغاز فقط"
+- حافظ على الاحترافية والدقة التقنية
+- رتب الردود بشكل منظم وسهل القراءة
+- التزم بالتنسيق الإجباري للقوائم في كل الإجابات
+"""
+
+SYSTEM_PROMPT_ENGLISH = """
+You are **OILNOVA** Smart Assistant - specialized in oil and gas engineering.
+
+🎯 **Primary Specialization**: 
+- Oil and gas engineering exclusively
+- ESP systems and artificial lift
+- Reservoir engineering and exploration
+- Drilling and production operations
+- Geophysical logging and oil data analysis
+
+🌐 **Strict Language Rules**:
+- If question is in Arabic → reply ONLY in Arabic
+- If question is in English → reply ONLY in English  
+- Never mix languages in the same response
+- If you must use an English technical term, write it then explain in parentheses
+
+📝 **Mandatory List Formatting**:
+- When answering any question containing parts, steps, or bullet points, you MUST write each point on a separate line
+- Use this format ONLY:
+  
+1. [First point]
+2. [Second point]
+3. [Third point]
+
+- Add a newline before each number, and never write two points on the same line
+
+👥 **Team Information (only when directly asked)**:
+- Hayder Naseem: Platform founder, petroleum engineer, programmer
+- Ali Bilal: Python programmer from Mosul
+- Noor Kanaan: Python programmer from Kirkuk
+- Arzu Metin: Data analyst and Python programmer from Kirkuk
+
+🚫 **Policies**:
+- Do not give personal information unless directly asked about team members
+- For non-oil/gas questions: "I specialize only in oil and gas engineering"
+- Maintain professionalism and technical accuracy
+- Organize responses in a structured, easy-to-read format
+- Strictly adhere to mandatory list formatting in all responses
+"""
+
+# ====== تلخيص التاريخ الذي خرج من ميزانية السياق ======
+SUMMARY_PROMPT = """Summarize the earlier part of this oil and gas engineering conversation in at most 120 words.
+Write in the same language as the conversation. Keep technical facts, numbers, well/field details and what the user is trying to achieve.
+If a previous summary is given, merge it with the new messages into one summary."""
+
+SUMMARY_PREFIX = {
+    "arabic": "ملخص الجزء السابق من المحادثة: ",
+    "english": "Summary of the earlier conversation: "
+}
+
+DEFAULT_PROMPTS = {
+    "arabic": SYSTEM_PROMPT_ARABIC,
+    "english": SYSTEM_PROMPT_ENGLISH
+}
+
+
+def prompt_version(*parts):
+    """12 حرفاً من sha1 للترتيب والنصوص"""
+    digest = hashlib.sha1("\x1f".join(PROMPT_LAYOUT).encode('utf-8'))
+    for part in parts:
+        digest.update(b"\x1e")
+        digest.update(part.encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+class ChatPrompt(list):
+    """رسائل Groq لطلب واحد. أول prefix_length رسالة هي بادئة القالب ذي الإصدار version"""
+
+    __slots__ = ('version', 'prefix_length')
+
+
+class PromptTemplate:
+    """برومبت لغة واحدة، محسوب مرة واحدة"""
+
+    __slots__ = ('language', 'text', 'summary_prefix', 'version', 'tokens', 'prefix')
+
+    def __init__(self, language, text, summary_prefix):
+        self.language = language
+        self.text = text
+        self.summary_prefix = summary_prefix
+        self.version = prompt_version(language, text, summary_prefix)
+        self.tokens = estimate_tokens(text)
+        # نفس القاموس في كل الطلبات: لا يعدل
+        self.prefix = ({"role": "system", "content": text},)
+
+    def messages(self, history, user_msg, summary=None):
+        """رسائل Groq بترتيب PROMPT_LAYOUT"""
+        messages = ChatPrompt(self.prefix)
+        messages.version = self.version
+        messages.prefix_length = len(self.prefix)
+        if summary:
+            messages.append({"role": "system", "content": self.summary_prefix + summary})
+        # الرسائل المخزنة تحمل "tokens" ولا يرسل لـ Groq إلا role و content
+        messages += [{"role": message["role"], "content": message["content"]} for message in history]
+        messages.append({"role": "user", "content": user_msg})
+        return messages
+
+
+class PromptSet:
+    """قوالب كل اللغات وبرومبت التلخيص"""
+
+    def __init__(self, prompts, summary_prompt=SUMMARY_PROMPT, source="builtin"):
+        self.templates = {
+            language: PromptTemplate(language, text, SUMMARY_PREFIX.get(language, ""))
+            for language, text in prompts.items()
+        }
+        self.summary_prompt = {"role": "system", "content": summary_prompt}
+        self.source = source
+        self.version = prompt_version(summary_prompt, *(
+            template.version for _, template in sorted(self.templates.items())
+        ))
+
+    def __getitem__(self, language):
+        return self.templates[language]
+
+    def summary_messages(self, transcript):
+        return [self.summary_prompt, {"role": "user", "content": transcript}]
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "layout": list(PROMPT_LAYOUT),
+            "source": self.source,
+            "languages": {
+                language: {"version": template.version, "tokens": template.tokens}
+                for language, template in self.templates.items()
+            }
+        }
+
+
+def load_prompts(directory=None):
+    """النصوص المضمنة، مع استبدال ما يوجد له ملف {language}.txt في directory"""
+    prompts = dict(DEFAULT_PROMPTS)
+    if not directory:
+        return PromptSet(prompts)
+    for language in prompts:
+        path = os.path.join(directory, f"{language}.txt")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                prompts[language] = f.read()
+    return PromptSet(prompts, source=directory)
+
+
+def create_prompts():
+    """القوالب حسب SYSTEM_PROMPTS_DIR من البيئة"""
+    return load_prompts(os.environ.get("SYSTEM_PROMPTS_DIR") or None)
@@ -1,10 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import os
-from groq import Groq
+import json
+import hmac
 import uuid
-from datetime import datetime, timedelta
+import threading
+import time
 import re
+from concurrent.futures import ThreadPoolExecutor
+from sessions import create_session_store
+from journal import create_session_journal
+from completion_cache import create_completion_cache
+from singleflight import SingleFlight, flight_key
+from context import estimate_tokens, fit_history, RollingSummaries
+from metrics import Metrics, StageClock, TimedStream, record_usage
+from upstream import create_upstream, is_rate_limited
+from model_routing import create_model_router
+from language import detect_language, classify_script
+from admission import create_admission_controller, Rejected
+from jobs import create_job_runner, raise_if_cancelled, JobCancelled
+from prompts import create_prompts
 
 app = Flask(__name__)
 
@@ -12,16 +27,103 @@ app = Flask(__name__)
 CORS(app, resources={
     r"/*": {
         "origins": ["https://petroai-iq.web.app","https://ping-pkai.onrender.com" ,"*"],
-        "methods": ["POST", "GET", "OPTIONS"],
+        "methods": ["POST", "GET", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type"]
     }
 })
 
 # ====== Groq Client ======
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+# مهلة، إعادة محاولة، تحوط وقاطع دائرة (إعدادات UPSTREAM_* في upstream.py)
+upstream = create_upstream(os.environ.get("GROQ_API_KEY"))
+
+CHAT_MODEL = "llama-3.3-70b-versatile"
+COMPLETION_PARAMS = {
+    "temperature": 0.7,
+    "top_p": 0.9
+}
+
+# النموذج و max_tokens لكل سؤال (model_routing.py): أسئلة التعريف القصيرة لنموذج سريع
+model_router = create_model_router(CHAT_MODEL)
+
+ERROR_MESSAGES = {
+    "arabic": "عذراً، حدث خطأ في المعالجة. يرجى المحاولة مرة أخرى.",
+    "english": "Sorry, an error occurred during processing. Please try again."
+}
+
+BUSY_MESSAGES = {
+    "arabic": "الخدمة مشغولة حالياً بسبب كثرة الطلبات. يرجى المحاولة بعد قليل.",
+    "english": "The service is busy right now. Please try again in a moment."
+}
+
+# ====== التحكم في الطلبات التي تحتاج النموذج (إعدادات ADMISSION_* في admission.py) ======
+admission = create_admission_controller()
+# كل بروكسي يضيف في آخر X-Forwarded-For عنوان من اتصل به، وما قبل ذلك يكتبه المستخدم كما يشاء.
+# TRUST_FORWARDED_FOR=1 خلف بروكسي (Render): العنوان الذي أضافه أقرب TRUSTED_PROXY_COUNT بروكسي من اليمين
+TRUST_FORWARDED_FOR = os.environ.get("TRUST_FORWARDED_FOR", "0") == "1"
+TRUSTED_PROXY_COUNT = max(1, int(os.environ.get("TRUSTED_PROXY_COUNT", 1)))
+
+# /chat/batch: أقصى عدد عناصر في الطلب وأقصى عدد جلسات تعالج بالتوازي
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 50))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 8))
+
+# الردود الطويلة كمهام في الخلفية (/chat/jobs، إعدادات JOBS_* في jobs.py)
+job_runner = create_job_runner()
+
+# واجهة الإدارة /admin/*: تحتاج Authorization: Bearer <ADMIN_TOKEN>، وبدون ADMIN_TOKEN مغلقة
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", 100))
+ADMIN_MAX_PAGE_SIZE = 1000
+
+# الطلبات المتطابقة المتزامنة تشترك في استدعاء واحد لـ Groq
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", 120))
+upstream_flights = SingleFlight(timeout=SINGLE_FLIGHT_TIMEOUT)
+
+# كاش ردود الدور الأول (نفس السؤال بدون تاريخ محادثة)
+completion_cache = create_completion_cache()
 
 # ====== تخزين المحادثات ======
-conversations = {}
+# حد أعلى لتخزين الرسائل فقط، أما ما يرسل للنموذج فتحدده ميزانية التوكنات
+HISTORY_LIMIT = int(os.environ.get("HISTORY_MAX_MESSAGES", 40))
+# مع SESSION_LOG_DIR تحفظ الجلسات على القرص وتسترجع بعد إعادة التشغيل أو النشر
+session_journal = create_session_journal()
+session_store = create_session_store(max_messages=HISTORY_LIMIT, journal=session_journal)
+
+# أقصى عدد جلسات تحذف في كل طلب حتى لا تتأخر الطلبات عند انتهاء دفعة كبيرة
+CLEANUP_BATCH_SIZE = int(os.environ.get("SESSION_CLEANUP_BATCH", 64))
+SESSION_SWEEP_INTERVAL = int(os.environ.get("SESSION_SWEEP_INTERVAL", 60))
+
+# ====== القياسات (/metrics) ======
+metrics = Metrics(
+    "oilnova",
+    directory=os.environ.get("METRICS_DIR"),
+    flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+)
+STAGE_SECONDS = metrics.histogram("stage_seconds", "Time spent in each chat pipeline stage", ["stage"])
+UPSTREAM_SECONDS = metrics.histogram("upstream_seconds", "Groq call time (phase=first_token for streams, total)", ["phase"])
+REQUEST_SECONDS = metrics.histogram("request_seconds", "Time until response headers, per route", ["route"])
+REQUESTS = metrics.counter("requests", "Requests per route and status", ["route", "status"])
+REPLIES = metrics.counter("replies", "Chat replies per source (model, cache, local route)", ["source"])
+ERRORS = metrics.counter("errors", "Errors per route and exception type", ["route", "type"])
+UPSTREAM_TOKENS = metrics.counter("upstream_tokens", "Tokens reported in Groq usage per model tier", ["tier", "kind"])
+MODEL_SECONDS = metrics.histogram("model_seconds", "Non-streaming completion time per model tier", ["tier"])
+# سلاسل المسار الساخن مربوطة مرة واحدة (Family.bind) بدل labels() في كل طلب
+STAGES = STAGE_SECONDS.bind([
+    "session_cleanup", "detect_language", "history_load", "routing", "prompt_assembly", "admission",
+    "upstream", "format", "history_update"
+])
+REPLY_SOURCES = REPLIES.bind(["model", "cache"])
+ROUTE_SECONDS = REQUEST_SECONDS.bind()
+ROUTE_STATUSES = REQUESTS.bind()
+MODEL_ROUTES = metrics.counter("model_routes", "Model tier chosen per question and why", ["tier", "reason"])
+MODEL_FALLBACKS = metrics.counter("model_fallbacks", "Completions retried on the other tier after a 429", ["from_tier", "to_tier"])
+ADMISSION_REJECTED = metrics.counter("admission_rejected", "Model requests shed by admission control", ["reason"])
+# SQLite مشترك بين العمليات فالعدد نفسه في كل عملية، أما الذاكرة فلكل عملية جلساتها
+metrics.gauge("sessions", "Sessions in the session store", lambda: len(session_store),
+              merge="max" if session_store.shared else "sum")
+metrics.gauge("session_bytes", "Bytes held by in-process sessions", session_store.memory_bytes)
+metrics.gauge("chat_jobs_pending", "Chat jobs queued or running in this process", lambda: job_runner.pending)
+metrics.gauge("completion_cache_entries", "Entries in the completion cache", lambda: len(completion_cache.entries))
+metrics.gauge("completion_cache_bytes", "Bytes held by the completion cache", lambda: completion_cache.bytes)
 
 # ====== معلومات الفريق المحسنة ======
 FOUNDERS_INFO = {
@@ -110,67 +212,302 @@ FOUNDERS_INFO = {
     }
 }
 
+# ====== برومبتات النظام (prompts.py) ======
+prompts = create_prompts()
+
+# ====== ميزانية السياق ======
+# أقصى توكنات تقديرية للبرومبت كاملاً: النظام + الملخص + التاريخ + الرسالة الحالية
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2500))
+# تلخيص الرسائل التي تخرج من الميزانية (استدعاء إضافي لـ Groq في الخلفية)
+CONTEXT_SUMMARY = os.environ.get("CONTEXT_SUMMARY", "0") == "1"
+
+def summarize_history(previous_summary, messages):
+    """ملخص جديد من الملخص السابق والرسائل التي خرجت من السياق"""
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    if previous_summary:
+        transcript = f"Previous summary: {previous_summary}\n\n{transcript}"
+
+    completion = upstream.create(
+        model=CHAT_MODEL,
+        messages=prompts.summary_messages(transcript),
+        temperature=0.2,
+        max_tokens=256
+    )
+    return completion.choices[0].message.content.strip()
+
+history_summaries = RollingSummaries(summarize_history) if CONTEXT_SUMMARY else None
+
+# ====== كلمات البحث عن أعضاء الفريق ======
+# الترتيب مهم: أول عضو تطابق كلماته هو المعتمد
+TEAM_KEYWORDS = [
+    ("hayder", ["حيدر", "هايدر", "نسيم", "المؤسس", "منو مؤسس", "مؤسس المنصة", "بنيسان", "سامراء"],
+               ["hayder", "naseem", "founder", "owner", "creator", "samarra"]),
+    ("ali", ["علي بلال", "علي", "بلال", "زبور", "زمار", "موصل"],
+            ["ali", "bilal", "mosul", "jubour"]),
+    ("noor", ["نور", "كنعان", "كردية", "كركوك"],
+             ["noor", "kanaan", "kurdish", "kirkuk"]),
+    ("arzo", ["ارزو", "أرزو", "متين", "تركمانية"],
+             ["arzo", "arzu", "metin", "turkmen"]),
+]
+
+# ====== مطابقة الكلمات المفتاحية ======
+WORD_RE = re.compile(r'\w+')
+
+# أدوات تتصل بأول الكلمة العربية مثل: و، ف، ب، ل، ك، ال، بال، لل
+ARABIC_PREFIXES = ('وبال', 'وال', 'فال', 'بال', 'كال', 'لل', 'ال', 'و', 'ف', 'ب', 'ل', 'ك')
+
+def message_words(text):
+    """تقطيع الرسالة إلى كلمات بحروف صغيرة (مرة واحدة لكل رسالة)"""
+    return WORD_RE.findall(text.lower())
+
+def keyword_forms(keyword):
+    """صيغ الكلمة المقبولة: مع الأدوات العربية المتصلة بها، أو بصيغة الجمع الإنجليزية"""
+    if keyword.isascii():
+        return [keyword, keyword + 's']
+    return [keyword] + [prefix + keyword for prefix in ARABIC_PREFIXES]
+
+class KeywordMatcher:
+    """
+    مطابقة كلمات كاملة عبر جدول يبنى مرة واحدة (كل الصيغ مسبقاً)، فلا تطابق "علي"
+    داخل "عليك" ولا "ali" داخل "quality"، والبحث مجرد تقاطع مجموعات.
+    الكلمات المركبة مثل "علي بلال" تطابق ككلمات متتالية.
+    """
+
+    def __init__(self, keywords):
+        # keywords: [(label, [كلمات]), ...] والأسبقية لأول label عند التكرار
+        self.words = {}
+        self.phrases = {}
+        for label, items in keywords:
+            for keyword in items:
+                first, *rest = keyword.lower().split()
+                for form in keyword_forms(first):
+                    if rest:
+                        self.phrases.setdefault(form, {}).setdefault(tuple(rest), label)
+                    else:
+                        self.words.setdefault(form, label)
+
+    def labels(self, words):
+        found = {self.words[word] for word in self.words.keys() & words}
+
+        if self.phrases.keys() & words:
+            for index, word in enumerate(words):
+                for rest, label in self.phrases.get(word, {}).items():
+                    if tuple(words[index + 1:index + 1 + len(rest)]) == rest:
+                        found.add(label)
+
+        return found
+
+TEAM_MATCHER = KeywordMatcher(
+    (member_key, keywords_arabic + keywords_english)
+    for member_key, keywords_arabic, keywords_english in TEAM_KEYWORDS
+)
+TEAM_PRIORITY = {member_key: index for index, (member_key, _, _) in enumerate(TEAM_KEYWORDS)}
+
+def find_team_member(user_msg, words=None):
+    """إرجاع مفتاح عضو الفريق المذكور في الرسالة أو None"""
+    members = TEAM_MATCHER.labels(words if words is not None else message_words(user_msg))
+    if not members:
+        return None
+    return min(members, key=TEAM_PRIORITY.__getitem__)
+
+def cache_partition(language, model):
+    """قسم الكاش: النموذج الذي رد واللغة وإصدار البرومبت"""
+    return (model, language, prompts[language].version)
+
+def build_chat_messages(language, conversation_history, user_msg, summary=None):
+    """بناء رسائل المحادثة: النظام ثم الملخص ثم التاريخ ثم الرسالة الحالية"""
+    return prompts[language].messages(conversation_history, user_msg, summary)
+
+def assemble_prompt(session_id, language, conversation_history, user_msg):
+    """رسائل Groq ضمن CONTEXT_TOKEN_BUDGET، الأحدث أولاً. يرجع (الرسائل، التوكنات التقديرية)"""
+    used = prompts[language].tokens + estimate_tokens(user_msg)
+    budget = max(0, CONTEXT_TOKEN_BUDGET - used)
+    dropped, kept, history_tokens = fit_history(conversation_history, budget)
+
+    # الملخص يرسل ويحجز مكانه من الميزانية فقط إذا خرجت رسائل فعلاً من السياق
+    summary = history_summaries.get(session_id) if history_summaries and dropped else None
+    if summary:
+        used += summary[1]
+        dropped, kept, history_tokens = fit_history(conversation_history, max(0, budget - summary[1]))
+    if history_summaries:
+        history_summaries.refresh(session_id, dropped)
+
+    messages = build_chat_messages(language, kept, user_msg, summary[0] if summary else None)
+    return messages, used + history_tokens
+
+def forget_history_summary(session_id):
+    if history_summaries:
+        history_summaries.forget(session_id)
+
+def choose_model(user_msg, language, conversation_history):
+    """طبقة النموذج و max_tokens لهذا السؤال"""
+    route = model_router.choose(user_msg, language, len(conversation_history), classify_script(user_msg).mixed)
+    MODEL_ROUTES.labels(route.tier.name, route.reason).inc()
+    return route
+
+def with_model_fallback(route, call):
+    """call(route)، وعند 429 مرة واحدة بالطبقة الأخرى (حدود Groq لكل نموذج). يرجع (النتيجة، الطبقة المستخدمة)"""
+    try:
+        return call(route), route
+    except Exception as e:
+        if not is_rate_limited(e) or not model_router.enabled:
+            raise
+        fallback = model_router.fallback(route)
+        MODEL_FALLBACKS.labels(route.tier.name, fallback.tier.name).inc()
+        return call(fallback), fallback
+
+def completion_params(messages, route, **extra):
+    """كل ما يرسل لـ Groq، وهو نفسه مفتاح دمج الطلبات المتطابقة"""
+    return {
+        "model": route.model, "messages": messages, **COMPLETION_PARAMS,
+        "max_tokens": route.max_tokens, **extra
+    }
+
+def complete_chat(messages, route):
+    """رد النموذج كاملاً. يرجع (الرد، الطبقة المستخدمة)"""
+
+    def call(route):
+        params = completion_params(messages, route)
+
+        def create():
+            started = time.perf_counter()
+            completion = upstream.create(**params)
+            elapsed = time.perf_counter() - started
+            UPSTREAM_SECONDS.labels("total").observe(elapsed)
+            MODEL_SECONDS.labels(route.tier.name).observe(elapsed)
+            if completion.usage is not None:
+                record_usage(UPSTREAM_TOKENS, completion.usage, route.tier.name)
+            return completion.choices[0].message.content
+
+        return upstream_flights.do(flight_key(params), create)
+
+    return with_model_fallback(route, call)
+
+def stream_chat(messages, route):
+    """مولد لنصوص قطع رد النموذج أثناء التوليد. يرجع (المولد، الطبقة المستخدمة)"""
+
+    def call(route):
+        params = completion_params(messages, route, stream=True)
+
+        def open_stream():
+            started = time.perf_counter()
+            return TimedStream(
+                upstream.create(**params), started, UPSTREAM_SECONDS, UPSTREAM_TOKENS, (route.tier.name,)
+            )
+
+        return upstream_flights.stream(flight_key(params), open_stream)
+
+    return with_model_fallback(route, call)
+
 # ====== تنظيف المحادثات القديمة ======
-def cleanup_old_conversations():
-    """حذف المحادثات الأقدم من ساعة"""
-    current_time = datetime.now()
-    expired_sessions = []
-    
-    for session_id, session_data in conversations.items():
-        if current_time - session_data['last_activity'] > timedelta(hours=1):
-            expired_sessions.append(session_id)
-    
-    for session_id in expired_sessions:
-        del conversations[session_id]
+def cleanup_old_conversations(max_evictions=CLEANUP_BATCH_SIZE):
+    """حذف المحادثات المنتهية من بداية الترتيب فقط بدل المرور على كل الجلسات"""
+    return session_store.cleanup(max_evictions)
+
+def sweep_expired_sessions():
+    """تنظيف دوري في الخلفية للجلسات المنتهية عندما لا توجد طلبات"""
+    while True:
+        time.sleep(SESSION_SWEEP_INTERVAL)
+        try:
+            cleanup_old_conversations(max_evictions=None)
+        except Exception as e:
+            print(f"Session sweep error: {e}")
+
+def create_session(session_id):
+    """إنشاء جلسة جديدة فارغة"""
+    return session_store.create(session_id)
 
 def get_conversation_history(session_id):
     """استرجاع تاريخ المحادثة"""
-    if session_id not in conversations:
-        conversations[session_id] = {
-            'messages': [],
-            'last_activity': datetime.now(),
-            'context': {}
-        }
-    else:
-        conversations[session_id]['last_activity'] = datetime.now()
-    
-    return conversations[session_id]
+    return session_store.get(session_id)
 
 def add_message_to_history(session_id, role, content):
     """إضافة رسالة جديدة للمحادثة"""
-    session = get_conversation_history(session_id)
-    session['messages'].append({"role": role, "content": content})
-    
-    # الحفاظ على آخر 12 رسالة فقط
-    if len(session['messages']) > 12:
-        session['messages'] = session['messages'][-12:]
-
-def detect_language(text):
-    """كشف لغة النص بدقة"""
-    arabic_chars = len(re.findall(r'[\u0600-\u06FF]', text))
-    english_chars = len(re.findall(r'[a-zA-Z]', text))
-    
-    if arabic_chars > english_chars:
-        return 'arabic'
-    elif english_chars > arabic_chars:
-        return 'english'
-    else:
-        # إذا كانت متساوية، ننظر إلى الكلمات
-        arabic_words = len(re.findall(r'\b[\u0600-\u06FF]+\b', text))
-        english_words = len(re.findall(r'\b[a-zA-Z]+\b', text))
-        return 'arabic' if arabic_words >= english_words else 'english'
+    session_store.append_message(session_id, role, content)
 
 # ====== FORMATTING FUNCTIONS ======
+# كل الأنماط تبنى مرة واحدة عند الاستيراد
+UNSUPPORTED_CHARS_RE = re.compile(
+    r'[^\u0600-\u06FFa-zA-Z0-9\s\.\,\!\?\-\:\;\(\)\%\&\"\'\@\#\$\*\+\=\/\<\>\[\]\\\n]'
+)
+
+# str.replace أسرع بكثير من str.translate على نص عربي (translate يمر حرفاً حرفاً عبر القاموس)
+ARABIC_DIGITS = list(zip('0123456789', '٠١٢٣٤٥٦٧٨٩'))
+
+LIST_ITEM_RE = re.compile(r'\s+(\d+)\.\s+')
+BULLET_ITEM_RE = re.compile(r'\s+([•\-\*])\s+')
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+SPACES_RE = re.compile(r' +')
+GAP_RE = re.compile(r'\s{2,}')
+
+# مرور واحد يلتقط:
+# - سلسلة عناصر قائمة (فراغ ثم 1. أو - أو * أو • ثم فراغ ...): المجموعة 1 أول عنصر والمجموعة 2 البقية
+# - أو فراغ من حرفين فأكثر يحتاج تنظيفاً (سطر فارغ واحد "\n\n" بين كلمتين يبقى كما هو فيُتجاهل)
+LAYOUT_RE = re.compile(
+    r'\s(?:\s*(\d+\.|[•\-\*])\s+((?:(?:\d+\.|[•\-\*])\s+)*)|(?!(?<=\n)\n\S)\s+)'
+)
+
+IMPORTANT_WORDS = [
+    'مهم', 'ملاحظة', 'تنبيه',
+    'Important', 'Note', 'Warning',
+    'OILNOVA', 'oilnova'
+]
+IMPORTANT_WORD_PATTERNS = [
+    re.compile(re.escape(word), re.IGNORECASE) for word in IMPORTANT_WORDS
+]
+# النظرة المسبقة على الحرف الأول تجعل البحث يتخطى معظم المواضع بسرعة
+BOLD_WORDS_RE = re.compile(
+    '(?=[' + ''.join(sorted({re.escape(word[0]) for word in IMPORTANT_WORDS})) + r'])'
+    r'\b(?:' + '|'.join(re.escape(word) for word in IMPORTANT_WORDS) + r')\b',
+    re.IGNORECASE
+)
+# عدد مرات التغليف بـ ** لكل كلمة مطابقة (OILNOVA تطابق كلمتين فتغلف مرتين)
+bold_markers = {}
+
+def format_gap(gap):
+    """
+    تنسيق فراغ بين كلمتين بنفس نتيجة تنظيف الأسطر:
+    بدون سطر جديد تدمج المسافات، سطر واحد يبقى، وأكثر يصبح سطراً فارغاً واحداً
+    """
+    newlines = gap.count('\n')
+    if newlines == 0:
+        return SPACES_RE.sub(' ', gap)
+    return '\n' if newlines == 1 else '\n\n'
+
+def gap_match(match):
+    return format_gap(match.group(0))
+
+def layout_match(match):
+    marker = match.group(1)
+    if marker is None:
+        return format_gap(match.group(0))
+
+    # الحالة الشائعة: عنصر واحد فقط
+    if not match.group(2):
+        return f"\n{marker} "
+
+    # سلسلة أطول قصيرة أيضاً فنطبق عليها نفس خطوات enforce_list_formatting بالترتيب
+    text = BULLET_ITEM_RE.sub(r'\n\1 ', LIST_ITEM_RE.sub(r'\n\1. ', match.group(0)))
+    return GAP_RE.sub(gap_match, text)
+
+def bold_match(match):
+    word = match.group(0)
+    markers = bold_markers.get(word)
+    if markers is None:
+        count = sum(1 for pattern in IMPORTANT_WORD_PATTERNS if pattern.fullmatch(word))
+        markers = bold_markers[word] = '**' * count
+    return f"{markers}{word}{markers}"
+
+def format_layout(text):
+    """مرور واحد للقوائم والفراغات ثم مرور واحد للكلمات المهمة"""
+    text = LAYOUT_RE.sub(layout_match, text)
+    return BOLD_WORDS_RE.sub(bold_match, text).strip()
+
 def convert_english_numbers_to_arabic(text):
     """تحويل الأرقام الإنجليزية إلى عربية"""
-    number_map = {
-        '0': '٠', '1': '١', '2': '٢', '3': '٣', '4': '٤',
-        '5': '٥', '6': '٦', '7': '٧', '8': '٨', '9': '٩'
-    }
-    
-    for eng_num, arabic_num in number_map.items():
-        text = text.replace(eng_num, arabic_num)
-    
+    for english_digit, arabic_digit in ARABIC_DIGITS:
+        text = text.replace(english_digit, arabic_digit)
+
     return text
 
 def enforce_list_formatting(text, language):
@@ -185,13 +522,13 @@ def enforce_list_formatting(text, language):
     # تحويل " 1. نص 2. نص" إلى:
     # 1. نص
     # 2. نص
-    text = re.sub(r'\s+(\d+)\.\s+', r'\n\1. ', text)
+    text = LIST_ITEM_RE.sub(r'\n\1. ', text)
 
     # تحويل " - نص  - نص" إلى كل نقطة بسطر
-    text = re.sub(r'\s+([•\-\*])\s+', r'\n\1 ', text)
+    text = BULLET_ITEM_RE.sub(r'\n\1 ', text)
 
     # تنظيف التكرار في الأسطر
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = BLANK_LINES_RE.sub('\n\n', text)
 
     return text.strip()
 
@@ -205,62 +542,21 @@ def bold_important_words(text):
     if not text:
         return text
 
-    important_words = [
-        'مهم', 'ملاحظة', 'تنبيه',
-        'Important', 'Note', 'Warning',
-        'OILNOVA', 'oilnova'
-    ]
-
-    for word in important_words:
-        pattern = rf'\b{re.escape(word)}\b'
-        text = re.sub(
-            pattern,
-            lambda m: f"**{m.group(0)}**",
-            text,
-            flags=re.IGNORECASE
-        )
-
-    return text
+    return BOLD_WORDS_RE.sub(bold_match, text)
 
 def format_arabic_text(text):
     """تنسيق النص العربي بشكل احترافي مع التعداد والسولد"""
     if not text:
         return text
-    
-    # تحويل الأرقام
-    text = convert_english_numbers_to_arabic(text)
-    # تنسيق التعداد
-    text = enforce_list_formatting(text, 'arabic')
-    # الكلمات المهمة سولد
-    text = bold_important_words(text)
-
-    # تنظيف فراغات زائدة داخل الأسطر
-    lines = [re.sub(r' +', ' ', line.strip()) for line in text.split('\n')]
-    formatted_text = '\n'.join(lines)
-    
-    # تنظيف أسطر فارغة متكررة
-    formatted_text = re.sub(r'\n\s*\n', '\n\n', formatted_text)
-    
-    return formatted_text.strip()
+
+    return format_layout(convert_english_numbers_to_arabic(text))
 
 def format_english_text(text):
     """تنسيق النص الإنجليزي بشكل احترافي مع التعداد والسولد"""
     if not text:
         return text
-    
-    # تنسيق التعداد
-    text = enforce_list_formatting(text, 'english')
-    # الكلمات المهمة سولد
-    text = bold_important_words(text)
-
-    # تنظيف فراغات زائدة داخل الأسطر
-    lines = [re.sub(r' +', ' ', line.strip()) for line in text.split('\n')]
-    formatted_text = '\n'.join(lines)
-    
-    # تنظيف أسطر فارغة متكررة
-    formatted_text = re.sub(r'\n\s*\n', '\n\n', formatted_text)
-    
-    return formatted_text.strip()
+
+    return format_layout(text)
 
 def format_final_response(text, language):
     """تنسيق الرد النهائي بشكل احترافي مع الحفاظ على التعداد والسولد"""
@@ -268,17 +564,69 @@ def format_final_response(text, language):
         return text
 
     # إزالة رموز غريبة فقط بدون حذف المسافات والأسطر
-    text = re.sub(
-        r'[^\u0600-\u06FFa-zA-Z0-9\s\.\,\!\?\-\:\;\(\)\%\&\"\'\@\#\$\*\+\=\/\<\>\[\]\\\n]',
-        '',
-        text
-    )
-    
+    text = UNSUPPORTED_CHARS_RE.sub('', text)
+
     if language == 'arabic':
         return format_arabic_text(text)
     else:
         return format_english_text(text)
 
+# ====== STREAMING FORMATTER ======
+STREAM_TOKEN_RE = re.compile(r'\S+|\s+')
+LIST_MARKER_RE = re.compile(r'\d+\.|[•\-\*]')
+
+class StreamingFormatter:
+    """
+    تنسيق الرد تدريجياً أثناء البث:
+    - يقطع النص عند فراغ محاط بكلمتين ليستا بداية قائمة (1. أو - أو * أو •)
+    - كل مقطع يمر على format_final_response، والفراغ بين المقاطع يُنسق بنفس قواعدها
+    - مجموع ما يرسل يطابق format_final_response للنص الكامل
+    """
+
+    def __init__(self, language):
+        self.language = language
+        self.text = ""
+        self._pending = ""
+        self._gap = None
+
+    def _emit(self, segment):
+        formatted = format_final_response(segment, self.language)
+        if self._gap is not None:
+            formatted = format_gap(self._gap) + formatted
+        self.text += formatted
+        return formatted
+
+    def feed(self, chunk):
+        """إضافة جزء جديد من الرد وإرجاع ما أصبح جاهزاً للإرسال"""
+        self._pending += UNSUPPORTED_CHARS_RE.sub('', chunk)
+        tokens = [m.span() for m in STREAM_TOKEN_RE.finditer(self._pending)]
+
+        # آخر فراغ صالح للقطع يحتاج كلمة مكتملة بعده (أي يتبعها فراغ)
+        for i in range(len(tokens) - 3, 0, -1):
+            gap_start, gap_end = tokens[i]
+            if not self._pending[gap_start].isspace():
+                continue
+            before = self._pending[tokens[i - 1][0]:gap_start]
+            after = self._pending[gap_end:tokens[i + 1][1]]
+            if LIST_MARKER_RE.fullmatch(before) or LIST_MARKER_RE.fullmatch(after):
+                continue
+
+            segment = self._pending[:gap_start]
+            gap = self._pending[gap_start:gap_end]
+            self._pending = self._pending[gap_end:]
+            formatted = self._emit(segment)
+            self._gap = gap
+            return formatted
+
+        return ""
+
+    def finish(self):
+        """إرسال ما تبقى بعد انتهاء البث"""
+        segment, self._pending = self._pending, ""
+        if not segment.strip():
+            return ""
+        return self._emit(segment)
+
 def rewrite_team_member_info(member_key, language):
     """إعادة كتابة معلومات أعضاء الفريق بشكل طبيعي وسلس"""
     if member_key not in FOUNDERS_INFO:
@@ -344,6 +692,146 @@ def rewrite_team_member_info(member_key, language):
 
 📧 **Contact**: {member_info['contact']}"""
 
+# ====== SERVER-SENT EVENTS ======
+def sse_event(payload, event=None):
+    """تحويل حدث إلى صيغة SSE"""
+    data = json.dumps(payload, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {data}\n\n"
+    return f"data: {data}\n\n"
+
+def sse_response(events):
+    """استجابة بث بدون تخزين مؤقت في الوسطاء"""
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ====== ردود محلية سريعة (بدون استدعاء النموذج) ======
+# الردود الجاهزة تبنى مرة واحدة عند التشغيل
+TEAM_REPLIES = {
+    (member_key, language): rewrite_team_member_info(member_key, language)
+    for member_key in FOUNDERS_INFO
+    for language in ('arabic', 'english')
+}
+
+GREETING_RE = re.compile(
+    r'(?:\s*(?:' + '|'.join([
+        'السلام عليكم', 'سلام عليكم', 'ورحمة الله', 'وبركاته', 'مرحبا', 'مرحباً', 'اهلا', 'أهلا', 'أهلاً',
+        'اهلين', 'هلا', 'صباح الخير', 'مساء الخير', 'هاي',
+        'hi', 'hello', 'hey', 'salam', 'greetings', 'good morning', 'good evening', 'good afternoon'
+    ]) + r')[\s!.,،؟?😊👋]*)+',
+    re.IGNORECASE
+)
+
+# مواضيع واضحة خارج التخصص، ولا تعتبر كذلك إذا ذُكر أي مصطلح نفطي
+TOPIC_MATCHER = KeywordMatcher([
+    ("domain", ["نفط", "بترول", "غاز", "بئر", "آبار", "ابار", "حفر", "مكمن", "مضخة", "إنتاج", "انتاج", "خام",
+                "oil", "gas", "petroleum", "well", "pump", "esp", "reservoir", "drilling", "rig", "crude",
+                "pipeline", "field"]),
+    ("off_topic", ["كرة القدم", "مباراة", "طبخ", "وصفة", "فيلم", "مسلسل", "أغنية", "اغنية", "الأبراج", "برجي",
+                   "football", "soccer", "recipe", "cooking", "movie", "song", "lyrics", "horoscope", "celebrity"]),
+])
+
+def is_greeting(user_msg, words):
+    return GREETING_RE.fullmatch(user_msg) is not None
+
+def is_off_topic(user_msg, words):
+    return TOPIC_MATCHER.labels(words) == {"off_topic"}
+
+# لإضافة رد محلي جديد: (اسم المسار، دالة التحقق، الردود حسب اللغة)
+LOCAL_ROUTES = [
+    ("greeting", is_greeting, {
+        "arabic": "أهلاً بك! 👋 أنا مساعد **OILNOVA** المتخصص في هندسة النفط والغاز. كيف يمكنني مساعدتك اليوم؟",
+        "english": "Hello! 👋 I'm the **OILNOVA** assistant, specialized in oil and gas engineering. How can I help you today?"
+    }),
+    ("off_topic", is_off_topic, {
+        "arabic": "أنا متخصص في هندسة النفط والغاز فقط. يسعدني مساعدتك في أي سؤال عن الحفر أو الإنتاج أو المكامن أو الرفع الاصطناعي.",
+        "english": "I specialize only in oil and gas engineering. I'm happy to help with any question about drilling, production, reservoirs or artificial lift."
+    }),
+]
+
+def route_message(user_msg, language):
+    """إرجاع (المسار، الرد الجاهز) إذا أمكن الرد محلياً، وإلا None"""
+    words = message_words(user_msg)
+
+    member_key = find_team_member(user_msg, words)
+    if member_key:
+        return f"team:{member_key}", TEAM_REPLIES[(member_key, language)]
+
+    for route, matches, replies in LOCAL_ROUTES:
+        if matches(user_msg, words):
+            return route, replies[language]
+
+    return None
+
+def ready_reply(user_msg, language, conversation_history):
+    """رد بدون استدعاء النموذج: رد محلي أو رد الدور الأول من الكاش. يرجع (المسار، الرد) أو None"""
+    routed = route_message(user_msg, language)
+    if routed:
+        return routed
+
+    if not conversation_history:
+        # نفس النموذج الذي سيختاره choose_model لسؤال دور أول
+        model = model_router.choose(user_msg, language, 0, classify_script(user_msg).mixed).model
+        reply = completion_cache.get(cache_partition(language, model), user_msg)
+        if reply is not None:
+            return "cache", reply
+
+    return None
+
+def remember_reply(user_msg, language, conversation_history, formatted_reply, model_route):
+    """تخزين رد النموذج في الكاش إذا كان سؤال دور أول، في قسم النموذج الذي رد"""
+    # رد الطبقة البديلة (بعد 429) لا يخزن: نفس السؤال يوجه للطبقة الأصلية ويبحث في قسمها
+    if not conversation_history and model_route.reason != "fallback":
+        completion_cache.put(cache_partition(language, model_route.model), user_msg, formatted_reply)
+
+def chat_payload(route, reply, session_id, language, prompt_tokens=None, model_route=None):
+    """استجابة /chat: الردود المحلية بدون detected_language كما كانت دائماً"""
+    payload = {"reply": reply, "session_id": session_id}
+    if route is None or route == "cache":
+        payload["detected_language"] = language
+    if prompt_tokens is not None:
+        payload["prompt_tokens"] = prompt_tokens
+    if model_route is not None:
+        payload["model_tier"] = model_route.tier.name
+        payload["model"] = model_route.model
+    return payload
+
+def busy_payload(rejected, language):
+    """(JSON، الحالة، الترويسات) لطلب رفضه التحكم في القبول"""
+    ADMISSION_REJECTED.labels(rejected.reason).inc()
+    body = {"error": BUSY_MESSAGES[language], "retry_after": rejected.retry_after}
+    return body, rejected.status, {"Retry-After": str(rejected.retry_after)}
+
+def forwarded_client(forwarded, peer):
+    """عنوان المستخدم لحدود الطلبات: من X-Forwarded-For فقط إذا كنا خلف بروكسي موثوق"""
+    if TRUST_FORWARDED_FOR and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXY_COUNT, len(hops))]
+    return peer
+
+def client_ip():
+    return forwarded_client(request.headers.get("X-Forwarded-For"), request.remote_addr)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    route = request.endpoint or "unknown"
+    ROUTE_SECONDS[route].observe(time.perf_counter() - g.request_started)
+    ROUTE_STATUSES[route, response.status_code].inc()
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """كل القياسات بصيغة Prometheus (مدموجة من كل عمليات gunicorn إذا حُدد METRICS_DIR)"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/")
 def home():
     return "OILNOVA CHAT BACKEND IS RUNNING OK - ENHANCED PROFESSIONAL VERSION"
@@ -352,13 +840,67 @@ def home():
 def start_session():
     """بدء جلسة محادثة جديدة"""
     session_id = str(uuid.uuid4())
-    conversations[session_id] = {
-        'messages': [],
-        'last_activity': datetime.now(),
-        'context': {}
-    }
+    create_session(session_id)
     return jsonify({"session_id": session_id})
 
+def answer_chat(user_msg, session_id, ip, cancelled=None, rate_checked=False):
+    """
+    رد رسالة واحدة كما في /chat. يرفع Rejected إذا رفضها التحكم في القبول،
+    و JobCancelled إذا أصبح cancelled() صحيحاً قبل استدعاء النموذج أو قبل حفظ الرد (/chat/jobs).
+    rate_checked: رصيد الطلب دُفع مسبقاً (/chat/batch)
+    """
+    clock = StageClock(STAGES)
+
+    # تنظيف المحادثات القديمة
+    cleanup_old_conversations()
+    clock.lap("session_cleanup")
+
+    # كشف لغة المستخدم
+    user_language = detect_language(user_msg)
+    clock.lap("detect_language")
+    
+    # استرجاع تاريخ المحادثة
+    session_data = get_conversation_history(session_id)
+    conversation_history = session_data.messages
+    clock.lap("history_load")
+
+    # ====== ردود فريق المنصة والردود المحلية وكاش الدور الأول ======
+    ready = ready_reply(user_msg, user_language, conversation_history)
+    clock.lap("routing")
+    if ready:
+        route, reply = ready
+        add_message_to_history(session_id, "user", user_msg)
+        add_message_to_history(session_id, "assistant", reply)
+        clock.lap("history_update")
+        REPLY_SOURCES[route.partition(":")[0]].inc()
+        return chat_payload(route, reply, session_id, user_language)
+
+    # ====== بناء رسائل المحادثة مع السياق ======
+    messages, prompt_tokens = assemble_prompt(session_id, user_language, conversation_history, user_msg)
+    model_route = choose_model(user_msg, user_language, conversation_history)
+    clock.lap("prompt_assembly")
+
+    # ====== AI COMPLETION مع تحسينات ======
+    raise_if_cancelled(cancelled)
+    with admission.admit(session_id, ip, rate_checked):
+        clock.lap("admission")
+        reply, model_route = complete_chat(messages, model_route)
+    clock.lap("upstream")
+    raise_if_cancelled(cancelled)
+    
+    # ✅ تطبيق التنسيق المحسن على الرد مع الالتزام بالتنسيق الإجباري
+    formatted_reply = format_final_response(reply, user_language)
+    remember_reply(user_msg, user_language, conversation_history, formatted_reply, model_route)
+    clock.lap("format")
+    
+    # تحديث تاريخ المحادثة
+    add_message_to_history(session_id, "user", user_msg)
+    add_message_to_history(session_id, "assistant", formatted_reply)
+    clock.lap("history_update")
+    REPLY_SOURCES["model"].inc()
+
+    return chat_payload(None, formatted_reply, session_id, user_language, prompt_tokens, model_route)
+
 @app.route("/chat", methods=["POST"])
 def chat():
     try:
@@ -369,183 +911,249 @@ def chat():
         if not user_msg:
             return jsonify({"error": "الرسالة فارغة"}), 400
 
-        # تنظيف المحادثات القديمة
-        cleanup_old_conversations()
+        return jsonify(answer_chat(user_msg, session_id, client_ip()))
+
+    except Rejected as e:
+        body, status, headers = busy_payload(e, detect_language(user_msg))
+        return jsonify(body), status, headers
+
+    except Exception as e:
+        print(f"Error: {e}")
+        ERRORS.labels("chat", type(e).__name__).inc()
+        user_language = detect_language(user_msg) if 'user_msg' in locals() else 'arabic'
+        return jsonify({"error": ERROR_MESSAGES[user_language]}), 500
+
+def job_handler(user_msg, session_id, ip):
+    """ما تنفذه مهمة /chat/jobs: (حالة HTTP، JSON) كما كان سيرجعه /chat"""
+    def run(cancelled):
+        try:
+            return 200, answer_chat(user_msg, session_id, ip, cancelled)
+        except JobCancelled:
+            raise
+        except Rejected as e:
+            body, status, _ = busy_payload(e, detect_language(user_msg))
+            return status, body
+        except Exception as e:
+            print(f"Error: {e}")
+            ERRORS.labels("chat_jobs", type(e).__name__).inc()
+            return 500, {"error": ERROR_MESSAGES[detect_language(user_msg)]}
+    return run
+
+def job_not_found():
+    return {"error": "المهمة غير موجودة أو انتهت صلاحيتها"}, 404
+
+@app.route("/chat/jobs", methods=["POST"])
+def submit_chat_job():
+    """نفس /chat لكن يرجع فوراً (202) بمعرف مهمة، والرد في GET /chat/jobs/<id>"""
+    try:
+        data = request.json
+        user_msg = data.get("message", "").strip()
+        session_id = data.get("session_id", "default")
+
+        if not user_msg:
+            return jsonify({"error": "الرسالة فارغة"}), 400
+
+        job = job_runner.submit(session_id, job_handler(user_msg, session_id, client_ip()))
+        return jsonify(job.payload()), 202, {"Location": f"/chat/jobs/{job.job_id}"}
+
+    except Rejected as e:
+        body, status, headers = busy_payload(e, detect_language(user_msg))
+        return jsonify(body), status, headers
+
+    except Exception as e:
+        print(f"Error: {e}")
+        ERRORS.labels("chat_jobs", type(e).__name__).inc()
+        user_language = detect_language(user_msg) if 'user_msg' in locals() else 'arabic'
+        return jsonify({"error": ERROR_MESSAGES[user_language]}), 500
+
+@app.route("/chat/jobs/<job_id>", methods=["GET"])
+def get_chat_job(job_id):
+    job = job_runner.get(job_id)
+    if job is None:
+        return job_not_found()
+    return jsonify(job.payload())
+
+@app.route("/chat/jobs/<job_id>", methods=["DELETE"])
+def cancel_chat_job(job_id):
+    """المهمة المنتظرة تلغى فوراً، والتي تنفذ لا يحفظ ردها في تاريخ المحادثة"""
+    job = job_runner.cancel(job_id)
+    if job is None:
+        return job_not_found()
+    return jsonify(job.payload())
+
+def batch_item(user_msg, session_id, ip):
+    """نتيجة عنصر واحد في /chat/batch: رد /chat أو خطأ خاص بالعنصر مع حالته"""
+    try:
+        return answer_chat(user_msg, session_id, ip, rate_checked=True)
+    except Rejected as e:
+        body, status, _ = busy_payload(e, detect_language(user_msg))
+        return {**body, "status": status, "session_id": session_id}
+    except Exception as e:
+        print(f"Error: {e}")
+        ERRORS.labels("chat_batch", type(e).__name__).inc()
+        return {"error": ERROR_MESSAGES[detect_language(user_msg)], "status": 500, "session_id": session_id}
+
+def batch_groups(items):
+    """(نتائج أولية للعناصر غير الصالحة، {session_id: [(الموقع، الرسالة)] بالترتيب})"""
+    results = [None] * len(items)
+    sessions = {}
+    for index, item in enumerate(items):
+        user_msg = item.get("message", "") if isinstance(item, dict) else ""
+        user_msg = user_msg.strip() if isinstance(user_msg, str) else ""
+        if not user_msg:
+            results[index] = {"error": "الرسالة فارغة", "status": 400}
+            continue
+        sessions.setdefault(str(item.get("session_id", "default")), []).append((index, user_msg))
+    return results, sessions
+
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """
+    عدة رسائل مستقلة في طلب واحد: {"items": [{"session_id", "message"}, ...]}.
+    الجلسات المختلفة تعالج بالتوازي (حتى BATCH_CONCURRENCY) ورسائل نفس الجلسة
+    بالترتيب، والنتائج بنفس ترتيب العناصر مع خطأ لكل عنصر فشل.
+    رصيد الـ IP والجلسات يدفع مرة للطلب كله، وإذا نفد يرفض الطلب كله بـ 429.
+    """
+    try:
+        data = request.get_json(silent=True)
+        items = data.get("items") if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "items يجب أن تكون قائمة غير فارغة"}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({"error": f"الحد الأقصى {BATCH_MAX_ITEMS} عنصراً في الطلب"}), 413
+
+        ip = client_ip()
+        results, sessions = batch_groups(items)
+        if sessions:
+            admission.check_rate(list(sessions), ip)
+
+        def answer_session(session_items):
+            session_id, entries = session_items
+            for index, user_msg in entries:
+                results[index] = batch_item(user_msg, session_id, ip)
+
+        if sessions:
+            with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(sessions))) as executor:
+                list(executor.map(answer_session, sessions.items()))
+
+        return jsonify({"results": results})
+
+    except Rejected as e:
+        body, status, headers = busy_payload(e, 'arabic')
+        return jsonify(body), status, headers
+
+    except Exception as e:
+        print(f"Error: {e}")
+        ERRORS.labels("chat_batch", type(e).__name__).inc()
+        return jsonify({"error": ERROR_MESSAGES['arabic']}), 500
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """نفس /chat لكن يرسل الرد كأحداث SSE أثناء التوليد"""
+    try:
+        data = request.json
+        user_msg = data.get("message", "").strip()
+        session_id = data.get("session_id", "default")
+
+        if not user_msg:
+            return jsonify({"error": "الرسالة فارغة"}), 400
 
-        # كشف لغة المستخدم
+        clock = StageClock(STAGES)
+        cleanup_old_conversations()
+        clock.lap("session_cleanup")
         user_language = detect_language(user_msg)
-        
-        # استرجاع تاريخ المحادثة
+        clock.lap("detect_language")
         session_data = get_conversation_history(session_id)
-        conversation_history = session_data['messages']
-
-        # ====== SYSTEM PROMPT المحسن والاحترافي مع التنسيق الإجباري ======
-        system_prompt_arabic = """
-أنت مساعد **OILNOVA** الذكي - مساعد متخصص في هندسة النفط والغاز.
-
-🎯 **التخصص الأساسي**: 
-- هندسة النفط والغاز بشكل حصري
-- أنظمة ESP والرفع الاصطناعي
-- هندسة المكامن والتنقيب
-- عمليات الحفر والإنتاج
-- التسجيل الجيوفيزيائي وتحليل البيانات النفطية
-
-🌐 **قواعد اللغة الصارمة**:
-- إذا كان السؤال بالعربية → أجب بالعربية فقط
-- إذا كان السؤال بالإنجليزية → أجب بالإنجليزية فقط  
-- لا تخلط اللغات أبداً في الرد الواحد
-- إذا اضطررت لاستخدام مصطلح تقني إنجليزي، اكتبه ثم اشرحه بين قوسين
-
-📝 **التنسيق الإجباري للقوائم**:
-- عند الإجابة عن أي سؤال يحتوي على أجزاء أو خطوات أو تعداد نقطي، يجب أن تكتب كل نقطة في سطر مستقل
-- استخدم هذا التنسيق فقط:
-  
-1. [النقطة الأولى]
-2. [النقطة الثانية] 
-3. [النقطة الثالثة]
-
-- أضف سطر جديد قبل كل رقم، ولا تكتب أي نقطة في نفس السطر مع نقطة أخرى
-
-👥 **معلومات الفريق (فقط عند السؤال المباشر)**:
-- حيدر نسيم: مؤسس المنصة، مهندس نفط، مبرمج
-- علي بلال: مبرمج بايثون من الموصل
-- نور كنعان: مبرمجة بايثون من كركوك
-- أرزو متين: محللة بيانات ومبرمجة بايثون من كركوك
-
-🚫 **السياسات**:
-- لا تعطي معلومات شخصية إلا عند السؤال المباشر عن أعضاء الفريق
-- للأسئلة خارج تخصص النفط: "أنا متخصص في هندسة النفط والغاز فقط"
-- حافظ على الاحترافية والدقة التقنية
-- رتب الردود بشكل منظم وسهل القراءة
-- التزم بالتنسيق الإجباري للقوائم في كل الإجابات
-"""
-
-        system_prompt_english = """
-You are **OILNOVA** Smart Assistant - specialized in oil and gas engineering.
-
-🎯 **Primary Specialization**: 
-- Oil and gas engineering exclusively
-- ESP systems and artificial lift
-- Reservoir engineering and exploration
-- Drilling and production operations
-- Geophysical logging and oil data analysis
-
-🌐 **Strict Language Rules**:
-- If question is in Arabic → reply ONLY in Arabic
-- If question is in English → reply ONLY in English  
-- Never mix languages in the same response
-- If you must use an English technical term, write it then explain in parentheses
-
-📝 **Mandatory List Formatting**:
-- When answering any question containing parts, steps, or bullet points, you MUST write each point on a separate line
-- Use this format ONLY:
-  
-1. [First point]
-2. [Second point]
-3. [Third point]
-
-- Add a newline before each number, and never write two points on the same line
-
-👥 **Team Information (only when directly asked)**:
-- Hayder Naseem: Platform founder, petroleum engineer, programmer
-- Ali Bilal: Python programmer from Mosul
-- Noor Kanaan: Python programmer from Kirkuk
-- Arzu Metin: Data analyst and Python programmer from Kirkuk
-
-🚫 **Policies**:
-- Do not give personal information unless directly asked about team members
-- For non-oil/gas questions: "I specialize only in oil and gas engineering"
-- Maintain professionalism and technical accuracy
-- Organize responses in a structured, easy-to-read format
-- Strictly adhere to mandatory list formatting in all responses
-"""
-
-        # اختيار النظام المناسب بناءً على لغة المستخدم
-        system_prompt = system_prompt_arabic if user_language == 'arabic' else system_prompt_english
-
-        # ====== ردود خاصة بفريق المنصة ======
-        msg_lower = user_msg.lower()
-        
-        # كلمات البحث العربية والإنجليزية
-        hayder_keywords_arabic = ["حيدر", "هايدر", "نسيم", "المؤسس", "منو مؤسس", "مؤسس المنصة", "بنيسان", "سامراء"]
-        hayder_keywords_english = ["hayder", "naseem", "founder", "owner", "creator", "samarra"]
-        
-        ali_keywords_arabic = ["علي بلال", "علي", "بلال", "زبور", "زمار", "موصل"]
-        ali_keywords_english = ["ali", "bilal", "mosul", "jubour"]
-        
-        noor_keywords_arabic = ["نور", "كنعان", "كردية", "كركوك"]
-        noor_keywords_english = ["noor", "kanaan", "kurdish", "kirkuk"]
-        
-        arzo_keywords_arabic = ["ارزو", "أرزو", "متين", "تركمانية"]
-        arzo_keywords_english = ["arzo", "arzu", "metin", "turkmen"]
+        conversation_history = session_data.messages
+        clock.lap("history_load")
 
-        # التحقق من طلبات معلومات الفريق
-        if any(keyword in msg_lower for keyword in hayder_keywords_arabic + [k.lower() for k in hayder_keywords_english]):
-            reply = rewrite_team_member_info("hayder", user_language)
-            add_message_to_history(session_id, "user", user_msg)
-            add_message_to_history(session_id, "assistant", reply)
-            return jsonify({"reply": reply, "session_id": session_id})
+        meta = {"session_id": session_id, "detected_language": user_language}
 
-        elif any(keyword in msg_lower for keyword in ali_keywords_arabic + [k.lower() for k in ali_keywords_english]):
-            reply = rewrite_team_member_info("ali", user_language)
+        # الردود المحلية وردود الكاش جاهزة مسبقاً فترسل كحدث واحد
+        ready = ready_reply(user_msg, user_language, conversation_history)
+        clock.lap("routing")
+        if ready:
+            route, reply = ready
             add_message_to_history(session_id, "user", user_msg)
             add_message_to_history(session_id, "assistant", reply)
-            return jsonify({"reply": reply, "session_id": session_id})
+            clock.lap("history_update")
+            REPLY_SOURCES[route.partition(":")[0]].inc()
+
+            def generate_static():
+                yield sse_event(meta, event="meta")
+                yield sse_event({"delta": reply})
+                yield sse_event({"reply": reply, **meta}, event="done")
+
+            return sse_response(generate_static())
+
+        messages, meta["prompt_tokens"] = assemble_prompt(session_id, user_language, conversation_history, user_msg)
+        model_route = choose_model(user_msg, user_language, conversation_history)
+        clock.lap("prompt_assembly")
+
+        # المكان في حد التزامن محجوز حتى ينتهي البث أو ينقطع الاتصال
+        admission.acquire(session_id, client_ip())
+        clock.lap("admission")
+        try:
+            # نفتح البث قبل إرجاع الاستجابة حتى تظهر أخطاء الاتصال كـ 500 عادي
+            pieces, model_route = stream_chat(messages, model_route)
+        except BaseException:
+            admission.release()
+            raise
+        meta["model_tier"] = model_route.tier.name
+        meta["model"] = model_route.model
+
+    except Rejected as e:
+        body, status, headers = busy_payload(e, user_language)
+        return jsonify(body), status, headers
 
-        elif any(keyword in msg_lower for keyword in noor_keywords_arabic + [k.lower() for k in noor_keywords_english]):
-            reply = rewrite_team_member_info("noor", user_language)
+    except Exception as e:
+        print(f"Error: {e}")
+        ERRORS.labels("chat_stream", type(e).__name__).inc()
+        user_language = detect_language(user_msg) if 'user_msg' in locals() else 'arabic'
+        return jsonify({"error": ERROR_MESSAGES[user_language]}), 500
+
+    def generate():
+        formatter = StreamingFormatter(user_language)
+        format_seconds = 0.0
+        try:
+            yield sse_event(meta, event="meta")
+
+            for text in pieces:
+                started = time.perf_counter()
+                piece = formatter.feed(text)
+                format_seconds += time.perf_counter() - started
+                if piece:
+                    yield sse_event({"delta": piece})
+
+            piece = formatter.finish()
+            if piece:
+                yield sse_event({"delta": piece})
+            STAGES["format"].observe(format_seconds)
+
+            # حفظ الرد المنسق كاملاً بعد انتهاء البث
+            formatted_reply = formatter.text
+            remember_reply(user_msg, user_language, conversation_history, formatted_reply, model_route)
+            clock.reset()
             add_message_to_history(session_id, "user", user_msg)
-            add_message_to_history(session_id, "assistant", reply)
-            return jsonify({"reply": reply, "session_id": session_id})
+            add_message_to_history(session_id, "assistant", formatted_reply)
+            clock.lap("history_update")
+            REPLY_SOURCES["model"].inc()
 
-        elif any(keyword in msg_lower for keyword in arzo_keywords_arabic + [k.lower() for k in arzo_keywords_english]):
-            reply = rewrite_team_member_info("arzo", user_language)
-            add_message_to_history(session_id, "user", user_msg)
-            add_message_to_history(session_id, "assistant", reply)
-            return jsonify({"reply": reply, "session_id": session_id})
+            yield sse_event({"reply": formatted_reply, **meta}, event="done")
 
-        # ====== بناء رسائل المحادثة مع السياق ======
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # إضافة تاريخ المحادثة السابقة
-        messages.extend(conversation_history)
-        
-        # إضافة الرسالة الحالية
-        messages.append({"role": "user", "content": user_msg})
-
-        # ====== AI COMPLETION مع تحسينات ======
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1024,
-            top_p=0.9
-        )
-
-        reply = completion.choices[0].message.content
-        
-        # ✅ تطبيق التنسيق المحسن على الرد مع الالتزام بالتنسيق الإجباري
-        formatted_reply = format_final_response(reply, user_language)
-        
-        # تحديث تاريخ المحادثة
-        add_message_to_history(session_id, "user", user_msg)
-        add_message_to_history(session_id, "assistant", formatted_reply)
+        except Exception as e:
+            print(f"Error: {e}")
+            ERRORS.labels("chat_stream", type(e).__name__).inc()
+            yield sse_event({"error": ERROR_MESSAGES[user_language]}, event="error")
 
-        return jsonify({
-            "reply": formatted_reply,
-            "session_id": session_id,
-            "detected_language": user_language
-        })
+        finally:
+            pieces.close()
 
-    except Exception as e:
-        print(f"Error: {e}")
-        error_msg_arabic = "عذراً، حدث خطأ في المعالجة. يرجى المحاولة مرة أخرى."
-        error_msg_english = "Sorry, an error occurred during processing. Please try again."
-        
-        user_language = detect_language(user_msg) if 'user_msg' in locals() else 'arabic'
-        error_msg = error_msg_arabic if user_language == 'arabic' else error_msg_english
-        
-        return jsonify({"error": error_msg}), 500
+    response = sse_response(generate())
+    # يستدعى عند انتهاء الاستجابة حتى لو لم يبدأ المولد (انقطاع قبل أول حدث)
+    response.call_on_close(pieces.close)
+    response.call_on_close(admission.release)
+    return response
 
 @app.route("/clear_history", methods=["POST"])
 def clear_history():
@@ -554,8 +1162,8 @@ def clear_history():
         data = request.json
         session_id = data.get("session_id", "default")
         
-        if session_id in conversations:
-            conversations[session_id]['messages'] = []
+        session_store.clear(session_id)
+        forget_history_summary(session_id)
         
         return jsonify({"message": "تم مسح تاريخ المحادثة", "session_id": session_id})
     
@@ -564,11 +1172,73 @@ def clear_history():
 
 @app.route("/get_session_info", methods=["GET"])
 def get_session_info():
-    """الحصول على معلومات الجلسة"""
+    """الحصول على معلومات الجلسة (قائمة الجلسات نفسها في /admin/sessions)"""
     return jsonify({
-        "active_sessions": len(conversations),
-        "sessions": list(conversations.keys())
+        "active_sessions": len(session_store),
+        "session_memory": session_store.memory_stats(),
+        "session_journal": session_journal.stats() if session_journal else None,
+        "completion_cache": completion_cache.stats(),
+        "single_flight": upstream_flights.stats(),
+        "upstream": upstream.stats(),
+        "admission": admission.stats(),
+        "jobs": job_runner.stats(),
+        "prompts": prompts.stats()
     })
 
+# ====== ADMIN ======
+def admin_authorized(headers):
+    if not ADMIN_TOKEN:
+        return False
+    scheme, _, token = headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode())
+
+def admin_page_query(args):
+    """معاملات /admin/sessions من query string. يرفع ValueError إذا كانت غير صالحة"""
+    def number(name, cast):
+        value = args.get(name)
+        return None if value in (None, "") else cast(value)
+
+    limit = number("limit", int) or ADMIN_PAGE_SIZE
+    if not 1 <= limit <= ADMIN_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {ADMIN_MAX_PAGE_SIZE}")
+    return {
+        "limit": limit,
+        "cursor": args.get("cursor") or None,
+        "active_after": number("active_after", float),
+        "active_before": number("active_before", float),
+        "min_messages": number("min_messages", int),
+        "max_messages": number("max_messages", int)
+    }
+
+def admin_denied():
+    return {"error": "غير مصرح"}, 401
+
+@app.route("/admin/sessions", methods=["GET"])
+def admin_sessions():
+    """صفحة من الجلسات، الأحدث نشاطاً أولاً. active_after/active_before بثواني epoch"""
+    if not admin_authorized(request.headers):
+        return admin_denied()
+    try:
+        page, next_cursor = session_store.list_sessions(**admin_page_query(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"sessions": page, "next_cursor": next_cursor})
+
+@app.route("/admin/sessions/stats", methods=["GET"])
+def admin_session_stats():
+    """إحصاءات الجلسات من العدادات (بدون المرور على الجلسات)"""
+    if not admin_authorized(request.headers):
+        return admin_denied()
+    return jsonify({
+        **session_store.session_stats(),
+        "memory": session_store.memory_stats(),
+        "journal": session_journal.stats() if session_journal else None
+    })
+
+if SESSION_SWEEP_INTERVAL > 0:
+    threading.Thread(target=sweep_expired_sessions, daemon=True).start()
+
+metrics.start_flusher()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=10000)
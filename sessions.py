@@ -0,0 +1,837 @@
+"""
+تخزين جلسات المحادثة بشكل قابل للتبديل.
+
+- MemorySessionStore: داخل العملية فقط (السلوك الافتراضي)، ومع SESSION_LOG_DIR
+  تحفظ التغييرات في سجل على القرص وتسترجع بعد إعادة التشغيل (journal.py)
+- SQLiteSessionStore: ملف SQLite بوضع WAL تتشاركه كل عمليات gunicorn على نفس
+  الجهاز، وأمامه طبقة LRU داخل كل عملية لتجنب قراءة الرسائل من القرص في كل طلب
+
+يتم الاختيار عبر SESSION_BACKEND=memory|sqlite
+
+AsyncSessionStore يغلف أي مخزن لاستخدامه من asyncio (نسخة ASGI).
+
+الجلسات في الذاكرة بصيغة مضغوطة: Session و Message بـ __slots__ بدل القواميس،
+أسماء الأدوار interned، ومحتوى الرسائل الأقدم من آخر SESSION_PLAIN_MESSAGES
+رسالة مضغوط بـ zlib (يفك عند القراءة). حجم كل جلسة محسوب بالبايت، والمخزن في
+الذاكرة يحذف الأقدم نشاطاً إذا تجاوز المجموع SESSION_MAX_BYTES.
+
+واجهة الإدارة: list_sessions صفحة من الجلسات (الأحدث نشاطاً أولاً) بمؤشر
+cursor وفلاتر آخر نشاط وعدد الرسائل، و session_stats إحصاءات (عدد الرسائل لكل
+جلسة، لغة آخر رسالة مستخدم) من عدادات تحدث مع كل تغيير بدل المرور على الجلسات.
+"""
+import asyncio
+import base64
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import timedelta
+
+from context import estimate_tokens, stored_message
+from language import detect_language
+
+# الرسائل الأقصر من هذا لا تستحق الضغط
+COMPRESS_MIN_CHARS = 256
+COMPRESS_LEVEL = 6
+
+# فهرس آخر نشاط في المخزن في الذاكرة: الجلسات مجمعة بالدقيقة
+ACTIVITY_BUCKET_SECONDS = 60
+
+
+# ====== التمثيل المضغوط ======
+class Message:
+    """رسالة مخزنة: تقرأ مثل قاموس {"role", "content", "tokens"}، والمحتوى نص أو zlib"""
+
+    __slots__ = ('role', 'data', 'tokens')
+
+    def __init__(self, role, content, tokens=None):
+        self.role = sys.intern(role)
+        self.data = content
+        self.tokens = tokens if tokens is not None else estimate_tokens(content)
+
+    @property
+    def content(self):
+        data = self.data
+        if isinstance(data, bytes):
+            return zlib.decompress(data).decode('utf-8')
+        return data
+
+    def __getitem__(self, key):
+        if key == "content":
+            return self.content
+        if key == "role":
+            return self.role
+        if key == "tokens":
+            return self.tokens
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def compress(self):
+        """ضغط المحتوى إذا كان يوفر ذاكرة. يرجع عدد البايتات الموفرة"""
+        data = self.data
+        if isinstance(data, bytes) or len(data) < COMPRESS_MIN_CHARS:
+            return 0
+        packed = zlib.compress(data.encode('utf-8'), COMPRESS_LEVEL)
+        saved = sys.getsizeof(data) - sys.getsizeof(packed)
+        if saved <= 0:
+            return 0
+        # إسناد واحد فالقارئ في خيط آخر يرى النص أو البايتات، لا حالة وسطى
+        self.data = packed
+        return saved
+
+    def nbytes(self):
+        return MESSAGE_BYTES + sys.getsizeof(self.data)
+
+
+class Session:
+    __slots__ = ('messages', 'last_activity', 'size', 'language')
+
+    def __init__(self, last_activity=None):
+        self.messages = []
+        self.last_activity = time.time() if last_activity is None else last_activity
+        self.size = SESSION_BYTES
+        # لغة آخر رسالة من المستخدم (None قبل أول رسالة)
+        self.language = None
+
+
+# الحجم الثابت لكل كائن بدون المحتوى، ولكل جلسة: الكائن والقائمة ومكانها في OrderedDict
+MESSAGE_BYTES = sys.getsizeof(object.__new__(Message)) + 8
+SESSION_BYTES = sys.getsizeof(object.__new__(Session)) + sys.getsizeof([]) + 100
+
+
+def compress_older(session, plain_messages):
+    """ضغط كل الرسائل عدا آخر plain_messages وتحديث حجم الجلسة"""
+    older = len(session.messages) - plain_messages
+    for message in session.messages[:max(older, 0)]:
+        session.size -= message.compress()
+
+
+def compact_session(messages, last_activity, plain_messages):
+    """جلسة مضغوطة من رسائل بصيغة قواميس (كما تخزن في SQLite)"""
+    session = Session(last_activity)
+    session.messages = [Message(m["role"], m["content"], m.get("tokens")) for m in messages]
+    session.size += sum(message.nbytes() for message in session.messages)
+    compress_older(session, plain_messages)
+    return session
+
+
+def last_user_language(messages):
+    for message in reversed(messages):
+        if message["role"] == "user":
+            return detect_language(message["content"])
+    return None
+
+
+# ====== واجهة الإدارة ======
+def encode_cursor(last_activity, session_id):
+    """مؤشر الصفحة التالية: آخر جلسة في الصفحة (الترتيب بآخر نشاط ثم المعرف، تنازلياً)"""
+    raw = json.dumps([last_activity, session_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        last_activity, session_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if isinstance(last_activity, (int, float)) and isinstance(session_id, str):
+            return float(last_activity), session_id
+    except (ValueError, TypeError):
+        pass
+    raise ValueError("invalid cursor")
+
+
+def session_matches(last_activity, message_count, active_after, active_before, min_messages, max_messages):
+    """active_after <= last_activity < active_before و min_messages <= message_count <= max_messages"""
+    return not (
+        (active_after is not None and last_activity < active_after)
+        or (active_before is not None and last_activity >= active_before)
+        or (min_messages is not None and message_count < min_messages)
+        or (max_messages is not None and message_count > max_messages)
+    )
+
+
+def session_summary(session_id, last_activity, message_count, language, size):
+    return {
+        "session_id": session_id,
+        "last_activity": last_activity,
+        "messages": message_count,
+        "language": language,
+        "bytes": size
+    }
+
+
+def stats_payload(active_sessions, histogram, languages):
+    """histogram: عدد الرسائل -> عدد الجلسات، languages: اللغة -> عدد الجلسات"""
+    return {
+        "active_sessions": active_sessions,
+        "messages": sum(count * sessions for count, sessions in histogram.items()),
+        "message_histogram": {str(count): histogram[count] for count in sorted(histogram)},
+        "languages": dict(sorted(languages.items()))
+    }
+
+
+def bump(counts, key, delta):
+    value = counts.get(key, 0) + delta
+    if value:
+        counts[key] = value
+    else:
+        counts.pop(key, None)
+
+
+class SessionStats:
+    """عدادات كل الجلسات: تطرح الجلسة قبل تعديلها وتضاف بعده"""
+
+    def __init__(self):
+        self.histogram = {}
+        self.languages = {}
+        self.messages = 0
+        self.compressed = 0
+
+    def add(self, session, sign=1):
+        count = len(session.messages)
+        bump(self.histogram, count, sign)
+        bump(self.languages, session.language or "none", sign)
+        self.messages += sign * count
+        self.compressed += sign * sum(1 for message in session.messages if isinstance(message.data, bytes))
+
+    def remove(self, session):
+        self.add(session, -1)
+
+
+def memory_stats(sessions, max_bytes=None, evicted=0):
+    messages = compressed = 0
+    total = 0
+    for session in sessions:
+        total += session.size
+        messages += len(session.messages)
+        compressed += sum(1 for message in session.messages if isinstance(message.data, bytes))
+    return {
+        "bytes": total,
+        "max_bytes": max_bytes,
+        "average_session_bytes": total // len(sessions) if sessions else 0,
+        "messages": messages,
+        "compressed_messages": compressed,
+        "evicted_for_memory": evicted
+    }
+
+
+class MemorySessionStore:
+    """الجلسات في OrderedDict مرتبة حسب آخر نشاط (الأقدم أولاً)، محدودة بالعدد وبالبايت"""
+
+    # كل عملية لها جلساتها
+    shared = False
+
+    def __init__(self, ttl, max_sessions, max_messages, max_bytes=None, plain_messages=2, journal=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.plain_messages = plain_messages
+        self.sessions = OrderedDict()
+        # دقيقة آخر نشاط -> [(آخر نشاط، المعرف)] مرتبة، فالصفحة بحث ثنائي ثم قراءة limit عنصراً
+        self.activity = {}
+        self.stats = SessionStats()
+        self.bytes = 0
+        self.evicted_for_memory = 0
+        self.lock = threading.Lock()
+        self.journal = journal
+        if journal is not None:
+            journal.start(ttl.total_seconds(), max_messages, plain_messages)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _index(self, session_id, session):
+        bucket = int(session.last_activity // ACTIVITY_BUCKET_SECONDS)
+        # النشاط الجديد غالباً الأحدث فيضاف في آخر القائمة
+        insort(self.activity.setdefault(bucket, []), (session.last_activity, session_id))
+
+    def _unindex(self, session_id, session):
+        bucket = int(session.last_activity // ACTIVITY_BUCKET_SECONDS)
+        keys = self.activity.get(bucket)
+        if keys is not None:
+            key = (session.last_activity, session_id)
+            position = bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                del keys[position]
+            if not keys:
+                del self.activity[bucket]
+
+    def _add(self, session_id, session):
+        self.sessions[session_id] = session
+        self.bytes += session.size + sys.getsizeof(session_id)
+        self.stats.add(session)
+        self._index(session_id, session)
+
+    def _drop(self, session_id):
+        session = self.sessions.pop(session_id)
+        self.bytes -= session.size + sys.getsizeof(session_id)
+        self.stats.remove(session)
+        self._unindex(session_id, session)
+
+    def _drop_oldest(self):
+        session_id, session = next(iter(self.sessions.items()))
+        self._drop(session_id)
+        if self.journal is not None:
+            # بدون سجل يعيد الاسترجاع رسائل جلسة حذفت لتجاوز الحد. بوقت آخر نشاطها
+            # فتنتهي في اللقطة مع TTL كما لو بقيت
+            self.journal.clear(session_id, session.last_activity)
+
+    def _resize(self, session, before):
+        """تسجيل تغير حجم جلسة وحذف الأقدم إذا تجاوز المجموع max_bytes"""
+        self.bytes += session.size - before
+        # الجلسة الحالية آخر الترتيب فلا تحذف إلا إذا كانت وحدها
+        while self.max_bytes and self.bytes > self.max_bytes and len(self.sessions) > 1:
+            self._drop_oldest()
+            self.evicted_for_memory += 1
+
+    def _create(self, session_id):
+        if self.journal is not None:
+            # ما قد يكون محفوظاً لنفس المعرف (جلسة حذفت بـ TTL أو لم تطلب بعد الاسترجاع)
+            # لا يسبق رسائل الجلسة الجديدة عند الاسترجاع
+            self.journal.forget(session_id)
+            self.journal.clear(session_id, time.time())
+        if session_id in self.sessions:
+            self._drop(session_id)
+        session = Session()
+        self._add(session_id, session)
+
+        while len(self.sessions) > self.max_sessions:
+            self._drop_oldest()
+
+        return session
+
+    def _touch(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return self._create(session_id)
+
+        self._unindex(session_id, session)
+        session.last_activity = time.time()
+        self._index(session_id, session)
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def _restore(self, session_id):
+        """جلسة محفوظة قبل إعادة التشغيل تعود للذاكرة عند أول طلب لها (خارج القفل لأنها قد تنتظر الاسترجاع)"""
+        if self.journal is None or session_id in self.sessions:
+            return
+        session = self.journal.load(session_id)
+        if session is None:
+            return
+        session.language = last_user_language(session.messages)
+        with self.lock:
+            if session_id in self.sessions:
+                return
+            self._add(session_id, session)
+            self._resize(session, session.size)
+            while len(self.sessions) > self.max_sessions:
+                self._drop_oldest()
+
+    def create(self, session_id):
+        with self.lock:
+            return self._create(session_id)
+
+    def get(self, session_id):
+        self._restore(session_id)
+        with self.lock:
+            return self._touch(session_id)
+
+    def append_message(self, session_id, role, content):
+        self._restore(session_id)
+        with self.lock:
+            session = self._touch(session_id)
+            if self.journal is not None:
+                self.journal.append(session_id, role, content, session.last_activity)
+            before = session.size
+            self.stats.remove(session)
+            message = Message(role, content)
+            session.messages.append(message)
+            if role == "user":
+                session.language = detect_language(content)
+            session.size += message.nbytes()
+
+            if len(session.messages) > self.max_messages:
+                removed = session.messages[:-self.max_messages]
+                session.size -= sum(message.nbytes() for message in removed)
+                session.messages = session.messages[-self.max_messages:]
+
+            compress_older(session, self.plain_messages)
+            self.stats.add(session)
+            self._resize(session, before)
+            return session
+
+    def clear(self, session_id):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.forget(session_id)
+                self.journal.clear(session_id, time.time())
+            session = self.sessions.get(session_id)
+            if session is not None:
+                before = session.size
+                self.stats.remove(session)
+                session.messages = []
+                session.language = None
+                session.size = SESSION_BYTES
+                self.stats.add(session)
+                self._resize(session, before)
+
+    def cleanup(self, max_evictions=None):
+        """حذف الجلسات المنتهية من بداية الترتيب فقط"""
+        cutoff = time.time() - self.ttl.total_seconds()
+        evicted = 0
+
+        with self.lock:
+            while self.sessions and (max_evictions is None or evicted < max_evictions):
+                session_id, session = next(iter(self.sessions.items()))
+                if session.last_activity >= cutoff:
+                    break
+                self._drop(session_id)
+                evicted += 1
+
+        return evicted
+
+    def list_sessions(self, limit, cursor=None, active_after=None, active_before=None,
+                      min_messages=None, max_messages=None):
+        """(صفحة الجلسات، مؤشر الصفحة التالية أو None). تمر فقط على دقائق النشاط داخل المدى، وتبدأ بعد المؤشر مباشرة"""
+        after = decode_cursor(cursor) if cursor else None
+        page = []
+        with self.lock:
+            if not self.activity:
+                return page, None
+            high = max(self.activity)
+            if active_before is not None:
+                high = min(high, int(active_before // ACTIVITY_BUCKET_SECONDS))
+            if after is not None:
+                high = min(high, int(after[0] // ACTIVITY_BUCKET_SECONDS))
+            low = min(self.activity)
+            if active_after is not None:
+                low = max(low, int(active_after // ACTIVITY_BUCKET_SECONDS))
+
+            for bucket in range(high, low - 1, -1):
+                keys = self.activity.get(bucket)
+                if not keys:
+                    continue
+                end = len(keys) if after is None else bisect_left(keys, after)
+                for position in range(end - 1, -1, -1):
+                    key = keys[position]
+                    last_activity, session_id = key
+                    session = self.sessions[session_id]
+                    if not session_matches(last_activity, len(session.messages), active_after, active_before,
+                                           min_messages, max_messages):
+                        continue
+                    page.append(session_summary(
+                        session_id, last_activity, len(session.messages), session.language, session.size
+                    ))
+                    if len(page) == limit:
+                        return page, encode_cursor(*key)
+        return page, None
+
+    def session_stats(self):
+        with self.lock:
+            return stats_payload(len(self.sessions), dict(self.stats.histogram), dict(self.stats.languages))
+
+    def memory_bytes(self):
+        return self.bytes
+
+    def memory_stats(self):
+        """من العدادات مباشرة، والمجموع يشمل مفاتيح الجلسات أيضاً"""
+        with self.lock:
+            return {
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "average_session_bytes": self.bytes // len(self.sessions) if self.sessions else 0,
+                "messages": self.stats.messages,
+                "compressed_messages": self.stats.compressed,
+                "evicted_for_memory": self.evicted_for_memory
+            }
+
+
+class SQLiteSessionStore:
+    """
+    جلسات مشتركة بين العمليات عبر SQLite (WAL).
+    كل تعديل يعطي الجلسة رقم إصدار جديد من عداد عام، فطبقة LRU المحلية تتحقق
+    من الإصدار بقراءة خفيفة وتعيد تحميل الرسائل فقط إذا غيّرتها عملية أخرى.
+    عدد الرسائل ولغة كل جلسة في أعمدة، وإحصاءاتها في session_stats تحدث في نفس معاملة كل تعديل.
+    """
+
+    # نفس الملف لكل عمليات gunicorn
+    shared = True
+
+    # لا نكتب last_activity في كل طلب، يكفي تحديثه إذا مضى عليه أكثر من هذا
+    TOUCH_INTERVAL = 10.0
+
+    def __init__(self, path, ttl, max_sessions, max_messages, cache_size=2048, plain_messages=2):
+        self.path = path
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.cache_size = cache_size
+        self.plain_messages = plain_messages
+        self.cache = OrderedDict()  # session_id -> (version, touched_at, session)
+        self.cache_lock = threading.Lock()
+        self._local = threading.local()
+
+        with self._connection() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    messages TEXT NOT NULL,
+                    last_activity REAL NOT NULL,
+                    version INTEGER NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    language TEXT
+                );
+                CREATE INDEX IF NOT EXISTS sessions_last_activity ON sessions (last_activity);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                INSERT OR IGNORE INTO meta (key, value) VALUES ('session_count', 0);
+                INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+                CREATE TABLE IF NOT EXISTS session_stats (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    sessions INTEGER NOT NULL,
+                    PRIMARY KEY (kind, key)
+                );
+            """)
+        self._write(self._migrate)
+
+    def _connection(self):
+        # اتصال لكل خيط ولكل عملية (gunicorn قد ينسخ العملية بعد الاستيراد)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'session_count'").fetchone()
+        return row[0] if row else 0
+
+    # ---------- LRU المحلية ----------
+    def _cache_get(self, session_id):
+        with self.cache_lock:
+            entry = self.cache.get(session_id)
+            if entry is not None:
+                self.cache.move_to_end(session_id)
+            return entry
+
+    def _cache_put(self, session_id, version, session):
+        with self.cache_lock:
+            self.cache[session_id] = (version, time.time(), session)
+            self.cache.move_to_end(session_id)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _cache_drop(self, session_id):
+        with self.cache_lock:
+            self.cache.pop(session_id, None)
+
+    # ---------- العمليات ----------
+    def _write(self, operation, *args):
+        """تنفيذ عملية كتابة داخل معاملة واحدة"""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = operation(db, *args)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _migrate(self, db):
+        """ملف من نسخة سابقة: إضافة الأعمدة وبناء الإحصاءات مرة واحدة"""
+        columns = {row[1] for row in db.execute("PRAGMA table_info(sessions)")}
+        if "message_count" in columns:
+            return
+        db.execute("ALTER TABLE sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+        db.execute("ALTER TABLE sessions ADD COLUMN language TEXT")
+        db.execute("UPDATE sessions SET message_count = json_array_length(messages)")
+        db.execute("DELETE FROM session_stats")
+        db.execute("""
+            INSERT INTO session_stats (kind, key, sessions)
+            SELECT 'messages', CAST(message_count AS TEXT), COUNT(*) FROM sessions GROUP BY message_count
+        """)
+        db.execute("""
+            INSERT INTO session_stats (kind, key, sessions)
+            SELECT 'language', 'none', COUNT(*) FROM sessions HAVING COUNT(*) > 0
+        """)
+
+    def _count(self, db, message_count, language, delta):
+        db.executemany(
+            "INSERT INTO session_stats (kind, key, sessions) VALUES (?, ?, ?) "
+            "ON CONFLICT (kind, key) DO UPDATE SET sessions = sessions + excluded.sessions",
+            [("messages", str(message_count), delta), ("language", language or "none", delta)]
+        )
+
+    def _next_version(self, db):
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def _insert(self, db, session_id, now):
+        version = self._next_version(db)
+        cursor = db.execute(
+            "INSERT OR IGNORE INTO sessions (session_id, messages, last_activity, version) VALUES (?, '[]', ?, ?)",
+            (session_id, now, version)
+        )
+        if cursor.rowcount:
+            db.execute("UPDATE meta SET value = value + 1 WHERE key = 'session_count'")
+            self._count(db, 0, None, 1)
+            self._enforce_max_sessions(db)
+        else:
+            message_count, language = db.execute(
+                "SELECT message_count, language FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            self._count(db, message_count, language, -1)
+            self._count(db, 0, None, 1)
+            db.execute(
+                "UPDATE sessions SET messages = '[]', last_activity = ?, version = ?, message_count = 0, "
+                "language = NULL WHERE session_id = ?",
+                (now, version, session_id)
+            )
+        return version
+
+    def _enforce_max_sessions(self, db):
+        overflow = len(self) - self.max_sessions
+        if overflow > 0:
+            self._delete_oldest(db, overflow, cutoff=None)
+
+    def _delete_oldest(self, db, limit, cutoff):
+        if cutoff is None:
+            query = "SELECT session_id, message_count, language FROM sessions ORDER BY last_activity LIMIT ?"
+            params = (limit,)
+        else:
+            query = ("SELECT session_id, message_count, language FROM sessions "
+                     "WHERE last_activity < ? ORDER BY last_activity LIMIT ?")
+            params = (cutoff, limit)
+
+        rows = db.execute(query, params).fetchall()
+        if rows:
+            db.executemany("DELETE FROM sessions WHERE session_id = ?", [(row[0],) for row in rows])
+            db.execute("UPDATE meta SET value = value - ? WHERE key = 'session_count'", (len(rows),))
+            for _, message_count, language in rows:
+                self._count(db, message_count, language, -1)
+        return len(rows)
+
+    def create(self, session_id):
+        now = time.time()
+        version = self._write(self._insert, session_id, now)
+
+        session = Session(now)
+        self._cache_put(session_id, version, session)
+        return session
+
+    def get(self, session_id):
+        now = time.time()
+        db = self._connection()
+        entry = self._cache_get(session_id)
+
+        touched = entry is None or now - entry[1] >= self.TOUCH_INTERVAL
+        if touched:
+            db.execute("UPDATE sessions SET last_activity = ? WHERE session_id = ?", (now, session_id))
+
+        # قراءة خفيفة للإصدار فقط، والرسائل لا تُقرأ إلا إذا تغيرت
+        row = db.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            self._cache_drop(session_id)
+            return self.create(session_id)
+
+        if entry is not None and row[0] == entry[0]:
+            if touched:
+                self._cache_put(session_id, entry[0], entry[2])
+            return entry[2]
+
+        row = db.execute(
+            "SELECT messages, version FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            self._cache_drop(session_id)
+            return self.create(session_id)
+
+        session = compact_session(json.loads(row[0]), now, self.plain_messages)
+        self._cache_put(session_id, row[1], session)
+        return session
+
+    def _append(self, db, session_id, role, content, now):
+        row = db.execute(
+            "SELECT messages, message_count, language FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            self._insert(db, session_id, now)
+            messages, message_count, language = [], 0, None
+        else:
+            messages, message_count, language = json.loads(row[0]), row[1], row[2]
+
+        messages.append(stored_message(role, content))
+        messages = messages[-self.max_messages:]
+        version = self._next_version(db)
+        self._count(db, message_count, language, -1)
+        if role == "user":
+            language = detect_language(content)
+        self._count(db, len(messages), language, 1)
+
+        db.execute(
+            "UPDATE sessions SET messages = ?, last_activity = ?, version = ?, message_count = ?, language = ? "
+            "WHERE session_id = ?",
+            (json.dumps(messages, ensure_ascii=False), now, version, len(messages), language, session_id)
+        )
+        return messages, version
+
+    def append_message(self, session_id, role, content):
+        now = time.time()
+        messages, version = self._write(self._append, session_id, role, content, now)
+
+        session = compact_session(messages, now, self.plain_messages)
+        self._cache_put(session_id, version, session)
+        return session
+
+    def _clear(self, db, session_id):
+        row = db.execute(
+            "SELECT message_count, language FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return
+        self._count(db, row[0], row[1], -1)
+        self._count(db, 0, None, 1)
+        db.execute(
+            "UPDATE sessions SET messages = '[]', version = ?, message_count = 0, language = NULL WHERE session_id = ?",
+            (self._next_version(db), session_id)
+        )
+
+    def clear(self, session_id):
+        self._write(self._clear, session_id)
+        self._cache_drop(session_id)
+
+    def cleanup(self, max_evictions=None):
+        cutoff = time.time() - self.ttl.total_seconds()
+        limit = -1 if max_evictions is None else max_evictions
+        return self._write(self._delete_oldest, limit, cutoff)
+
+    def list_sessions(self, limit, cursor=None, active_after=None, active_before=None,
+                      min_messages=None, max_messages=None):
+        """نفس MemorySessionStore.list_sessions بالفهرس على last_activity، و bytes حجم JSON المخزن"""
+        conditions, params = [], []
+        if cursor:
+            last_activity, session_id = decode_cursor(cursor)
+            conditions.append("(last_activity < ? OR (last_activity = ? AND session_id < ?))")
+            params += [last_activity, last_activity, session_id]
+        for condition, value in (("last_activity >= ?", active_after), ("last_activity < ?", active_before),
+                                 ("message_count >= ?", min_messages), ("message_count <= ?", max_messages)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        rows = self._connection().execute(
+            "SELECT session_id, last_activity, message_count, language, length(CAST(messages AS BLOB)) "
+            f"FROM sessions {where} ORDER BY last_activity DESC, session_id DESC LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+        page = [session_summary(*row) for row in rows]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+        return page, next_cursor
+
+    def session_stats(self):
+        histogram, languages = {}, {}
+        rows = self._connection().execute("SELECT kind, key, sessions FROM session_stats WHERE sessions > 0")
+        for kind, key, sessions in rows:
+            if kind == "messages":
+                histogram[int(key)] = sessions
+            else:
+                languages[key] = sessions
+        return stats_payload(len(self), histogram, languages)
+
+    def memory_bytes(self):
+        with self.cache_lock:
+            return sum(entry[2].size for entry in self.cache.values())
+
+    def memory_stats(self):
+        """ذاكرة طبقة LRU المحلية فقط (الجلسات نفسها على القرص)"""
+        with self.cache_lock:
+            sessions = [entry[2] for entry in self.cache.values()]
+        return memory_stats(sessions)
+
+
+class AsyncSessionStore:
+    """
+    واجهة async لمخزن الجلسات.
+    أقفال المخزن في الذاكرة قصيرة ولا تنتظر أي I/O فيستدعى مباشرة من حلقة الأحداث،
+    أما SQLite فقد ينتظر القرص أو قفل الكتابة فيُنفذ في خيط منفصل.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        # مع سجل الجلسات قد ينتظر أول طلب لجلسة قديمة انتهاء الاسترجاع ويقرأ من القرص
+        self.blocking = not isinstance(store, MemorySessionStore) or store.journal is not None
+
+    async def _call(self, method, *args):
+        if self.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def create(self, session_id):
+        return await self._call(self.store.create, session_id)
+
+    async def get(self, session_id):
+        return await self._call(self.store.get, session_id)
+
+    async def append_message(self, session_id, role, content):
+        return await self._call(self.store.append_message, session_id, role, content)
+
+    async def clear(self, session_id):
+        return await self._call(self.store.clear, session_id)
+
+    async def cleanup(self, max_evictions=None):
+        return await self._call(self.store.cleanup, max_evictions)
+
+    async def list_sessions(self, limit, cursor=None, active_after=None, active_before=None,
+                            min_messages=None, max_messages=None):
+        return await self._call(
+            self.store.list_sessions, limit, cursor, active_after, active_before, min_messages, max_messages
+        )
+
+    async def session_stats(self):
+        return await self._call(self.store.session_stats)
+
+    async def memory_stats(self):
+        return await self._call(self.store.memory_stats)
+
+
+def create_session_store(max_messages, journal=None):
+    """إنشاء مخزن الجلسات حسب متغيرات البيئة. journal (SessionJournal) للمخزن في الذاكرة فقط"""
+    backend = os.environ.get("SESSION_BACKEND", "memory")
+    ttl = timedelta(seconds=int(os.environ.get("SESSION_TTL_SECONDS", 3600)))
+    max_sessions = int(os.environ.get("MAX_SESSIONS", 100000))
+    # آخر رسالتين (السؤال والرد الأخيران) تبقيان نصاً عادياً وما قبلهما يضغط
+    plain_messages = int(os.environ.get("SESSION_PLAIN_MESSAGES", 2))
+
+    if backend == "sqlite":
+        if journal is not None:
+            raise ValueError("SESSION_LOG_DIR works with SESSION_BACKEND=memory only (SQLite already persists)")
+        return SQLiteSessionStore(
+            os.environ.get("SESSION_DB_PATH", "sessions.db"),
+            ttl,
+            max_sessions,
+            max_messages,
+            cache_size=int(os.environ.get("SESSION_CACHE_SIZE", 2048)),
+            plain_messages=plain_messages
+        )
+
+    if backend != "memory":
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+
+    # 0 = بدون حد بالبايت
+    max_bytes = int(os.environ.get("SESSION_MAX_BYTES", 256 * 1024 * 1024)) or None
+    return MemorySessionStore(ttl, max_sessions, max_messages, max_bytes, plain_messages, journal)
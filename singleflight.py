@@ -0,0 +1,355 @@
+"""
+دمج الطلبات المتطابقة المتزامنة إلى Groq (single-flight).
+
+عندما يرسل عدة مستخدمين نفس السؤال في نفس اللحظة (نفس برومبت النظام والتاريخ
+والرسالة وإعدادات التوليد) يُرسل طلب واحد فقط، وينتظر الباقون نتيجته.
+الخطأ يصل لكل المنتظرين، والمنتظر لا ينتظر أكثر من timeout.
+
+- SingleFlight: للخيوط (Flask/gunicorn مع --threads)
+- AsyncSingleFlight: لـ asyncio (asgi.py)
+
+لكل منهما do() للرد الكامل و stream() للبث: البث يقرؤه خيط/مهمة واحدة من Groq
+ويخزن القطع، وكل مشترك يقرأ القطع من البداية حتى لو انضم متأخراً. المشترك يجب
+أن يغلق اشتراكه (close/aclose) عند انتهاء الاستجابة حتى لو لم يقرأ شيئاً،
+وإذا غادر الجميع يتوقف القارئ.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+
+
+def flight_key(params):
+    """مفتاح الطلب: كل ما يؤثر على الرد (النموذج، الرسائل، إعدادات التوليد)"""
+    messages = params.get("messages")
+    version = getattr(messages, "version", None)
+    if version is not None:
+        # بادئة القالب (برومبت النظام) يمثلها إصدارها بدل ترميز نصها في كل طلب
+        params = {**params, "messages": [version, *messages[messages.prefix_length:]]}
+    data = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def chunk_text(chunk):
+    """نص قطعة بث chat.completions"""
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+class FlightTimeout(TimeoutError):
+    pass
+
+
+def shared_error(error):
+    """الخطأ الذي يصل للمشتركين: إلغاء القائد لا يجب أن يظهر كإلغاء عند الآخرين"""
+    if isinstance(error, Exception):
+        return error
+    return RuntimeError(f"upstream call interrupted: {error!r}")
+
+
+class SharedStream:
+    """قطع بث واحد من Groq يقرؤها عدة مشتركين"""
+
+    def __init__(self):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        # اشتراكات لم تغلق بعد (مجموعة حتى لا يحسب إغلاق نفس الاشتراك مرتين)
+        self.members = set()
+        # يصبح True إذا غادر كل المشتركين قبل انتهاء البث فيتوقف القارئ
+        self.cancelled = False
+
+    def leave(self, member):
+        self.members.discard(member)
+        if not self.members and not self.done:
+            self.cancelled = True
+
+
+class Subscription:
+    """
+    قطع البث لمشترك واحد (للقراءة بـ for). close() يخرجه من البث حتى لو لم تبدأ
+    القراءة أبداً (انقطع الاتصال قبل أول قطعة فلم يعمل finally في المولد).
+    """
+
+    def __init__(self, flight, shared):
+        self.flight = flight
+        self.shared = shared
+        self.pieces = flight._read(shared, self)
+
+    def __iter__(self):
+        return self.pieces
+
+    def close(self):
+        self.pieces.close()
+        self.flight._leave(self.shared, self)
+
+
+class AsyncSubscription:
+    """مثل Subscription لكن للقراءة بـ async for والإغلاق بـ aclose()"""
+
+    def __init__(self, flight, shared):
+        self.flight = flight
+        self.shared = shared
+        self.pieces = flight._read(shared, self)
+
+    def __aiter__(self):
+        return self.pieces
+
+    async def aclose(self):
+        await self.pieces.aclose()
+        self.flight._leave(self.shared, self)
+
+
+class FlightStats:
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+
+    def stats(self):
+        return {"upstream_calls": self.leaders, "coalesced": self.followers}
+
+
+# ====== خيوط ======
+class Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(FlightStats):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+        self.calls = {}
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    def do(self, key, fn):
+        """تنفيذ fn مرة واحدة لكل المتزامنين بنفس المفتاح"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except BaseException as e:
+                call.error = shared_error(e)
+                raise
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.event.set()
+
+        if not call.event.wait(self.timeout):
+            raise FlightTimeout(f"single-flight wait exceeded {self.timeout}s")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stream(self, key, open_stream):
+        """
+        الاشتراك في بث مشترك. open_stream يفتح بث Groq (يستدعى من القائد فقط،
+        وخطأ الاتصال يظهر عنده مباشرة). يرجع Subscription لنصوص القطع.
+        """
+        with self.lock:
+            shared = self.streams.get(key)
+            leader = shared is None or shared.cancelled
+            if leader:
+                shared = self.streams[key] = SharedStream()
+                self.leaders += 1
+            else:
+                self.followers += 1
+            subscription = Subscription(self, shared)
+            shared.members.add(subscription)
+
+        if leader:
+            try:
+                upstream = open_stream()
+            except BaseException as e:
+                self._finish(key, shared, shared_error(e))
+                raise
+            threading.Thread(target=self._pump, args=(key, shared, upstream), daemon=True).start()
+
+        return subscription
+
+    def _pump(self, key, shared, upstream):
+        error = None
+        try:
+            for chunk in upstream:
+                if shared.cancelled:
+                    break
+                text = chunk_text(chunk)
+                if text:
+                    with self.lock:
+                        shared.pieces.append(text)
+                        self.changed.notify_all()
+        except BaseException as e:
+            error = shared_error(e)
+        finally:
+            upstream.close()
+            self._finish(key, shared, error)
+
+    def _finish(self, key, shared, error):
+        with self.lock:
+            shared.done = True
+            shared.error = error
+            if self.streams.get(key) is shared:
+                del self.streams[key]
+            self.changed.notify_all()
+
+    def _leave(self, shared, member):
+        with self.lock:
+            shared.leave(member)
+
+    def _read(self, shared, member):
+        index = 0
+        try:
+            while True:
+                with self.lock:
+                    ready = self.changed.wait_for(lambda: index < len(shared.pieces) or shared.done, self.timeout)
+                    if not ready:
+                        raise FlightTimeout(f"single-flight stream idle for {self.timeout}s")
+                    pieces = shared.pieces[index:]
+                    done, error = shared.done, shared.error
+
+                index += len(pieces)
+                yield from pieces
+
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._leave(shared, member)
+
+
+# ====== asyncio ======
+class AsyncSharedStream(SharedStream):
+    def __init__(self):
+        super().__init__()
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        # حدث جديد لكل تغيير، فالمنتظرون على القديم يستيقظون كلهم
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class AsyncSingleFlight(FlightStats):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+        self.calls = {}
+        self.streams = {}
+
+    def _forget(self, registry, key, item):
+        if registry.get(key) is item:
+            del registry[key]
+
+    async def do(self, key, fn):
+        """
+        تنفيذ coroutine fn() مرة واحدة لكل المتزامنين بنفس المفتاح.
+        الطلب يعمل كمهمة مستقلة فلا يلغى إذا قطع القائد اتصاله والباقون ينتظرون.
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(self._task_done(key))
+            self.leaders += 1
+            return await asyncio.shield(task)
+
+        self.followers += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            raise FlightTimeout(f"single-flight wait exceeded {self.timeout}s") from None
+
+    def _task_done(self, key):
+        def done(task):
+            self._forget(self.calls, key, task)
+            # قراءة الخطأ حتى لا يطبع asyncio تحذيراً إذا لم يبق أحد ينتظر
+            if not task.cancelled():
+                task.exception()
+        return done
+
+    async def stream(self, key, open_stream):
+        """مثل SingleFlight.stream لكن open_stream coroutine ويرجع AsyncSubscription"""
+        shared = self.streams.get(key)
+        if shared is None or shared.cancelled:
+            shared = self.streams[key] = AsyncSharedStream()
+            subscription = AsyncSubscription(self, shared)
+            shared.members.add(subscription)
+            self.leaders += 1
+            try:
+                upstream = await open_stream()
+            except BaseException as e:
+                self._finish(key, shared, shared_error(e))
+                raise
+            asyncio.ensure_future(self._pump(key, shared, upstream))
+        else:
+            subscription = AsyncSubscription(self, shared)
+            shared.members.add(subscription)
+            self.followers += 1
+
+        return subscription
+
+    async def _pump(self, key, shared, upstream):
+        error = None
+        try:
+            async for chunk in upstream:
+                if shared.cancelled:
+                    break
+                text = chunk_text(chunk)
+                if text:
+                    shared.pieces.append(text)
+                    shared.notify()
+        except BaseException as e:
+            error = shared_error(e)
+        finally:
+            await upstream.close()
+            self._finish(key, shared, error)
+
+    def _finish(self, key, shared, error):
+        shared.done = True
+        shared.error = error
+        self._forget(self.streams, key, shared)
+        shared.notify()
+
+    def _leave(self, shared, member):
+        shared.leave(member)
+
+    async def _read(self, shared, member):
+        index = 0
+        try:
+            while True:
+                if index >= len(shared.pieces) and not shared.done:
+                    try:
+                        await asyncio.wait_for(shared.changed.wait(), self.timeout)
+                    except asyncio.TimeoutError:
+                        raise FlightTimeout(f"single-flight stream idle for {self.timeout}s") from None
+                    continue
+
+                pieces = shared.pieces[index:]
+                index += len(pieces)
+                for piece in pieces:
+                    yield piece
+
+                if shared.done and index >= len(shared.pieces):
+                    if shared.error is not None:
+                        raise shared.error
+                    return
+        finally:
+            shared.leave(member)
@@ -0,0 +1,515 @@
+"""
+طبقة الاتصال بـ Groq: كل استدعاء chat.completions.create يمر من هنا.
+
+- اتصالات keep-alive بحد معروف (UPSTREAM_MAX_CONNECTIONS) بدل إعدادات المكتبة
+- مهلة كلية لكل طلب (UPSTREAM_DEADLINE) تشمل كل المحاولات وقراءة جسم الرد والبث
+  حتى آخر قطعة (DeadlineStream)، فلا يبقى عامل معلقاً على رد بطيء أو يصل قطرة قطرة
+- إعادة المحاولة عند 429/5xx وأخطاء الاتصال بتأخير عشوائي متزايد، وباحترام
+  Retry-After إذا كان ضمن المهلة (المكتبة نفسها لا تعيد المحاولة: max_retries=0)
+- تحوط اختياري (UPSTREAM_HEDGE=1): إذا تأخر الرد أكثر من p95 للردود الأخيرة
+  يرسل طلب ثانٍ ويؤخذ أول رد ناجح
+- قاطع دائرة: بعد UPSTREAM_BREAKER_THRESHOLD فشلاً متتالياً ترفض الطلبات فوراً
+  (CircuitOpen) لمدة UPSTREAM_BREAKER_COOLDOWN ثانية ثم يمر طلب تجريبي واحد.
+  الخطأ يصل لمسارات /chat فترد برسائل ERROR_MESSAGES المعتادة
+
+- Upstream: للخيوط (server.py)
+- AsyncUpstream: لـ asyncio (asgi.py)
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import httpx
+from groq import (
+    APIConnectionError, APIStatusError, AsyncGroq, DefaultAsyncHttpxClient, DefaultHttpxClient, Groq
+)
+
+# نفس الحالات التي تعيدها مكتبة groq عادة
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpen(RuntimeError):
+    pass
+
+
+class UpstreamDeadline(TimeoutError):
+    pass
+
+
+# (نهاية المهلة بـ time.monotonic، UPSTREAM_DEADLINE) للمحاولة الحالية، يقرؤها deadline_hook
+# في نفس الخيط أو المهمة التي ترسل الطلب
+CALL_DEADLINE = contextvars.ContextVar("upstream_call_deadline", default=None)
+
+
+class DeadlineStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """
+    جسم رد httpx يتوقف بـ UpstreamDeadline إذا انتهت مهلة الاستدعاء أثناء قراءته.
+    مع asyncio كل قراءة محدودة بالوقت الباقي. مع الخيوط تفحص المهلة مع كل قطعة،
+    وأطول انتظار لقطعة واحدة هو مهلة القراءة (الوقت الباقي عند وصول الترويسات)
+    """
+
+    def __init__(self, stream, deadline, seconds):
+        self.stream = stream
+        self.deadline = deadline
+        self.seconds = seconds
+
+    def expired(self):
+        return UpstreamDeadline(f"Groq call exceeded {self.seconds}s while reading the response")
+
+    def __iter__(self):
+        try:
+            for chunk in self.stream:
+                if time.monotonic() >= self.deadline:
+                    raise self.expired()
+                yield chunk
+        except httpx.TimeoutException as e:
+            # مهلة القراءة نفسها انتهت مع المهلة الكلية
+            if time.monotonic() < self.deadline:
+                raise
+            raise self.expired() from e
+
+    async def __aiter__(self):
+        chunks = self.stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, self.deadline - time.monotonic()))
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise self.expired() from None
+            except httpx.TimeoutException as e:
+                if time.monotonic() < self.deadline:
+                    raise
+                raise self.expired() from e
+            yield chunk
+
+    def close(self):
+        self.stream.close()
+
+    async def aclose(self):
+        await self.stream.aclose()
+
+
+def deadline_hook(response):
+    """httpx response hook: جسم الرد (والبث) يقرأ ضمن مهلة الاستدعاء"""
+    call = CALL_DEADLINE.get()
+    if call is None:
+        return
+    deadline, seconds = call
+    timeout = response.request.extensions.get("timeout")
+    if timeout:
+        # httpcore يقرأ مهلة القراءة مرة واحدة عند بدء قراءة الجسم، أي بعد هذا
+        response.request.extensions["timeout"] = {**timeout, "read": max(0.001, deadline - time.monotonic())}
+    response.stream = DeadlineStream(response.stream, deadline, seconds)
+
+
+async def async_deadline_hook(response):
+    deadline_hook(response)
+
+
+def deadline_cause(error):
+    """UpstreamDeadline من قراءة الجسم تصل مغلفة في APIConnectionError من مكتبة groq"""
+    cause = getattr(error, "__cause__", None)
+    return cause if isinstance(cause, UpstreamDeadline) else error
+
+
+def retry_after(error):
+    """ثواني الانتظار التي طلبها Groq في ترويسات الرد، أو None"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    milliseconds = headers.get("retry-after-ms")
+    if milliseconds:
+        try:
+            return float(milliseconds) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limited(error):
+    return isinstance(error, APIStatusError) and error.status_code == 429
+
+
+def is_retryable(error):
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRY_STATUSES
+    # يشمل APITimeoutError
+    return isinstance(error, APIConnectionError)
+
+
+def close_quietly(result):
+    """إغلاق بث خسر سباق التحوط (الرد العادي لا يحتاج إغلاقاً)"""
+    close = getattr(result, "close", None)
+    if close is None:
+        return
+    try:
+        closed = close()
+        if asyncio.iscoroutine(closed):
+            asyncio.ensure_future(closed)
+    except Exception as e:
+        print(f"Upstream close error: {e}")
+
+
+def close_loser(future):
+    if not future.cancelled() and future.exception() is None:
+        close_quietly(future.result())
+
+
+class CircuitBreaker:
+    """مغلق -> مفتوح بعد threshold فشلاً متتالياً -> نصف مفتوح بعد cooldown (طلب تجريبي واحد)"""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        if self.threshold <= 0:
+            return
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                self.rejected += 1
+                raise CircuitOpen("Groq circuit breaker is open")
+            self.probing = True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.threshold > 0 and self.failures >= self.threshold:
+                if self.opened_at is None:
+                    self.trips += 1
+                # فشل الطلب التجريبي يعيد فترة الانتظار من جديد
+                self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """الطلب التجريبي انقطع (إلغاء) بدون نتيجة"""
+        with self.lock:
+            self.probing = False
+
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+
+class LatencyWindow:
+    """أزمنة آخر الطلبات الناجحة لحساب تأخير التحوط"""
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, fraction):
+        with self.lock:
+            if len(self.samples) < self.MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class UpstreamPolicy:
+    """الإعدادات والحالة المشتركة بين Upstream و AsyncUpstream"""
+
+    def __init__(self, client, deadline, connect_timeout, max_retries, backoff_base, backoff_max,
+                 hedge, hedge_min_delay, breaker_threshold, breaker_cooldown):
+        self.client = client
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        # فتح البث (حتى الترويسات) أسرع بكثير من رد كامل فلكل منهما نافذته
+        self.latencies = {False: LatencyWindow(), True: LatencyWindow()}
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def hedge_delay(self, stream):
+        if not self.hedge:
+            return None
+        p95 = self.latencies[stream].percentile(0.95)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    def timeout(self, remaining):
+        return httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining))
+
+    def retry_delay(self, error, attempt, deadline):
+        """التأخير قبل المحاولة التالية، أو None إذا لا يجب إعادة المحاولة"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            # full jitter
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def finish(self, error):
+        """تسجيل نتيجة الاستدعاء في قاطع الدائرة"""
+        if error is None:
+            self.breaker.success()
+        elif not isinstance(error, Exception):
+            self.breaker.abandon()
+        elif is_retryable(error) or isinstance(error, UpstreamDeadline):
+            self.failures += 1
+            self.breaker.failure()
+        else:
+            # 400 وما شابه: Groq يعمل والخطأ في الطلب
+            self.breaker.success()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "breaker": self.breaker.state(),
+            "breaker_trips": self.breaker.trips,
+            "breaker_rejected": self.breaker.rejected
+        }
+
+
+# ====== خيوط ======
+class Upstream(UpstreamPolicy):
+    def __init__(self, client, max_connections, **settings):
+        super().__init__(client, **settings)
+        # الطلب والتحوط يعملان في خيوط منفصلة حتى يمكن انتظار أسرعهما
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2 * max_connections, thread_name_prefix="upstream"
+        ) if self.hedge else None
+
+    def create(self, **params):
+        """مثل client.chat.completions.create لكن بالمهلة والمحاولات والتحوط وقاطع الدائرة"""
+        self.breaker.allow()
+        self.calls += 1
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise UpstreamDeadline(f"Groq call exceeded {self.deadline}s")
+                result = self._attempt(params, remaining)
+            except BaseException as caught:
+                e = deadline_cause(caught)
+                delay = self.retry_delay(e, attempt, deadline) if isinstance(e, Exception) else None
+                if delay is None:
+                    self.finish(e)
+                    raise e
+                self.retries += 1
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self.finish(None)
+            return result
+
+    def _call(self, params, remaining):
+        started = time.monotonic()
+        token = CALL_DEADLINE.set((started + remaining, self.deadline))
+        try:
+            result = self.client.chat.completions.create(**params, timeout=self.timeout(remaining))
+        finally:
+            CALL_DEADLINE.reset(token)
+        self.latencies[bool(params.get("stream"))].add(time.monotonic() - started)
+        return result
+
+    def _attempt(self, params, remaining):
+        delay = self.hedge_delay(bool(params.get("stream")))
+        if delay is None or delay >= remaining:
+            return self._call(params, remaining)
+
+        first = self.executor.submit(self._call, params, remaining)
+        done, _ = concurrent.futures.wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        self.hedges += 1
+        second = self.executor.submit(self._call, params, remaining - delay)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                if future is second:
+                    self.hedge_wins += 1
+                # الخاسر لا يمكن إيقافه في خيط، فيغلق رده (إن كان بثاً) عند انتهائه
+                for other in pending | (done - {future}):
+                    other.add_done_callback(close_loser)
+                return future.result()
+        raise error
+
+
+# ====== asyncio ======
+class AsyncUpstream(UpstreamPolicy):
+    async def create(self, **params):
+        self.breaker.allow()
+        self.calls += 1
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise UpstreamDeadline(f"Groq call exceeded {self.deadline}s")
+                result = await self._attempt(params, remaining)
+            except BaseException as caught:
+                e = deadline_cause(caught)
+                delay = self.retry_delay(e, attempt, deadline) if isinstance(e, Exception) else None
+                if delay is None:
+                    self.finish(e)
+                    raise e
+                self.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self.finish(None)
+            return result
+
+    async def _call(self, params, remaining):
+        started = time.monotonic()
+        token = CALL_DEADLINE.set((started + remaining, self.deadline))
+        try:
+            result = await asyncio.wait_for(
+                self.client.chat.completions.create(**params, timeout=self.timeout(remaining)), remaining
+            )
+        except asyncio.TimeoutError:
+            raise UpstreamDeadline(f"Groq call exceeded {self.deadline}s") from None
+        finally:
+            CALL_DEADLINE.reset(token)
+        self.latencies[bool(params.get("stream"))].add(time.monotonic() - started)
+        return result
+
+    async def _attempt(self, params, remaining):
+        delay = self.hedge_delay(bool(params.get("stream")))
+        if delay is None or delay >= remaining:
+            return await self._call(params, remaining)
+
+        first = asyncio.ensure_future(self._call(params, remaining))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            self.hedges += 1
+            second = asyncio.ensure_future(self._call(params, remaining - delay))
+            pending.add(second)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    if task is second:
+                        self.hedge_wins += 1
+                    for other in done - {task}:
+                        if other.exception() is None:
+                            close_quietly(other.result())
+                    return task.result()
+            raise error
+        finally:
+            # هنا يمكن إلغاء الطلب الخاسر فعلاً
+            for task in pending:
+                task.cancel()
+
+
+# ====== الإنشاء من متغيرات البيئة ======
+def upstream_settings():
+    return {
+        "deadline": float(os.environ.get("UPSTREAM_DEADLINE", 45)),
+        "connect_timeout": float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 5)),
+        "max_retries": int(os.environ.get("UPSTREAM_MAX_RETRIES", 2)),
+        "backoff_base": float(os.environ.get("UPSTREAM_BACKOFF_BASE", 0.25)),
+        "backoff_max": float(os.environ.get("UPSTREAM_BACKOFF_MAX", 4)),
+        "hedge": os.environ.get("UPSTREAM_HEDGE", "0") == "1",
+        "hedge_min_delay": float(os.environ.get("UPSTREAM_HEDGE_MIN_DELAY", 0.5)),
+        "breaker_threshold": int(os.environ.get("UPSTREAM_BREAKER_THRESHOLD", 5)),
+        "breaker_cooldown": float(os.environ.get("UPSTREAM_BREAKER_COOLDOWN", 30))
+    }
+
+
+def connection_limits(max_connections):
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                        keepalive_expiry=60)
+
+
+def create_upstream(api_key, max_connections=None):
+    """
+    عميل Groq متزامن. عدد الاتصالات الافتراضي يكفي خيوط عامل gunicorn واحد
+    (كل خيط طلب واحد، والتحوط قد يضاعفه)
+    """
+    if max_connections is None:
+        max_connections = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 32))
+    client = Groq(
+        api_key=api_key,
+        max_retries=0,
+        http_client=DefaultHttpxClient(limits=connection_limits(max_connections),
+                                       event_hooks={"response": [deadline_hook]})
+    )
+    return Upstream(client, max_connections, **upstream_settings())
+
+
+def create_async_upstream(api_key, max_connections=None):
+    """عميل Groq غير متزامن (عملية uvicorn واحدة تخدم مئات المحادثات)"""
+    if max_connections is None:
+        max_connections = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 512))
+    client = AsyncGroq(
+        api_key=api_key,
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(limits=connection_limits(max_connections),
+                                            event_hooks={"response": [async_deadline_hook]})
+    )
+    return AsyncUpstream(client, **upstream_settings())